@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmarks for the toolkit's hot paths.
+
+Usage:
+    python bench.py prs [--size MB] [--repeat N] [--file BLOB]
+    python bench.py prs-compress [--size MB] [--levels 1,6,9] [--file BLOB]
+    python bench.py scan [--size MB] [--file BLOB] [--align SPEC] [--workers N]
+    python bench.py afs [--entries N] [--file AFS] [--extract] [--workers N]
+
+`prs` decodes synthetic PRS streams (or every PRS block found in BLOB) with the
+previous closure-based decoders and with prs.py, checks that the outputs are
+byte-identical and prints MB/s of decompressed output for both.
+
+`prs-compress` encodes the output of a synthetic stream (or BLOB itself) at each
+level, checks that it decodes back and prints MB/s of input and the ratio.
+
+`scan` finds every carve signature once with one find() loop per signature and
+once with scanners.HitTable, checks that the offsets agree and prints MB/s.
+With --align it also times the aligned NumPy mode (pass a multi-GB --file to
+see the speedup on real disc images).  With --workers it also times
+HitTable.for_file() splitting the file (the random input is written to a temporary
+file first) into spans scanned on N processes.
+
+`afs` opens a synthetic AFS archive of N entries (or AFS) with scanners.afs_toc(),
+header and table only, scoring the TOC layouts with NumPy and in pure Python,
+and checks that both pick the same entries.  With --extract it also copies every
+entry out once with a read()/write() loop and once with EntryReader.extract()
+(kernel-side copies on N threads), checks the files match and prints MB/s.
+"""
+from __future__ import annotations
+import argparse, random, sys, tempfile, time
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+if str(BASE) not in sys.path:
+    sys.path.insert(0, str(BASE))
+
+import prs
+import scanners
+
+
+# --------------------------- previous decoders (reference) ---------------------------
+def _ref_basic(buf: bytes, start: int = 0):
+    if buf[start:start+3] != b'PRS':
+        return None, 0
+    i = start + 3
+    out = bytearray()
+    bit = 0; cmd = 0
+    def getbit():
+        nonlocal bit, cmd, i
+        if bit == 0:
+            if i >= len(buf): return 0
+            cmd = buf[i]; i += 1; bit = 8
+        b = cmd & 1; cmd >>= 1; bit -= 1; return b
+    def getbyte():
+        nonlocal i
+        if i >= len(buf): return 0
+        b = buf[i]; i += 1; return b
+    while i < len(buf):
+        if getbit():
+            out.append(getbyte())
+        else:
+            if getbit():
+                a = getbyte(); b = getbyte()
+                off = ((b << 8) | a) >> 3
+                amount = (a & 7)
+                amount = (getbyte() + 1) if amount == 0 else (amount + 2)
+                sp = len(out) - 0x2000 + off
+            else:
+                amount = (getbit() << 1) | getbit()
+                off = getbyte()
+                amount += 2
+                sp = len(out) - 0x100 + off
+            for _ in range(amount):
+                if sp < 0: out.append(0)
+                elif sp < len(out): out.append(out[sp])
+                else: out.append(0)
+                sp += 1
+    return bytes(out), i - start
+
+def _ref_nights(buf: bytes, start: int = 0, ext: bool = False):
+    if buf[start:start+3] != b'PRS':
+        return None, 0
+    i = start + 3
+    out = bytearray()
+    bitbuf = 0; bits = 0
+    def getbit():
+        nonlocal bitbuf, bits, i
+        if bits == 0:
+            if i >= len(buf): return 0
+            bitbuf = buf[i]; i += 1; bits = 8
+        b = bitbuf & 1; bitbuf >>= 1; bits -= 1; return b
+    while True:
+        if getbit():
+            if i >= len(buf): break
+            out.append(buf[i]); i += 1
+        else:
+            if getbit():
+                if i+2 > len(buf): break
+                a = buf[i]; b = buf[i+1]; i += 2
+                offs = ((b & 0xF0) << 4) | a
+                cnt  = (b & 0x0F) + 3
+                if offs == 0: break
+            else:
+                if i+3 > len(buf): break
+                a = buf[i]; b = buf[i+1]; c = buf[i+2]; i += 3
+                if ext:
+                    cnt  = (a | ((b & 0xE0) << 3)) + 2
+                    offs = ((b & 0x1F) << 8) | c
+                else:
+                    cnt  = ((c & 0xE0) >> 5) + 2
+                    offs = ((c & 0x1F) << 8) | b
+                if offs == 0: return None, 0
+            src = len(out) - offs
+            if src < 0: return None, 0
+            for _ in range(cnt):
+                out.append(out[src]); src += 1
+    return bytes(out), i - start
+
+_REF = {"basic": _ref_basic,
+        "nights": _ref_nights,
+        "nights_ext": lambda buf, start=0: _ref_nights(buf, start, True)}
+
+
+# --------------------------- synthetic streams ---------------------------
+class _BitWriter:
+    """Control bits interleaved with data bytes, the way all PRS variants read them."""
+    def __init__(self):
+        self.buf = bytearray(b"PRS"); self.ctl = -1; self.nbit = 8
+    def bit(self, b: int):
+        if self.nbit == 8:
+            self.ctl = len(self.buf); self.buf.append(0); self.nbit = 0
+        self.buf[self.ctl] |= (b & 1) << self.nbit; self.nbit += 1
+    def data(self, *bs: int):
+        self.buf.extend(bs)
+
+def synth_stream(variant: str, out_size: int, seed: int = 0) -> bytes:
+    """Random but valid command stream producing about `out_size` bytes of texture-like data."""
+    rnd = random.Random(seed); w = _BitWriter(); produced = 0
+    while produced < out_size:
+        r = rnd.random()
+        if produced < 16 or r < 0.35:
+            w.bit(1); w.data(rnd.getrandbits(8)); produced += 1
+            continue
+        w.bit(0)
+        if variant == "basic":
+            if r < 0.6:   # short ref
+                w.bit(0); n = rnd.randint(2, 5); d = rnd.randint(1, min(0x100, produced))
+                n2 = n - 2; w.bit(n2 >> 1); w.bit(n2 & 1); w.data(0x100 - d)
+            else:         # long ref, sometimes with an explicit count byte
+                w.bit(1); d = rnd.randint(1, min(0x1FFF, produced))
+                n = rnd.choice((rnd.randint(3, 9), rnd.randint(10, 256)))
+                word = ((0x2000 - d) << 3) | (n - 2 if n <= 9 else 0)
+                w.data(word & 0xFF, word >> 8)
+                if n > 9: w.data(n - 1)
+        else:
+            d = rnd.randint(1, min(0xFFF, produced))
+            if r < 0.6:   # 2-byte form
+                w.bit(1); n = rnd.randint(3, 18)
+                w.data(d & 0xFF, ((d >> 4) & 0xF0) | (n - 3))
+            else:         # 3-byte form
+                w.bit(0)
+                if variant == "nights":
+                    n = rnd.randint(2, 9); w.data(0, d & 0xFF, ((n - 2) << 5) | (d >> 8))
+                else:
+                    n = rnd.randint(2, 600); n2 = n - 2
+                    w.data(n2 & 0xFF, ((n2 >> 8) << 5) | (d >> 8), d & 0xFF)
+        produced += n
+    # stop code (basic: long ref with word 0, NiGHTS: 2-byte form with offset 0)
+    w.bit(0)
+    if variant == "basic": w.bit(1); w.data(0, 0)
+    else: w.bit(1); w.data(0, 0)
+    return bytes(w.buf)
+
+
+# --------------------------- runner ---------------------------
+def _time(fn, buf, starts, repeat):
+    best = None; total = 0; outs = []
+    for _ in range(repeat):
+        t = time.perf_counter(); outs = [fn(buf, s) for s in starts]; dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    total = sum(len(o[0] or b"") for o in outs)
+    return best, total, outs
+
+def bench_prs(args):
+    jobs = []
+    if args.file:
+        blob = Path(args.file).read_bytes()
+        starts = []; p = blob.find(b"PRS")
+        while p != -1:
+            starts.append(p); p = blob.find(b"PRS", p + 3)
+        for v in prs.VARIANTS:
+            jobs.append((v, f"{Path(args.file).name} ({len(starts)} hits)", blob, starts))
+    else:
+        size = int(args.size * 1024 * 1024)
+        for v in prs.VARIANTS:
+            jobs.append((v, f"synthetic {args.size:g} MB", synth_stream(v, size, seed=1), [0]))
+    print(f"{'variant':<11} {'input':<28} {'old MB/s':>9} {'new MB/s':>9} {'speedup':>8}  identical")
+    for v, label, buf, starts in jobs:
+        t_old, n_old, o_old = _time(_REF[v], buf, starts, args.repeat)
+        t_new, n_new, o_new = _time(lambda b, s: prs.prs_decompress(b, s, v), buf, starts, args.repeat)
+        mb = n_new / (1024 * 1024)
+        print(f"{v:<11} {label:<28} {mb / max(t_old, 1e-9):9.2f} {mb / max(t_new, 1e-9):9.2f} "
+              f"{t_old / max(t_new, 1e-9):7.1f}x  {o_old == o_new}")
+
+def bench_prs_compress(args):
+    if args.file:
+        data = Path(args.file).read_bytes(); label = Path(args.file).name
+    else:
+        size = int(args.size * 1024 * 1024)
+        data = prs.prs_decompress(synth_stream("basic", size, seed=1))[0]; label = f"synthetic {args.size:g} MB"
+    mb = len(data) / (1024 * 1024)
+    print(f"{'variant':<11} {'input':<28} {'level':>5} {'MB/s':>8} {'ratio':>7}  roundtrip")
+    for v in prs.VARIANTS:
+        for lv in args.levels:
+            t = time.perf_counter(); enc = prs.prs_compress(data, v, lv); dt = time.perf_counter() - t
+            ok = prs.prs_decode_block(enc, 0, v, max_out=0) == (data, len(enc))
+            print(f"{v:<11} {label:<28} {lv:5d} {mb / max(dt, 1e-9):8.2f} {len(enc) / max(len(data), 1):7.3f}  {ok}")
+
+def bench_scan(args):
+    if args.file:
+        with scanners.map_file(args.file) as buf:
+            return _bench_scan(buf, Path(args.file).name, args, args.file)
+    n = int(args.size * 1024 * 1024)
+    buf = (random.Random(1).randbytes(1 << 20) * (n // (1 << 20) + 1))[:n]
+    if not args.workers:
+        return _bench_scan(buf, f"random {args.size:g} MB", args)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "random.bin"; path.write_bytes(buf)
+        return _bench_scan(buf, f"random {args.size:g} MB", args, path)
+
+def _bench_scan(buf, label, args, path=None):
+    mb = len(buf) / (1024 * 1024)
+    t = time.perf_counter(); old = {}
+    for sig in scanners.SIGNATURES:
+        offs = old[sig] = []; p = buf.find(sig)
+        while p != -1:
+            offs.append(p); p = buf.find(sig, p + 1)
+    t_old = time.perf_counter() - t
+    t = time.perf_counter(); hits = scanners.HitTable(buf); t_new = time.perf_counter() - t
+    same = all(hits.offsets(s) == old[s] for s in scanners.SIGNATURES)
+    print(f"{'input':<28} {'mode':<14} {'MB/s':>9} {'speedup':>8}  hits  identical")
+    print(f"{label:<28} {'find() loops':<14} {mb / max(t_old, 1e-9):9.2f} {1:7.1f}x  {sum(map(len, old.values())):4d}")
+    print(f"{label:<28} {'HitTable':<14} {mb / max(t_new, 1e-9):9.2f} {t_old / max(t_new, 1e-9):7.1f}x  "
+          f"{len(hits.hits()):4d}  {same}")
+    if args.align:
+        align = scanners.parse_align(args.align)
+        t = time.perf_counter(); al = scanners.HitTable(buf, align=align); t_al = time.perf_counter() - t
+        # aligned hits must be exactly the byte-granular hits at aligned offsets
+        ok = all(al.offsets(s) == [p for p in hits.offsets(s) if p % align.get(s, 1) == 0]
+                 for s in scanners.SIGNATURES)
+        mode = "aligned" + ("" if scanners.np is not None else " (no numpy)")
+        print(f"{label:<28} {mode:<14} {mb / max(t_al, 1e-9):9.2f} {t_old / max(t_al, 1e-9):7.1f}x  "
+              f"{len(al.hits()):4d}  {ok}")
+    if args.regions:
+        t = time.perf_counter(); rm = scanners.RegionMap.build(buf); t_map = time.perf_counter() - t
+        t = time.perf_counter(); rg = scanners.HitTable(buf, regions=rm); t_rg = time.perf_counter() - t
+        live = rm.live_ranges()
+        # only hits in all-0x00/0xFF sectors may be dropped
+        ok = all(rg.offsets(s) == [p for p in hits.offsets(s) if any(a <= p < e for a, e in live)]
+                 for s in scanners.SIGNATURES)
+        for mode, dt in (("regions", t_map + t_rg), ("regions cached", t_rg)):
+            print(f"{label:<28} {mode:<14} {mb / max(dt, 1e-9):9.2f} {t_old / max(dt, 1e-9):7.1f}x  "
+                  f"{len(rg.hits()):4d}  {ok}")
+        print(f"{'':<28} map: {rm.summary()}")
+    if args.workers:
+        t = time.perf_counter()
+        pt = scanners.HitTable.for_file(path, workers=args.workers, part=args.part << 20); t_pt = time.perf_counter() - t
+        ok = all(pt.offsets(s) == hits.offsets(s) for s in scanners.SIGNATURES)
+        mode = f"spans x{args.workers}"
+        print(f"{label:<28} {mode:<14} {mb / max(t_pt, 1e-9):9.2f} {t_old / max(t_pt, 1e-9):7.1f}x  "
+              f"{len(pt.hits()):4d}  {ok}")
+
+def bench_afs(args):
+    if args.file:
+        return _bench_afs(Path(args.file), Path(args.file).name, args)
+    rnd = random.Random(1); off = (12 + 8 * args.entries + 0x7FF) & ~0x7FF; toc = bytearray()
+    for _ in range(args.entries):
+        size = rnd.randrange(1, 1 << 16); toc += off.to_bytes(4, "little") + size.to_bytes(4, "little")
+        off += (size + 0x7FF) & ~0x7FF
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "synthetic.afs"
+        with open(path, "wb") as fp:   # sparse body: only the header and table are written
+            fp.write(b"AFS\x00" + args.entries.to_bytes(4, "little") + bytes(4) + toc); fp.truncate(off)
+        return _bench_afs(path, f"synthetic {args.entries} entries", args)
+
+def _bench_afs(path, label, args):
+    np = scanners.np; rows = []
+    for mode in ("numpy", "python"):
+        scanners.np = np if mode == "numpy" else None
+        try:
+            with open(path, "rb") as fp:
+                t = time.perf_counter(); base, entries = scanners.afs_toc(fp); rows.append((mode, time.perf_counter() - t, entries))
+        finally:
+            scanners.np = np
+    if np is None: rows = rows[1:]
+    print(f"{'input':<28} {'layouts':<8} {'ms':>9}  entries  identical")
+    for mode, dt, entries in rows:
+        print(f"{label:<28} {mode:<8} {dt * 1e3:9.2f}  {len(entries):7d}  {entries == rows[-1][2]}")
+    if args.extract:
+        _bench_afs_extract(path, rows[-1][2], args.workers)
+
+class _AFSEntries(scanners.EntryReader):
+    def __init__(self, path, entries):
+        self._open(path); self.entries = entries
+
+def _bench_afs_extract(path, entries, workers):
+    total = sum(e["size"] for e in entries) / 1e6
+    with tempfile.TemporaryDirectory() as tmp:
+        old, new = Path(tmp) / "loop", Path(tmp) / "extract"
+        t = time.perf_counter(); old.mkdir()
+        with open(path, "rb") as fp:        # the previous per-entry extract_all()
+            for e in entries:
+                fp.seek(e["offset"]); (old / f"{e['index']:04d}.bin").write_bytes(fp.read(e["size"]))
+        t_old = time.perf_counter() - t
+        with _AFSEntries(path, entries) as afs:
+            t = time.perf_counter(); afs.extract(new, workers=workers); t_new = time.perf_counter() - t
+        same = all((old / p.name).read_bytes() == p.read_bytes() for p in new.iterdir())
+    print(f"\n{'extract':<28} {'MB':>9} {'MB/s':>9}  identical")
+    print(f"{'read/write loop':<28} {total:9.1f} {total / t_old:9.1f}")
+    print(f"{'EntryReader.extract':<28} {total:9.1f} {total / t_new:9.1f}  {same}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("prs", help="PRS decoder throughput (old vs prs.py)")
+    p.add_argument("--size", type=float, default=4.0, help="decompressed MB per synthetic stream")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--file", help="benchmark every PRS hit in this file instead")
+    p.set_defaults(fn=bench_prs)
+    p = sub.add_parser("prs-compress", help="PRS encoder throughput and ratio per level")
+    p.add_argument("--size", type=float, default=1.0, help="uncompressed MB of synthetic input")
+    p.add_argument("--levels", type=lambda s: [int(x) for x in s.split(",")], default=[1, 6, 9])
+    p.add_argument("--file", help="compress this file instead")
+    p.set_defaults(fn=bench_prs_compress)
+    p = sub.add_parser("scan", help="signature search: per-signature find() vs HitTable")
+    p.add_argument("--size", type=float, default=64.0, help="MB of random input")
+    p.add_argument("--file", help="scan this file (memory-mapped) instead")
+    p.add_argument("--align", metavar="SPEC", help='also time the aligned mode, e.g. "4" or "4,AFS=2048"')
+    p.add_argument("--regions", action="store_true", help="also time a RegionMap pre-pass + HitTable over live sectors")
+    p.add_argument("--workers", type=int, default=0, help="also time HitTable.for_file() on N processes")
+    p.add_argument("--part", type=int, default=64, help="span size in MB for --workers")
+    p.set_defaults(fn=bench_scan)
+    p = sub.add_parser("afs", help="AFS table of contents: header-only read, layout scoring")
+    p.add_argument("--entries", type=int, default=10000)
+    p.add_argument("--file", help="open this AFS instead")
+    p.add_argument("--extract", action="store_true", help="also time extracting every entry")
+    p.add_argument("--workers", type=int, default=0, help="threads for --extract (0 = up to 8)")
+    p.set_defaults(fn=bench_afs)
+    args = ap.parse_args(argv)
+    return args.fn(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -11,7 +11,8 @@ import pathlib
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from scanners import robust_scan_to_dir
+from scanners import robust_scan_to_dir, map_file, carve_to, HitTable, parse_align, RegionMap, pvrt_header, EXTENTS, TextureArchive, AssetStore, AssetIndex, read_asset, ScanCache, afs_toc, EntryReader, AFS_STRATEGIES
+from prs import prs_decompress, prs_decode_block, prs_probe, prs_note_source, PRSVariantCache, PRSView, AUTO_VARIANTS, SCANNER_VARIANTS
 
 
 # ---- Tiny tooltip helper ----
@@ -71,84 +72,22 @@ sys.modules["pypvr"] = pypvr
 
 # ---- Updated CRI PRS decompressor ----
 # The previous minimal decompressor did not work for some Dreamcast PRS blocks.
-# This implementation is adapted from the NiGHTS LZS decompressor and works
-# with PRS streams found in many SEGA games.  It returns both the
-# decompressed bytes and the number of input bytes consumed.
+# Decoding is done by the shared table-driven engine in prs.py.  It returns
+# both the decompressed bytes and the number of input bytes consumed.
 def _prs_decompress(buf, start=0):
     """Decompress a PRS block beginning at `start` in `buf`.  If the
     signature 'PRS' is not present, returns (None, 0).  The algorithm
-    operates on a sliding window and is based on LZ77; see:【146627541408994†L92-L131】 for a reference.
+    operates on a sliding window and is based on LZ77; see prs.py.
     """
-    if buf[start:start+3] != b'PRS':
-        return None, 0
-    i = start + 3
-    out = bytearray()
-    bit = 0
-    cmd = 0
-    # helper to read a single bit
-    def getbit():
-        nonlocal bit, cmd, i
-        if bit == 0:
-            if i >= len(buf):
-                return 0
-            cmd = buf[i]
-            i += 1
-            bit = 8
-        res = cmd & 1
-        cmd >>= 1
-        bit -= 1
-        return res
-    # helper to read a byte
-    def getByte():
-        nonlocal i
-        if i >= len(buf):
-            return 0
-        b = buf[i]
-        i += 1
-        return b
-    while i < len(buf):
-        if getbit():
-            # literal byte
-            out.append(getByte())
-        else:
-            if getbit():
-                # short backref (0x2000 window)
-                a = getByte()
-                b = getByte()
-                # compute offset and amount
-                offset = ((b << 8) | a) >> 3
-                amount = a & 7
-                if amount == 0:
-                    amount = getByte() + 1
-                else:
-                    amount += 2
-                start_pos = len(out) - 0x2000 + offset
-            else:
-                # long backref (0x100 window)
-                amount = 0
-                amount = (amount << 1) | getbit()
-                amount = (amount << 1) | getbit()
-                offset = getByte()
-                amount += 2
-                start_pos = len(out) - 0x100 + offset
-            # copy from out buffer
-            for _ in range(amount):
-                if start_pos < 0:
-                    out.append(0)
-                elif start_pos < len(out):
-                    out.append(out[start_pos])
-                else:
-                    out.append(0)
-                start_pos += 1
-    consumed = i - start
-    return bytes(out), consumed
+    return prs_decompress(buf, start, "basic")
 
-def prs_extract_all_to_folder(container_bytes: bytes, out_dir: str, entry_label: str = "blob"):
+def prs_extract_all_to_folder(container_bytes: bytes, out_dir: str, entry_label: str = "blob", stats: dict = None):
     """Scan `container_bytes` for PRS signatures and decompress them into
     individual files under `out_dir`.  Returns the number of blocks
-    decompressed.  If multiple PRS headers appear close together, each
-    will be attempted; overlapping segments are skipped based on the
-    consumed length reported by the decompressor.
+    decompressed.  Each block is decoded up to its end-of-stream marker, and
+    signatures inside an already decoded block are skipped using its exact
+    compressed extent.  Streams without a stop code are dropped.  Hits are
+    probed first; pass `stats` to collect prs_hits/prs_probes/prs_accepted.
     """
     import re, os
     os.makedirs(out_dir, exist_ok=True)
@@ -159,10 +98,18 @@ def prs_extract_all_to_folder(container_bytes: bytes, out_dir: str, entry_label:
         # skip if inside the previous decompressed segment
         if off < last_end:
             continue
-        dec, consumed = _prs_decompress(container_bytes, start=off)
+        if stats is not None:
+            for k in ("prs_hits", "prs_probes"): stats[k] = stats.get(k, 0) + 1
+        if not prs_probe(container_bytes, off):
+            continue
+        if stats is not None: stats["prs_accepted"] = stats.get("prs_accepted", 0) + 1
+        dec, consumed = prs_decode_block(container_bytes, start=off)
         if dec:
-            with open(os.path.join(out_dir, f"{entry_label}_{found:03d}.bin"), "wb") as w:
+            blob = os.path.join(out_dir, f"{entry_label}_{found:03d}.bin")
+            with open(blob, "wb") as w:
                 w.write(dec)
+            if getattr(container_bytes, "path", None):   # map_file(): pvr_log reimport recompresses into it
+                prs_note_source(blob, container_bytes.path, off, "basic")
             found += 1
             # update last_end to skip overlapping signatures
             last_end = off + consumed
@@ -232,6 +179,9 @@ I18N = {
         "done": "Готово",
         "repack_saved": "Патченный AFS сохранён:\n{dst}",
         "repack_failed": "Сбой репака",
+        "repack_patch": "Копия + запись только изменённых записей (pwrite)",
+        "repack_mode": "Режим: patch — замены не больше оригинала; minimal/append/shift/repack — пересборка",
+        "rebuild_stats": "{strategy}: перемещено {moved} Б, записей на новом месте: {relocated}, размер {size} Б",
         "recipes_r1": "Рецепт 1 — Сканировать контейнер → PVRT/PVPL → PNG + pvr_log.txt",
         "recipes_r1_run": "Выполнить",
         "recipes_r2": "Рецепт 2 — Реимпорт по pvr_log.txt (код PNG→PVR и запись в контейнер)",
@@ -245,10 +195,16 @@ I18N = {
         # Help/instruction texts
         "afs_help": "Шаги: 1) Выберите файл‑контейнер (.afs/.bin/.dat). 2) Нажмите «Сканировать записи», чтобы увидеть список. 3) Для извлечения RAW выберите папку вывода и нажмите «Извлечь RAW». 4) Чтобы найти текстуры PVRT и палитры, выберите папку вывода и нажмите «Найти PVRT/палитры». 5) Выберите запись и нажмите «Декодировать выделенное → предпросмотр» для просмотра. Примечание: если ничего не найдено, контейнер может быть PRS‑сжат; распакуйте его внешним инструментом.",
         "pvr_help": "Эта вкладка конвертирует между текстурами PVR/PVP и изображениями PNG. Выберите PVR или папку и нажмите «Декодировать PVR→PNG», чтобы получить PNG. Выберите PNG или папку, настройте параметры (формат пикселей, текстуры, мипмапы) и нажмите «Кодировать PNG→PVR», чтобы создать PVR и PVP. «Показать файлы» выводит список файлов источника.",
-        "repack_help": "Создание патченного AFS. 1) Выберите исходный AFS и нажмите «Загрузить записи». 2) Для каждой записи, которую нужно заменить, укажите новый файл (размер не должен превышать исходный). 3) Выберите путь для сохранения патченного AFS. 4) Нажмите «Записать новый AFS». Только выбранные записи заменяются; остальные копируются без изменений.",
+        "repack_help": "Создание патченного AFS. 1) Выберите исходный AFS и нажмите «Загрузить записи». 2) Для каждой записи, которую нужно заменить, укажите новый файл (в режиме patch размер не должен превышать исходный; режимы пересборки переносят выросшие записи с выравниванием 2048 и переписывают таблицу). 3) Выберите путь для сохранения патченного AFS. 4) Нажмите «Записать новый AFS». Только выбранные записи заменяются; остальные копируются без изменений.",
         "recipes_help": "«Рецепты» автоматизируют типовые операции:\n• Рецепт 1 сканирует контейнер, извлекает PVR/PVP текстуры в PNG и создаёт файл pvr_log.txt с описанием каждой конверсии.\n• Рецепт 2 берёт pvr_log.txt, перекодирует изменённые PNG обратно в PVR и записывает их в контейнер по исходным смещениям. Используйте для реимпорта правок.\n• Рецепт 3 читает pvr_log.txt и перекодирует все PNG из списка в PVR‑файлы в выбранную папку, не изменяя контейнер.",
         "btn_full_deprs": "Полный dePRS → поиск PVRT",
         "tip_full_deprs": "Распаковать все PRS (рекурсивно) и сразу найти/вытащить PVRT/PVPL. Результаты: *_DEPRS и *_DEPRS_PVR, PNG идёт в папку вывода.",
+        "deprs_workers": "Процессы (0 = все ядра):",
+        "deprs_dedup": "Без дублей",
+        "deprs_index": "Только индекс",
+        "scan_cache": "Кэш",
+        "clear_cache": "Сбросить кэш",
+        "cache_cleared": "Кэш сброшен: {n} записей",
     },
     "en": {
         "lang_name": "English",
@@ -305,6 +261,9 @@ I18N = {
         "done": "Done",
         "repack_saved": "Patched AFS saved:\n{dst}",
         "repack_failed": "Repack failed",
+        "repack_patch": "Copy, then pwrite only the changed entries",
+        "repack_mode": "Mode: patch — replacements no larger than the original; minimal/append/shift/repack — rebuild",
+        "rebuild_stats": "{strategy}: {moved} B moved, {relocated} entries relocated, {size} B",
         "recipes_r1": "Recipe 1 — Scan container → PVRT/PVPL → PNG + pvr_log.txt",
         "recipes_r1_run": "Run",
         "recipes_r2": "Recipe 2 — Reimport from pvr_log.txt (encode PNG→PVR & write back to container)",
@@ -318,7 +277,7 @@ I18N = {
         # Help/instruction texts
         "afs_help": "Steps: 1) Select a container file (.afs/.bin/.dat). 2) Click ‘Scan entries’ to display the list of entries. 3) To extract RAW entries, choose an output folder then press ‘Extract RAW’. 4) To search for PVRT textures and palettes, choose an output folder then press ‘Find PVRT & palettes’. 5) Select an entry and click ‘Decode selected → preview’ to preview textures. Note: if nothing is found the container may be PRS‑compressed and must be decompressed externally first.",
         "pvr_help": "This tab converts between PVR/PVP textures and PNG images. Choose a PVR file or folder and click ‘Decode PVR→PNG’ to get PNG. Choose a PNG file or folder, set options (pixel format, texture type, mipmaps) and click ‘Encode PNG→PVR’ to create PVR and PVP files. ‘List files’ prints the source file list.",
-        "repack_help": "Creating a patched AFS. 1) Select the original AFS and click ‘Load entries’. 2) For each entry you want to replace, specify a new file (its size must not exceed the original). 3) Choose where to save the patched AFS. 4) Click ‘Write new AFS’. Only selected entries are replaced; all others are copied unchanged.",
+        "repack_help": "Creating a patched AFS. 1) Select the original AFS and click ‘Load entries’. 2) For each entry you want to replace, specify a new file (in patch mode its size must not exceed the original; the rebuild modes relocate grown entries on 2048-byte sectors and rewrite the TOC). 3) Choose where to save the patched AFS. 4) Click ‘Write new AFS’. Only selected entries are replaced; all others are copied unchanged.",
         "recipes_help": "The ‘Recipes’ automate common tasks:\n• Recipe 1 scans a container, extracts PVR/PVP textures to PNG and creates a pvr_log.txt describing each conversion.\n• Recipe 2 reads a pvr_log.txt, re‑encodes modified PNGs back to PVR and writes them into the container at the original offsets. Use this to reimport your edits.\n• Recipe 3 reads a pvr_log.txt and re‑encodes all listed PNGs into PVR files in a chosen folder, without modifying any container.",
     }
 }
@@ -333,6 +292,12 @@ try:
         "decode_sticker_auto": "Separate textures → PNG",
         "decoding_stickers": "Decoding textures…",
         "decoded_stickers_n": "Done: {n} textures → {out}",
+        "deprs_workers": "Workers (0 = all cores):",
+        "deprs_dedup": "Dedup",
+        "deprs_index": "Index only",
+        "scan_cache": "Cache",
+        "clear_cache": "Clear cache",
+        "cache_cleared": "Cache cleared: {n} entries",
     })
 except Exception:
     pass
@@ -340,42 +305,29 @@ except Exception:
 
 
 # ---- AFS minimal reader ----
-class AFSArchive:
+class AFSArchive(EntryReader):
+    """The archive stays open (EntryReader): close() it or use it in a with block."""
     def __init__(self, path):
-        self.path = pathlib.Path(path)
+        self._open(path)
         self.entries = []
-        self._read()
+        try: self._read()
+        except Exception: self.close(); raise
     def _read(self):
-        with open(self.path, "rb") as f:
-            if f.read(4) != b"AFS\x00":
-                raise ValueError("Not an AFS archive (missing 'AFS\\0')")
-            n = int.from_bytes(f.read(4), "little")
-            f.read(4)  # unknown/align
-            table = [tuple(int.from_bytes(f.read(4), "little") for _ in range(2)) for _ in range(n)]
-            f.seek(0,2); total=f.tell()
-            def plaus_so(pair): size,off=pair; return 0<off<total and 0<size<=total-off
-            use_so = sum(1 for p in table if plaus_so(p)) >= n//2
-            self.entries = [{"index":i,"offset":(b if use_so else a),"size":(a if use_so else b)} for i,(a,b) in enumerate(table)]
-    def read_entry_bytes(self, idx):
-        e = self.entries[idx]
-        with open(self.path,"rb") as f:
-            f.seek(e["offset"]); return f.read(e["size"])
-    def extract_all(self, out_dir):
-        out = pathlib.Path(out_dir); out.mkdir(parents=True, exist_ok=True)
-        with open(self.path,"rb") as f:
-            for e in self.entries:
-                if e["offset"] and e["size"]:
-                    f.seek(e["offset"]); (out/f"entry_{e['index']:04d}.bin").write_bytes(f.read(e["size"]))
-        return len(self.entries)
-    def replace_in_place(self, repl:dict, out_path:Path):
-        data = bytearray(Path(self.path).read_bytes())
-        for idx,newp in repl.items():
-            idx=int(idx); e=self.entries[idx]; off, size = e["offset"], e["size"]
-            chunk = pathlib.Path(newp).read_bytes()
-            if len(chunk)>size: raise ValueError(f"Entry #{idx} replacement is larger than original ({len(chunk)}>{size}).")
-            data[off:off+len(chunk)] = chunk
-            if len(chunk)<size: data[off+len(chunk):off+size] = b"\x00"*(size-len(chunk))
-        outp = pathlib.Path(out_path); outp.write_bytes(bytes(data)); return outp
+        f = self._fp
+        if f.read(4) != b"AFS\x00":
+            raise ValueError("Not an AFS archive (missing 'AFS\\0')")
+        n = int.from_bytes(f.read(4), "little")
+        f.read(4)  # unknown/align
+        table = [tuple(int.from_bytes(f.read(4), "little") for _ in range(2)) for _ in range(n)]
+        f.seek(0,2); total=f.tell()
+        def plaus_so(pair): size,off=pair; return 0<off<total and 0<size<=total-off
+        use_so = sum(1 for p in table if plaus_so(p)) >= n//2
+        self.entries = [{"index":i,"offset":(b if use_so else a),"size":(a if use_so else b)} for i,(a,b) in enumerate(table)]
+    def extract_all(self, out_dir, indices=None, kinds=None, workers=0):
+        return self.extract(out_dir, "entry_{index:04d}.bin", indices, kinds, workers, skip_empty=True)
+    def replace_in_place(self, repl:dict, out_path:Path, in_place:bool=False):
+        # streamed (EntryReader.repack): untouched ranges copied kernel-side, only replacements written
+        return self.repack(repl, out_path, in_place)
 
 # ---- GUI ----
 # ---- Full PRS recursive decompressor + PVRT splitter ----
@@ -386,63 +338,48 @@ def _read_u32le_deprs(b, off):
 
 def _prs_decompress_nights(data: bytes, start: int = 0):
     """CRI PRS (NiGHTS-like) bitstream decoder. Returns (out_bytes, consumed) or (None, None)."""
-    i = start
-    if data[i:i+3] != b'PRS':
+    out, used = prs_decompress(data, start, "nights_ext")
+    if out is None:
         return (None, None)
-    i += 3
-    out = bytearray()
-    bitbuf = 0
-    bits = 0
-    def getbit():
-        nonlocal bitbuf, bits, i
-        if bits == 0:
-            if i >= len(data): return 0
-            bitbuf = data[i]; i += 1; bits = 8
-        b = bitbuf & 1
-        bitbuf >>= 1; bits -= 1
-        return b
-    try:
-        while True:
-            if getbit() == 1:
-                if i >= len(data): break
-                out.append(data[i]); i += 1
-            else:
-                if getbit() == 1:
-                    if i+2 > len(data): break
-                    a = data[i]; b = data[i+1]; i += 2
-                    offs = ((b & 0xF0) << 4) | a
-                    cnt  = (b & 0x0F) + 3
-                    if offs == 0:  # end
-                        break
-                    src = len(out) - offs
-                    if src < 0: return (None, None)
-                    for _ in range(cnt):
-                        out.append(out[src]); src += 1
-                else:
-                    if i+3 > len(data): break
-                    a = data[i]; b = data[i+1]; c = data[i+2]; i += 3
-                    cnt  = (a | ((b & 0xE0) << 3)) + 2
-                    offs = ((b & 0x1F) << 8) | c
-                    src = len(out) - offs
-                    if src < 0: return (None, None)
-                    for _ in range(cnt):
-                        out.append(out[src]); src += 1
-    except Exception:
+    return (out, used)
+
+def _prs_decompress_auto(data: bytes, start: int, stats: dict = None, variants: PRSVariantCache = None):
+    """Try plain NiGHTS bit order; if fails, try per-byte bit-reversed stream.
+    Each order is probed on the first commands before the full decode; pass
+    `stats` to collect prs_hits/prs_probes/prs_accepted.  Pass one `variants`
+    cache per container so the order is decided once, not at every hit; the
+    bit-reversed stream is translated window by window inside the decoder."""
+    if stats is not None: stats["prs_hits"] = stats.get("prs_hits", 0) + 1
+    if variants is None:
+        variants = PRSVariantCache(AUTO_VARIANTS, strict=False)
+    out, used = variants.decode(data, start, stats)
+    if out is None:
         return (None, None)
-    return (bytes(out), i - start)
-
-def _prs_decompress_auto(data: bytes, start: int):
-    """Try plain NiGHTS bit order; if fails, try per-byte bit-reversed stream."""
-    o1,c1 = _prs_decompress_nights(data, start)
-    if o1 and c1: return (o1,c1)
-    if data[start:start+3] != b'PRS': return (None, None)
-    tbl = bytes(int(f'{i:08b}'[::-1],2) for i in range(256))
-    head = data[start:start+3]
-    rest = bytes(tbl[b] for b in data[start+3:])
-    alt  = head + rest
-    o2,c2 = _prs_decompress_nights(alt, 0)
-    if o2 and c2: return (o2,c2)
-    return (None, None)
+    return (out, used)
+
+def _prs_first_pvr(buf, start: int = 0, window: int = 0x10000):
+    """First valid PVRT texture (with the GBIX chunk just before it) in the output
+    of the PRS block at `start`, read through a PRSView: the block is indexed once
+    and only the searched windows and the texture itself are decoded into memory.
+    Returns (bytes, output offset) or None."""
+    for variant, bitrev in AUTO_VARIANTS + SCANNER_VARIANTS:
+        if not prs_probe(buf, start, variant, bitrev=bitrev): continue
+        try: view=PRSView(buf, start, variant, strict=False, bitrev=bitrev, every=window)
+        except ValueError: continue
+        for a in range(0, len(view), window):
+            win=view.read(max(0, a-16), window+16+16); lo=a-max(0, a-16)
+            p=win.find(b"PVRT", lo)
+            while p!=-1 and p<lo+window:
+                at=a-lo+p; declared=int.from_bytes(win[p+4:p+8], "little") if p+8<=len(win) else 0
+                if 16<=declared<=len(view)-at-8:
+                    tex=view.read(at, 8+declared)
+                    if pvrt_header(tex, 0) is not None:
+                        g=p-16
+                        if g>=0 and win[g:g+4]==b"GBIX" and EXTENTS[b"GBIX"](win, g)==(g, p):
+                            return win[g:p]+tex, at-16
+                        return tex, at
+                p=win.find(b"PVRT", p+1)
+    return None
 
 def _split_pvrt_pvpl(buf: bytes, out_dir: _pl_deprs.Path, base_name: str):
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -452,68 +389,197 @@ def _split_pvrt_pvpl(buf: bytes, out_dir: _pl_deprs.Path, base_name: str):
         if pos+8 <= len(buf):
             size = _read_u32le_deprs(buf, pos+4) + 8
             if 0 < size <= len(buf)-pos:
-                (out_dir / f'{base_name}_pvrt_{pos:08X}.pvr').write_bytes(buf[pos:pos+size])
+                carve_to(out_dir / f'{base_name}_pvrt_{pos:08X}.pvr', buf, pos, pos+size)
                 count += 1
     for m in _re_deprs.finditer(b'PVPL', buf):
         pos = m.start()
         if pos+8 <= len(buf):
             size = _read_u32le_deprs(buf, pos+4) + 8
             if 0 < size <= len(buf)-pos:
-                (out_dir / f'{base_name}_pvpl_{pos:08X}.pvp').write_bytes(buf[pos:pos+size])
+                carve_to(out_dir / f'{base_name}_pvpl_{pos:08X}.pvp', buf, pos, pos+size)
                 count += 1
     return count
 
 
 
 
-def full_deprs_and_scan(input_path: str, out_dir: str, max_depth: int = 6):
-    """Recursive PRS unpack + PVRT/PVPL scan (base + leaves) using robust_scan_to_dir."""
+# ---- dePRS recursion (shared by the serial and the process-pool paths) ----
+def _deprs_block(buf, pos: int, tag: str, d: int, max_depth: int, deprs: _pl_deprs.Path,
+                 variants: PRSVariantCache, stats: dict, leaf):
+    """Decode the PRS hit at `pos` into <deprs>/<tag>_d<d>_@<pos>.bin, then recurse
+    into it (or hand it to `leaf(name, buf)` at max_depth / when it has no PRS)."""
+    name=f"{tag}_d{d}_@{pos:08X}"; path=deprs/f"{name}.bin"
+    stats["prs_hits"]+=1
+    try: ok=variants.decode_to(buf,pos,path,stats)[0]>0
+    except Exception: ok=False
+    if ok:
+        if getattr(buf, "path", None): prs_note_source(path, buf.path, pos, *variants.choice)
+        with map_file(path) as out:
+            if d<max_depth and out.find(b"PRS")!=-1: _deprs_rec(out, name, d+1, max_depth, deprs, variants, stats, leaf)
+            else: leaf(name,out)
+
+def _deprs_rec(buf, tag: str, d: int, max_depth: int, deprs: _pl_deprs.Path,
+               variants: PRSVariantCache, stats: dict, leaf, regions=None):
+    """Decode every PRS hit of `buf`.  Each top-level block gets its own copy of
+    `variants` (nested blocks share their block's), as each pool job does in
+    _deprs_worker, so the serial and parallel outputs are the same."""
+    found=False
+    for pos in HitTable(buf, (b"PRS",), regions=regions).offsets(b"PRS"):
+        found=True
+        if regions is not None and not regions.prs_plausible(pos):
+            stats["prs_skipped"]+=1; continue
+        v=PRSVariantCache(variants.candidates, variants.strict) if d==0 else variants
+        _deprs_block(buf, pos, tag, d, max_depth, deprs, v, stats, leaf)
+    if not found: leaf(f"{tag}_raw", buf)
+
+def _deprs_leaf(scan: str, pvrdir: _pl_deprs.Path, c_leaf: dict, align=None, store=None):
+    """leaf(name, buf) for the given scanner: "robust" (robust_scan_to_dir) or "gbix"."""
+    def leaf(name, buf):
+        if scan=="gbix": r=__scan_pvrt_pvpl_gbix(buf, pvrdir, name, "leaf", store=store)
+        else: r=robust_scan_to_dir(buf, str(pvrdir), name, "leaf", align=align, store=store)
+        c_leaf["pvr"]+=r["pvr"]; c_leaf["pvp"]+=r["pvp"]
+    return leaf
+
+def _deprs_worker(job):
+    """One top-level PRS block in a pool process.  The job carries the input path
+    and block offset only; the worker maps the file itself, so no payload is pickled.
+    With a `sink` (AssetStore or AssetIndex) it writes into the shared store
+    directory and returns its manifest records for the parent to merge."""
+    input_path, pos, tag, max_depth, deprs, pvrdir, scan, align, sink = job
+    stats={"prs_hits":0,"prs_probes":0,"prs_accepted":0}; c_leaf={"pvr":0,"pvp":0}
+    store=sink(pvrdir, _pl_deprs.Path(input_path).name) if sink else None
+    leaf=_deprs_leaf(scan, _pl_deprs.Path(pvrdir), c_leaf, align, store)
+    with map_file(input_path) as data:
+        _deprs_block(data, pos, tag, 0, max_depth, _pl_deprs.Path(deprs),
+                     PRSVariantCache(AUTO_VARIANTS, strict=False), stats, leaf)
+    return c_leaf, stats, (store.records, store.totals) if store else None
+
+def _deprs_parallel(input_path, data, base: str, max_depth: int, deprs, pvrdir, scan: str,
+                    workers: int, stats: dict, c_leaf: dict, align=None, regions=None, store=None):
+    """Top level of the dePRS recursion on a process pool.
+
+    PRS hits are probed here first and only candidates become jobs; each job
+    decodes one block and recurses into it with its own variant cache.  Output
+    names depend only on offsets and results are merged in offset order, so
+    files and counts do not depend on the worker count."""
+    from concurrent.futures import ProcessPoolExecutor
+    hits=HitTable.for_file(input_path, (b"PRS",), regions=regions, workers=workers).offsets(b"PRS")
+    if not hits:
+        _deprs_leaf(scan, pvrdir, c_leaf, align, store)(f"{base}_raw", data); return
+    jobs=[]
+    for pos in hits:
+        if regions is not None and not regions.prs_plausible(pos):
+            stats["prs_skipped"]+=1
+        elif any(prs_probe(data, pos, v, bitrev=br) for v, br in AUTO_VARIANTS):
+            jobs.append((str(input_path), pos, base, max_depth, str(deprs), str(pvrdir), scan, align, type(store) if store is not None else None))
+        else:   # what the worker would have tallied for this hit
+            stats["prs_hits"]+=1; stats["prs_probes"]+=len(AUTO_VARIANTS)
+    if not jobs: return
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as ex:
+        for leaf_c, st, stored in ex.map(_deprs_worker, jobs, chunksize=max(1, len(jobs)//(workers*4))):
+            for k in c_leaf: c_leaf[k]+=leaf_c[k]
+            for k in st: stats[k]+=st[k]
+            if stored: store.merge(*stored)
+
+def _deprs_sink(pvrdir, container: str, dedup: bool, index_only: bool):
+    """Where the dePRS scans put their hits: None (one file each), an AssetStore
+    (`dedup`) or an AssetIndex (`index_only`, records only)."""
+    if index_only: return AssetIndex(pvrdir, container)
+    return AssetStore(pvrdir, container) if dedup else None
+
+def export_index(manifest, out_dir, fmt: str = "png") -> int:
+    """Decode the PVR records of an index (AssetIndex / --index-only) to images in
+    out_dir, each distinct texture once, named after its first hit; returns the count."""
+    out=_pl_deprs.Path(out_dir); out.mkdir(parents=True, exist_ok=True); seen=set(); n=0
+    for r in AssetStore.load(manifest):
+        if r["ext"]!="pvr" or r["hash"] in seen: continue
+        seen.add(r["hash"])
+        try:
+            img=pypvr.Pypvr.Decode(args_str=f'-buffer -fmt {fmt} -nolog', buff_pvr=read_asset(r), buff_pvp=None).get_image_buffer()
+            if img is not None: img.save(out/f"{_pl_deprs.Path(r['name']).stem}.{fmt}"); n+=1
+        except Exception: pass
+    return n
+
+def _deprs_workers(workers) -> int:
+    """Worker count from the GUI/CLI: 0 or less means one per CPU."""
+    workers=int(workers or 0)
+    return workers if workers>0 else (os.cpu_count() or 1)
+
+def _deprs_cached(cache, p_in, params):
+    """Result of an earlier dePRS run with the same params on the unchanged input,
+    if every file it wrote is still there; else None."""
+    hit=cache.get(p_in, "deprs", params) if cache is not None else None
+    if hit is not None and ScanCache.intact(hit["outputs"]):
+        return {**hit["result"], "cached": True}
+    return None
+
+def _deprs_remember(cache, p_in, params, res: dict, base: str, *dirs):
+    """Cache a dePRS result with its top-level PRS block table ([offset, decoded
+    size] of each <base>_d0_@<offset>.bin) and the files under `dirs`."""
+    if cache is None: return
+    deprs=_pl_deprs.Path(res["deprs_dir"])
+    prs=[[int(p.stem.rpartition("@")[2], 16), p.stat().st_size] for p in sorted(deprs.glob(f"{base}_d0_@*.bin"))]
+    cache.put(p_in, "deprs", params, {"result": res, "prs": prs, "outputs": ScanCache.outputs(*dirs)})
+
+
+def full_deprs_and_scan(input_path: str, out_dir: str, max_depth: int = 6, workers: int = 1, align=None,
+                        regions: bool = False, dedup: bool = False, index_only: bool = False, cache=None):
+    """Recursive PRS unpack + PVRT/PVPL scan (base + leaves) using robust_scan_to_dir.
+    workers > 1 decodes top-level PRS blocks on a process pool (0 = one per CPU)
+    and splits the base signature search into file spans (HitTable.for_file);
+    `align` turns on the aligned signature scan (see scanners.HitTable);
+    `regions` maps the input first (cached as <out>/<base>.rmap) and skips its
+    padding and noise sectors in the base scan and the top-level PRS pass;
+    `dedup` writes every distinct asset once into the PVR folder by hash, with
+    manifest.jsonl mapping (container, layer, offset) to it, so PNG export
+    decodes each unique texture once; `index_only` writes no asset files and no
+    PNGs, only <pvr dir>/index.jsonl (see export_index()).  With `cache` (a
+    scanners.ScanCache) an unchanged input returns the earlier result while its
+    output files are intact, and the base hit table is reused otherwise."""
     import re
     from pathlib import Path as _P
     p_in=_P(input_path); p_out=_P(out_dir); p_out.mkdir(parents=True, exist_ok=True)
-    base=p_in.stem; data=p_in.read_bytes()
+    base=p_in.stem
     deprs=p_out/f"{base}_DEPRS"; pvrdir=p_out/f"{base}_DEPRS_PVR"
+    params={"out": str(p_out.resolve()), "scan": "robust", "max_depth": max_depth, "align": repr(align),
+            "regions": bool(regions), "dedup": bool(dedup), "index_only": bool(index_only)}
+    res=_deprs_cached(cache, p_in, params)
+    if res is not None: return res
     deprs.mkdir(exist_ok=True); pvrdir.mkdir(exist_ok=True)
 
-    # 1) base scan
-    c_base = robust_scan_to_dir(data, str(pvrdir), base, "base")
-
-    # 2) recurse PRS blocks
-    leaves=[]
-    def _prs(buf,pos):
-        try:
-            out,used=_prs_decompress_auto(buf,pos)
-            if out and used: return out,used
-        except Exception: pass
-        return None,None
-
-    def rec(buf, tag, d):
-        found=False
-        for m in re.finditer(b"PRS", buf):
-            found=True
-            pos=m.start(); out,used=_prs(buf,pos)
-            if out:
-                name=f"{tag}_d{d}_@{pos:08X}"; (deprs/f"{name}.bin").write_bytes(out)
-                if d<max_depth and b"PRS" in out: rec(out, name, d+1)
-                else: leaves.append((name,out))
-        if not found: leaves.append((f"{tag}_raw", buf))
-
-    rec(data, base, 0)
-
+    # PRS blocks are streamed to .bin files and scanned through a map of them
     c_leaf={"pvr":0,"pvp":0}
-    for name,buf in leaves:
-        r=robust_scan_to_dir(buf, str(pvrdir), name, "leaf")
-        c_leaf["pvr"]+=r["pvr"]; c_leaf["pvp"]+=r["pvp"]
+    stats={"prs_hits":0,"prs_probes":0,"prs_accepted":0,"prs_skipped":0}
+    workers=_deprs_workers(workers)
+
+    with map_file(p_in) as data:
+        rm=RegionMap.for_file(p_in, p_out/f"{base}.rmap", data) if regions else None
+        store=_deprs_sink(pvrdir, p_in.name, dedup, index_only)
+        # 1) base scan, 2) recurse PRS blocks
+        # the base scan of a big input is partitioned over the same workers
+        hits=HitTable.for_file(p_in, align=align, regions=rm, workers=workers, cache=cache) \
+            if workers>1 or cache is not None else None
+        c_base = robust_scan_to_dir(data, str(pvrdir), base, "base", align=align, regions=rm, store=store, hits=hits)
+        if workers>1:
+            _deprs_parallel(p_in, data, base, max_depth, deprs, pvrdir, "robust", workers, stats, c_leaf, align, rm, store)
+        else:
+            _deprs_rec(data, base, 0, max_depth, deprs, PRSVariantCache(AUTO_VARIANTS, strict=False),
+                       stats, _deprs_leaf("robust", pvrdir, c_leaf, align, store), rm)
+        prs_blocks = len(list(re.finditer(b"PRS", data)))
+    if store is not None:
+        stats["manifest"]=str(store.save()); stats.update(store.summary())
 
     total = c_base["pvr"]+c_base["pvp"]+c_leaf["pvr"]+c_leaf["pvp"]
-    if total>0:
-        try: pypvr.Pypvr.Decode(args_str=f'-scandir \"{pvrdir}\" -o \"{p_out}\" -fmt png -nolog')
+    if total>0 and not index_only:
+        try: pypvr.Pypvr.Decode(args_str=f'-scandir \"{pvrdir}\" -o \"{p_out}\" -fmt png -nolog -j {workers}')
         except Exception: pass
 
-    return {"prs_blocks": len(list(re.finditer(b"PRS", data))),
-            "base_pvr": c_base["pvr"], "base_pvp": c_base["pvp"],
-            "leaf_pvr": c_leaf["pvr"], "leaf_pvp": c_leaf["pvp"],
-            "total_pvrpvp": total, "deprs_dir": str(deprs), "pvr_dir": str(pvrdir)}
+    res={"prs_blocks": prs_blocks,
+         "base_pvr": c_base["pvr"], "base_pvp": c_base["pvp"],
+         "leaf_pvr": c_leaf["pvr"], "leaf_pvp": c_leaf["pvp"],
+         "total_pvrpvp": total, "deprs_dir": str(deprs), "pvr_dir": str(pvrdir), **stats}
+    _deprs_remember(cache, p_in, params, res, base, deprs, pvrdir, p_out/f"{pvrdir.name}_ext")
+    return res
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -522,6 +588,8 @@ class App(tk.Tk):
         self.geometry("1200x740"); self.minsize(1000,620)
         self.afs_path=tk.StringVar(); self.out_dir=tk.StringVar(value=str(Path.cwd()/ "extracted"))
         self.status=tk.StringVar(value="Ready."); self.replacements={}; self._current_afs=None
+        self.deprs_workers=tk.IntVar(value=1); self.deprs_dedup=tk.BooleanVar(value=False)
+        self.deprs_index=tk.BooleanVar(value=False); self.scan_cache=tk.BooleanVar(value=True)
         self._file_imgtk=None; self.preview_imgtk=None
         self.build_shell(); self.build_tabs()
 
@@ -580,6 +648,12 @@ class App(tk.Tk):
         top2 = ttk.Frame(frm); top2.pack(fill=tk.X, padx=8, pady=(0,6))
         self._btn_full_deprs = ttk.Button(top2, text=self.tr("btn_full_deprs"), command=self.on_full_deprs)
         self._btn_full_deprs.pack(side=tk.LEFT, padx=6)
+        ttk.Label(top2, text=self.tr("deprs_workers")).pack(side=tk.LEFT)
+        ttk.Spinbox(top2, from_=0, to=64, width=4, textvariable=self.deprs_workers).pack(side=tk.LEFT, padx=(2,6))
+        ttk.Checkbutton(top2, text=self.tr("deprs_dedup"), variable=self.deprs_dedup).pack(side=tk.LEFT, padx=(0,6))
+        ttk.Checkbutton(top2, text=self.tr("deprs_index"), variable=self.deprs_index).pack(side=tk.LEFT, padx=(0,6))
+        ttk.Checkbutton(top2, text=self.tr("scan_cache"), variable=self.scan_cache).pack(side=tk.LEFT)
+        ttk.Button(top2, text=self.tr("clear_cache"), command=self.on_clear_cache).pack(side=tk.LEFT, padx=(2,6))
         self._btn_sticker = ttk.Button(top2, text=self.tr("decode_sticker_auto"), command=self.on_decode_sticker_auto)
         self._btn_sticker.pack(side=tk.LEFT)
         try:
@@ -610,10 +684,15 @@ class App(tk.Tk):
         except Exception as e:
             self.status.set(f"AFS parse failed: {e}"); return None
 
+    def _set_current_afs(self, afs):
+        # the previewed archive keeps its handle open until it is replaced
+        old=self._current_afs; self._current_afs=afs
+        if old is not None and old is not afs: old.close()
+
     def on_scan_entries(self):
         self.lst.delete(0, tk.END); afs=self._load_afs()
         if not afs: return
-        self._current_afs=afs
+        self._set_current_afs(afs)
         for e in afs.entries: self.lst.insert(tk.END, f"#{e['index']:04d} off=0x{e['offset']:08X} size=0x{e['size']:06X}")
         self.status.set(self.tr("entries_n", n=len(afs.entries)))
 
@@ -621,7 +700,8 @@ class App(tk.Tk):
         afs=self._load_afs()
         if not afs: return
         out=pathlib.Path(self.out_dir.get() or "."); out.mkdir(parents=True, exist_ok=True)
-        n=afs.extract_all(out); self.status.set(self.tr("extracted_n", n=n, out=out))
+        with afs: n=afs.extract_all(out, workers=self.deprs_workers.get())
+        self.status.set(self.tr("extracted_n", n=n, out=out))
 
     
     
@@ -717,11 +797,11 @@ class App(tk.Tk):
             return gx + gy
 
         total=0
-        with open(afs.path, "rb") as f:
+        with afs:
             for e in afs.entries:
                 if e["size"] != 2080 or e["offset"] <= 0: 
                     continue
-                f.seek(e["offset"]); raw = f.read(e["size"])
+                raw = afs.read_range(e["offset"], e["size"])
                 best_s=None; best_im=None
                 for palmode in ("4444","1555","565","5551"):
                     for even_high in (True, False):
@@ -757,7 +837,8 @@ class App(tk.Tk):
         out = pathlib.Path(self.out_dir.get() or ".")
         out.mkdir(parents=True, exist_ok=True)
         try:
-            res = full_deprs_and_scan(path, str(out))
+            res = full_deprs_and_scan(path, str(out), workers=self.deprs_workers.get(), dedup=self.deprs_dedup.get(),
+                                      index_only=self.deprs_index.get(), cache=self._scan_cache())
             # show summary and where results live
             msg = f"PRS: {res.get('prs_blocks')}  |  PVR/PVP found: {res.get('pvr_found')}\n" \
                   f"DEPRS: {res.get('deprs_dir')}\n" \
@@ -767,13 +848,21 @@ class App(tk.Tk):
         except Exception as e:
             messagebox.showerror("dePRS", str(e))
 
+    def _scan_cache(self):
+            return ScanCache() if self.scan_cache.get() else None
+    def on_clear_cache(self):
+            # explicit invalidation: the selected container's entries, or the whole cache
+            path=self.afs_path.get().strip()
+            n=ScanCache().invalidate(path or None)
+            self.status.set(self.tr("cache_cleared", n=n))
     def on_scan_pvrt(self):
             path=self.afs_path.get().strip()
             if not path: messagebox.showwarning(self.tr("no_file"), self.tr("pick_container")); return
             out=pathlib.Path(self.out_dir.get() or "."); out.mkdir(parents=True, exist_ok=True)
             try:
                 # first attempt: scan the container directly for PVRT
-                pypvr.Pypvr.Decode(args_str=f'"{path}" -o "{out}" -dbg')
+                cache=" -cache" if self.scan_cache.get() else ""
+                pypvr.Pypvr.Decode(args_str=f'"{path}" -o "{out}" -dbg{cache}')
     
                 # after direct scan, check if any PVRT were emitted
                 base = pathlib.Path(path).name
@@ -783,12 +872,12 @@ class App(tk.Tk):
     
                 # PRS fallback: if no PVRT found, try decompress PRS chunks into _DEPRS and scan that folder
                 if not found:
-                    raw = pathlib.Path(path).read_bytes()
                     deprs_dir = ext_dir / "_DEPRS"
-                    n = prs_extract_all_to_folder(raw, str(deprs_dir), entry_label="prs")
+                    with map_file(path) as raw:
+                        n = prs_extract_all_to_folder(raw, str(deprs_dir), entry_label="prs")
                     if n:
                         # scan decompressed blobs recursively
-                        pypvr.Pypvr.Decode(args_str=f'-scandir "{deprs_dir}" -o "{out}" -dbg')
+                        pypvr.Pypvr.Decode(args_str=f'-scandir "{deprs_dir}" -o "{out}" -dbg{cache}')
                         # update pvr_dir check after decompress
                         found = pvr_dir.exists() and any(pvr_dir.glob("*.pvr"))
                 # update status or warn depending on whether anything was found
@@ -809,6 +898,10 @@ class App(tk.Tk):
             sel=self.lst.curselection()
             if not sel: return
             idx=sel[0]; raw=self._current_afs.read_entry_bytes(idx)
+            if raw[:3]==b"PRS":
+                # a compressed entry: decode lazily up to its first texture instead of the whole block
+                found=_prs_first_pvr(raw)
+                if found: raw=found[0]
             try:
                 dec = pypvr.Pypvr.Decode(args_str='-buffer -fmt png -nolog', buff_pvr=raw, buff_pvp=None)
                 img = dec.get_image_buffer()
@@ -866,17 +959,40 @@ class App(tk.Tk):
             p=pathlib.Path(src)
             if p.is_dir():
                 for f in sorted(p.rglob("*")):
-                    if f.suffix.lower() in (".pvr",".pvp",".png",".bmp",".gif",".tga",".jpg",".jpeg"):
-                        self.file_list.insert(tk.END, str(f))
+                    if f.suffix.lower() in (".pvr",".pvp",".pvm",".png",".bmp",".gif",".tga",".jpg",".jpeg") or f.name==AssetIndex.MANIFEST:
+                        self._list_file(f)
             else:
-                self.file_list.insert(tk.END, str(p))
+                self._list_file(p)
+    def _list_file(self, f):
+            self.file_list.insert(tk.END, str(f))
+            if f.suffix.lower()==".pvm":   # one line per texture of the entry table: "<path>#<index> <name>"
+                try:
+                    with map_file(f) as buf:
+                        arc=TextureArchive.parse(buf, 0)
+                        for e in (arc.entries if arc else ()):
+                            self.file_list.insert(tk.END, f"{f}#{e['index']:03d} {e.get('name','')}".rstrip())
+                except (OSError, ValueError): pass
+            elif f.name==AssetIndex.MANIFEST or f.suffix.lower() in (".sqlite",".db"):   # index: "<path>#<record> <name>"
+                try:
+                    for i, r in enumerate(AssetStore.load(f)):
+                        if r["ext"]=="pvr": self.file_list.insert(tk.END, f"{f}#{i:05d} {r['name']}")
+                except (OSError, ValueError, KeyError): pass
     def on_preview_file_select(self, _evt=None):
             if Image is None: return
             sel=self.file_list.curselection()
             if not sel: return
-            p=pathlib.Path(self.file_list.get(sel[0]))
+            item=self.file_list.get(sel[0]); p=pathlib.Path(item)
             try:
-                if p.suffix.lower()==".pvr":
+                if "#" in p.name and not p.exists():   # PVM entry / index record: decode straight from its bytes
+                    path, _, rest = item.rpartition("#")
+                    if path.lower().endswith((".jsonl",".sqlite",".db")):
+                        raw=read_asset(AssetStore.load(path)[int(rest.split()[0])])
+                    else:
+                        with map_file(path) as buf:
+                            arc=TextureArchive.parse(buf, 0)
+                            raw=bytes(arc.view(arc.entries[int(rest.split()[0])]))
+                    img=pypvr.Pypvr.Decode(args_str='-buffer -fmt png -nolog', buff_pvr=raw, buff_pvp=None).get_image_buffer()
+                elif p.suffix.lower()==".pvr":
                     raw=p.read_bytes(); dec=pypvr.Pypvr.Decode(args_str='-buffer -fmt png -nolog', buff_pvr=raw, buff_pvp=None)
                     img=dec.get_image_buffer()
                 else:
@@ -953,6 +1069,11 @@ class App(tk.Tk):
             self.repack_out=tk.StringVar(value=str(Path.cwd()/ "patched.AFS"))
             ttk.Entry(btns, textvariable=self.repack_out, width=50).pack(fill=tk.X, pady=4)
             ttk.Button(btns, text=self.tr("choose"), command=lambda: self._choose_save(self.repack_out)).pack()
+            self.repack_patch=tk.BooleanVar(value=False)
+            ttk.Checkbutton(btns, text=self.tr("repack_patch"), variable=self.repack_patch).pack(anchor="w", pady=4)
+            ttk.Label(btns, text=self.tr("repack_mode"), wraplength=300, justify=tk.LEFT).pack(anchor="w")
+            self.repack_mode=tk.StringVar(value="patch")
+            ttk.Combobox(btns, textvariable=self.repack_mode, values=("patch",)+AFS_STRATEGIES, state="readonly", width=12).pack(anchor="w", pady=4)
             ttk.Separator(btns).pack(fill=tk.X, pady=8)
             ttk.Button(btns, text=self.tr("write_new_afs"), command=self.on_write_repack).pack(fill=tk.X, pady=8)
     def _browse_to(self, var):
@@ -965,7 +1086,7 @@ class App(tk.Tk):
             self.map_list.delete(0, tk.END); p=self.repack_src.get().strip()
             if not p: return
             try:
-                self._current_afs=AFSArchive(p)
+                self._set_current_afs(AFSArchive(p))
             except Exception as e:
                 messagebox.showerror("AFS", str(e)); return
             for e in self._current_afs.entries:
@@ -988,8 +1109,14 @@ class App(tk.Tk):
             if not self.replacements: messagebox.showwarning("AFS", self.tr("no_replacements")); return
             outp=self.repack_out.get().strip()
             try:
-                dst=self._current_afs.replace_in_place(self.replacements, pathlib.Path(outp))
-                self.status.set(self.tr("done")); messagebox.showinfo(self.tr("done"), self.tr("repack_saved", dst=dst))
+                mode=self.repack_mode.get()
+                if mode=="patch":
+                    dst=self._current_afs.replace_in_place(self.replacements, pathlib.Path(outp), self.repack_patch.get())
+                    self.status.set(self.tr("done"))
+                else:
+                    res=self._current_afs.rebuild(self.replacements, pathlib.Path(outp), mode); dst=res["path"]
+                    self.status.set(self.tr("rebuild_stats", **res))
+                messagebox.showinfo(self.tr("done"), self.tr("repack_saved", dst=dst))
             except Exception as e:
                 messagebox.showerror(self.tr("repack_failed"), str(e))
     
@@ -1050,136 +1177,128 @@ class App(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Recipe 3", str(e))
 
-def main():
-    app=App(); app.mainloop()
-
-if __name__=="__main__":
-    main()
+def main(argv=None):
+    """GUI by default; `--deprs INPUT [-o OUT] [-j N]` runs Full dePRS headless."""
+    import argparse
+    ap=argparse.ArgumentParser(description="TXR2 Texture Toolkit")
+    ap.add_argument("--deprs", metavar="INPUT", help="recursive PRS unpack + PVRT/PVPL scan, no GUI")
+    ap.add_argument("-o", "--out", default="extracted", help="output folder for --deprs")
+    ap.add_argument("-j", "--workers", type=int, default=1, help="dePRS worker processes (0 = one per CPU)")
+    ap.add_argument("--max-depth", type=int, default=6)
+    ap.add_argument("--align", metavar="SPEC", help='aligned signature scan, e.g. "4" or "4,AFS=2048"')
+    ap.add_argument("--regions", action="store_true", help="skip padding/noise sectors (map cached as OUT/<name>.rmap)")
+    ap.add_argument("--dedup", action="store_true", help="write each distinct asset once (by hash) + manifest.jsonl")
+    ap.add_argument("--index-only", action="store_true", help="write no assets, only an index of every hit (PVR dir/index.jsonl)")
+    ap.add_argument("--cache", nargs="?", const="", metavar="DIR",
+                    help="reuse results for an unchanged input (default dir: $TXR2_SCAN_CACHE or ~/.cache/txr2_toolkit/scan)")
+    ap.add_argument("--cache-limit", type=int, default=1024, metavar="MB", help="evict old cache entries above this size")
+    ap.add_argument("--clear-cache", action="store_true", help="drop the cache entries of INPUT (all without --deprs)")
+    args=ap.parse_args(argv)
+    cache=ScanCache(args.cache or None, args.cache_limit<<20) if args.cache is not None or args.clear_cache else None
+    if args.clear_cache:
+        print(f"cache entries removed: {cache.invalidate(args.deprs)}")
+        if args.cache is None: cache=None
+        if not args.deprs: return
+    if args.deprs:
+        res=full_deprs_and_scan(args.deprs, args.out, max_depth=args.max_depth, workers=args.workers,
+                                align=parse_align(args.align) if args.align else None, regions=args.regions,
+                                dedup=args.dedup, index_only=args.index_only, cache=cache)
+        for k,v in res.items(): print(f"{k}: {v}")
+        return
+    app=App(); app.deprs_workers.set(args.workers); app.mainloop()
 
 # ====== FINAL PATCH BLOCK (appended) ======
 
 # Robust AFS reader supporting embedded AFS and sector-sized tables
-class __PatchedAFSArchive:
+class __PatchedAFSArchive(EntryReader):
     def __init__(self, path):
-        from pathlib import Path as _P
-        self.path=_P(path); self.entries=[]; self.base=0
-        self._read()
-
-    @staticmethod
-    def _u32(b,o): return int.from_bytes(b[o:o+4], "little")
-    @staticmethod
-    def _ok(total, off, size): return (0 <= off < total) and (0 < size <= total - off)
+        self._open(path); self.entries=[]; self.base=0
+        try: self._read()
+        except Exception: self.close(); raise
 
     def _read(self):
-        data=self.path.read_bytes(); total=len(data)
-        pos=data.find(b"AFS\x00")
-        if pos==-1: raise ValueError("AFS not found")
-        n=self._u32(data, pos+4); table=pos+12
-        pairs=[(self._u32(data, table+i*8+0), self._u32(data, table+i*8+4)) for i in range(n)]
-        cand=[]
-        for mode in ("a_abs","b_abs","a_rel","b_rel"):
-            for mul_off in (1,2048):
-                for mul_sz in (1,2048):
-                    ok=0; ent=[]
-                    for i,(a,b) in enumerate(pairs):
-                        if   mode=="a_abs": off,size=a*mul_off, b*mul_sz
-                        elif mode=="b_abs": off,size=b*mul_off, a*mul_sz
-                        elif mode=="a_rel": off,size=pos + a*mul_off, b*mul_sz
-                        else:               off,size=pos + b*mul_off, a*mul_sz
-                        if self._ok(total, off, size): ok+=1
-                        ent.append({"index":i,"offset":off,"size":size})
-                    cand.append((ok, ent))
-        cand.sort(key=lambda x:x[0], reverse=True)
-        best=cand[0][1]
-        self.entries=[e for e in best if self._ok(total, e["offset"], e["size"])]
-        self.base=pos
-
-    def read_entry_bytes(self, idx):
-        e = self.entries[idx]
-        with open(self.path, "rb") as f:
-            f.seek(e["offset"])
-            return f.read(e["size"])
-
-    def extract_all(self, out_dir):
-        from pathlib import Path as _P
-        out=_P(out_dir); out.mkdir(parents=True, exist_ok=True); n=0
-        with open(self.path, "rb") as f:
-            for e in self.entries:
-                f.seek(e["offset"]); (out/f"{e['index']:04d}.bin").write_bytes(f.read(e["size"])); n+=1
-        return n
+        # header + TOC only; the 16 offset/size layouts are scored in one NumPy pass (scanners.afs_toc)
+        self.base, self.entries = afs_toc(self._fp)
+
+    def extract_all(self, out_dir, indices=None, kinds=None, workers=0):
+        # kernel-side copies on a thread pool (EntryReader.extract)
+        return self.extract(out_dir, "{index:04d}.bin", indices, kinds, workers)
+
+    def replace_in_place(self, repl, out_path, in_place=False):
+        return self.repack(repl, out_path, in_place)
+
+# PVRT/PVPL scan with GBIX inclusion (leaf scanner of the patched dePRS)
+def __scan_pvrt_pvpl_gbix(buf: bytes, out, tag: str, origin: str, regions=None, store=None, hits=None):
+    def _u32(b,o): return int.from_bytes(b[o:o+4],'little')
+    out.mkdir(parents=True, exist_ok=True); L=len(buf); c={"pvr":0,"pvp":0}
+    put=(lambda p, d, a, b: store.carve(p, d, a, b, f"{tag}_{origin}")) if store is not None else carve_to
+    if hits is None: hits=HitTable(buf, (b"PVRT", b"PVPL", b"GBIX"), regions=regions)
+    def _maybe_gbix(start):
+        look=max(0,start-32); g=hits.prev_tag(look, start-3, b"GBIX")
+        if g!=-1 and g+8<=L:
+            try:
+                n=_u32(buf,g+4)
+                if g+8+n==start: return g
+            except: pass
+        return start
+    for pos in hits.offsets(b"PVRT"):
+        hdr=pvrt_header(buf,pos)
+        if hdr is not None:
+            st=_maybe_gbix(pos); put(out/f"{tag}_{origin}_pvrt_{pos:08X}.pvr", buf, st, hdr[4]); c["pvr"]+=1
+    for pos in hits.offsets(b"PVPL"):
+        if pos+8<=L:
+            size=_u32(buf,pos+4)+8
+            if 0<size<=L-pos:
+                put(out/f"{tag}_{origin}_pvpl_{pos:08X}.pvp", buf, pos, pos+size); c["pvp"]+=1
+    return c
 
 # DePRS + PVRT scan (base + leaves) with GBIX inclusion
-def __patched_full_deprs_and_scan(input_path: str, out_dir: str, max_depth: int = 6):
+def __patched_full_deprs_and_scan(input_path: str, out_dir: str, max_depth: int = 6, workers: int = 1,
+                                  regions: bool = False, dedup: bool = False, index_only: bool = False,
+                                  cache=None):
     import re
     from pathlib import Path as _P
-    def _u32(b,o): return int.from_bytes(b[o:o+4],'little')
-    def _scan(buf: bytes, out: _P, tag: str, origin: str):
-        out.mkdir(parents=True, exist_ok=True); L=len(buf); c={"pvr":0,"pvp":0}
-        def _maybe_gbix(start):
-            look=max(0,start-32); g=buf.rfind(b"GBIX", look, start)
-            if g!=-1 and g+8<=L:
-                try:
-                    n=_u32(buf,g+4)
-                    if g+8+n==start: return g
-                except: pass
-            return start
-        for m in re.finditer(b"PVRT", buf):
-            pos=m.start()
-            if pos+8<=L:
-                size=_u32(buf,pos+4)+8
-                if 0<size<=L-pos:
-                    st=_maybe_gbix(pos); (out/f"{tag}_{origin}_pvrt_{pos:08X}.pvr").write_bytes(buf[st:pos+size]); c["pvr"]+=1
-        for m in re.finditer(b"PVPL", buf):
-            pos=m.start()
-            if pos+8<=L:
-                size=_u32(buf,pos+4)+8
-                if 0<size<=L-pos:
-                    (out/f"{tag}_{origin}_pvpl_{pos:08X}.pvp").write_bytes(buf[pos:pos+size]); c["pvp"]+=1
-        return c
 
     p_in=_P(input_path); p_out=_P(out_dir); p_out.mkdir(parents=True, exist_ok=True)
-    data=p_in.read_bytes(); base=p_in.stem
-    ddir=p_out/f"{base}_DEPRS"; sdir=p_out/f"{base}_DEPRS_PVR"; ddir.mkdir(exist_ok=True); sdir.mkdir(exist_ok=True)
-
-    c_base=_scan(data, sdir, base, "base")
-
-    leaves=[]
-    def _prs(buf,pos):
-        try:
-            out,used=_prs_decompress_auto(buf,pos)
-            if out and used: return out,used
-        except Exception: pass
-        return None,None
-
-    import re
-    def rec(buf, tag, d):
-        found=False
-        for m in re.finditer(b"PRS", buf):
-            found=True
-            pos=m.start(); out,used=_prs(buf,pos)
-            if out:
-                name=f"{tag}_d{d}_@{pos:08X}"; (ddir/f"{name}.bin").write_bytes(out)
-                if d<max_depth and b"PRS" in out: rec(out, name, d+1)
-                else: leaves.append((name,out))
-        if not found:
-            leaves.append((f"{tag}_raw", buf))
-    rec(data, base, 0)
+    base=p_in.stem
+    ddir=p_out/f"{base}_DEPRS"; sdir=p_out/f"{base}_DEPRS_PVR"
+    params={"out": str(p_out.resolve()), "scan": "gbix", "max_depth": max_depth,
+            "regions": bool(regions), "dedup": bool(dedup), "index_only": bool(index_only)}
+    res=_deprs_cached(cache, p_in, params)
+    if res is not None: return res
+    ddir.mkdir(exist_ok=True); sdir.mkdir(exist_ok=True)
 
     c_leaf={"pvr":0,"pvp":0}
-    for name,buf in leaves:
-        r=_scan(buf, sdir, name, "leaf")
-        c_leaf["pvr"]+=r["pvr"]; c_leaf["pvp"]+=r["pvp"]
+    stats={"prs_hits":0,"prs_probes":0,"prs_accepted":0,"prs_skipped":0}
+    workers=_deprs_workers(workers)
+
+    with map_file(p_in) as data:
+        rm=RegionMap.for_file(p_in, p_out/f"{base}.rmap", data) if regions else None
+        store=_deprs_sink(sdir, p_in.name, dedup, index_only)
+        hits=HitTable.for_file(p_in, (b"PVRT", b"PVPL", b"GBIX"), regions=rm, workers=workers, cache=cache) \
+            if workers>1 or cache is not None else None
+        c_base=__scan_pvrt_pvpl_gbix(data, sdir, base, "base", rm, store, hits)
+        if workers>1:
+            _deprs_parallel(p_in, data, base, max_depth, ddir, sdir, "gbix", workers, stats, c_leaf, regions=rm, store=store)
+        else:
+            _deprs_rec(data, base, 0, max_depth, ddir, PRSVariantCache(AUTO_VARIANTS, strict=False),
+                       stats, _deprs_leaf("gbix", sdir, c_leaf, store=store), rm)
+        prs_blocks=len(list(re.finditer(b"PRS", data)))
+    if store is not None:
+        stats["manifest"]=str(store.save()); stats.update(store.summary())
 
     total=c_base["pvr"]+c_base["pvp"]+c_leaf["pvr"]+c_leaf["pvp"]
-    if total>0:
+    if total>0 and not index_only:
         try:
-            pypvr.Pypvr.Decode(args_str=f'-scandir "{sdir}" -o "{p_out}" -fmt png -nolog')
+            pypvr.Pypvr.Decode(args_str=f'-scandir "{sdir}" -o "{p_out}" -fmt png -nolog -j {workers}')
         except Exception: pass
 
-    return {"prs_blocks": len(list(re.finditer(b"PRS", data))),
-            "base_pvr": c_base["pvr"], "base_pvp": c_base["pvp"],
-            "leaf_pvr": c_leaf["pvr"], "leaf_pvp": c_leaf["pvp"],
-            "total_pvrpvp": total, "deprs_dir": str(ddir), "pvr_dir": str(sdir)}
+    res={"prs_blocks": prs_blocks,
+         "base_pvr": c_base["pvr"], "base_pvp": c_base["pvp"],
+         "leaf_pvr": c_leaf["pvr"], "leaf_pvp": c_leaf["pvp"],
+         "total_pvrpvp": total, "deprs_dir": str(ddir), "pvr_dir": str(sdir), **stats}
+    _deprs_remember(cache, p_in, params, res, base, ddir, sdir, p_out/f"{sdir.name}_ext")
+    return res
 
 # Monkey-patch App to use robust AFS + fallback PVRT list + detailed dePRS report
 try:
@@ -1199,7 +1318,7 @@ def __patched_on_scan_entries(self):
         if not path:
             messagebox.showwarning(self.tr("no_file"), self.tr("pick_container")); return
         try:
-            afs = __PatchedAFSArchive(path); self._current_afs = afs
+            afs = __PatchedAFSArchive(path); self._set_current_afs(afs)
             for e in afs.entries:
                 self.lst.insert(
                     tk.END,
@@ -1209,22 +1328,24 @@ def __patched_on_scan_entries(self):
         except Exception as e:
             # Фоллбэк: нет AFS — покажем найденные PVRT/PVPL как «виртуальные» записи
             try:
-                buf = _P(path).read_bytes()
                 def _u32(b, o): return int.from_bytes(b[o:o+4], 'little')
                 idx = 0
-                for tag in ("PVRT", "PVPL"):
-                    for m in re.finditer(tag.encode(), buf):
-                        pos = m.start()
-                        if pos + 8 <= len(buf):
-                            size = _u32(buf, pos+4) + 8
-                            if 0 < size <= len(buf) - pos:
-                                name = f"{tag}_{idx:04d}."+("pvr" if tag=="PVRT" else "pvp")
-                                self.lst.insert(
-                                    tk.END,
-                                    f"#{idx:04d} off=0x{pos:08X} size=0x{size:06X} {name}"
-                                )
-                                idx += 1
-                self._current_afs = None
+                with map_file(path) as buf:
+                    hits = HitTable(buf, (b"PVRT", b"PVPL"))
+                    for tag in ("PVRT", "PVPL"):
+                        for pos in hits.offsets(tag.encode()):
+                            if tag == "PVRT" and pvrt_header(buf, pos) is None:
+                                continue
+                            if pos + 8 <= len(buf):
+                                size = _u32(buf, pos+4) + 8
+                                if 0 < size <= len(buf) - pos:
+                                    name = f"{tag}_{idx:04d}."+("pvr" if tag=="PVRT" else "pvp")
+                                    self.lst.insert(
+                                        tk.END,
+                                        f"#{idx:04d} off=0x{pos:08X} size=0x{size:06X} {name}"
+                                    )
+                                    idx += 1
+                self._set_current_afs(None)
                 if idx == 0:
                     self.status.set(self.tr("no_afs_try_deprs"))
                 else:
@@ -1235,11 +1356,15 @@ def __patched_on_scan_entries(self):
 def __patched_on_full_deprs(self):
         path=self.afs_path.get().strip()
         out=self.out_dir.get().strip() or str(Path(path).with_name("extracted"))
-        res=__patched_full_deprs_and_scan(path, out)
+        res=__patched_full_deprs_and_scan(path, out, workers=self.deprs_workers.get(), dedup=self.deprs_dedup.get(),
+                                          index_only=self.deprs_index.get(), cache=self._scan_cache())
         msg=(f"PRS найдено: {res.get('prs_blocks')}\\n"
              f"PVR/PVP в базе: {res.get('base_pvr')} / {res.get('base_pvp')}\\n"
              f"PVR/PVP в распакованных слоях: {res.get('leaf_pvr')} / {res.get('leaf_pvp')}\\n"
              f"ИТОГО PVR/PVP: {res.get('total_pvrpvp')}\\n"
+             f"PRS проба: {res.get('prs_hits')} / {res.get('prs_probes')} / {res.get('prs_accepted')} (hits/probes/accepted)\\n"
+             +(f"Уникальных: {res.get('unique')} из {res.get('assets')}\\n" if 'unique' in res else "")+
+             (f"Индекс: {res.get('manifest')}\\n" if 'manifest' in res else "")+
              f"DEPRS: {res.get('deprs_dir')}\\n"
              f"PVR DIR: {res.get('pvr_dir')}")
         messagebox.showinfo("dePRS", msg)
@@ -1279,68 +1404,16 @@ except Exception:
 
 
 # ====== ROBUST PVRT/PVPL SCAN PATCH (size heuristics, GBIX merge, next-header bound) ======
-def __pvrt_guess_size(buf: bytes, pos: int):
-    """Return a safe (start, size) for the PVRT chunk at pos.
-       Strategy: prefer header size; if invalid -> use width/height/format heuristic;
-       maximum bounded by next header (PVRT/PVPL/GBIX) or EOF."""
-    import re, struct
-    L = len(buf)
-
-    def u16(o): 
-        if o+2<=L: return int.from_bytes(buf[o:o+2],'little')
-        return 0
-    def u32(o): 
-        if o+4<=L: return int.from_bytes(buf[o:o+4],'little')
-        return 0
-
-    # 1) try native size field
-    size = u32(pos+4) + 8
-    if 0 < size <= L - pos:
-        return pos, size
-
-    # 2) parse width/height and formats to estimate data size
-    px = buf[pos+8] if pos+9<=L else 0
-    tx = buf[pos+9] if pos+10<=L else 0
-    w  = u16(pos+12); h = u16(pos+14)
-    # sanity
-    if not (4 <= w <= 2048 and 4 <= h <= 2048):
-        # give up: bound by next header or EOF
-        nxt = min([i for i in [buf.find(b"PVRT", pos+4), buf.find(b"PVPL", pos+4), buf.find(b"GBIX", pos+4)] if i!=-1] or [L])
-        return pos, max(0, min(L - pos, nxt - pos))
-    # estimate bytes after header (data only)
-    bpp_guess = 2  # default direct-color 16bpp
-    data_guess = None
-    # texture mode rough groups (see PyPVR)
-    pal4 = {5,6}
-    pal8 = {7,8}
-    vq   = {3,4,16,17}
-    rect = {9,10,11,12,14,15,18}
-    if tx in pal4:
-        data_guess = (w*h)//2
-    elif tx in pal8:
-        data_guess = (w*h)
-    elif tx in vq:
-        # indices + codebook (heuristic); add mips slack
-        indices = (w*h)//4
-        codebook = 2048  # typical
-        data_guess = indices + codebook + 0x800  # slack for mips
-    elif tx in rect:
-        # rectangle/stride/bmp; use px to decide 16 or 32 bpp
-        if px in (7,14,18):
-            bpp_guess = 4
-        data_guess = w*h*bpp_guess
-    else:
-        data_guess = w*h*bpp_guess
-    est_size = 0x10 + data_guess  # header ~16 bytes
-    # 3) bound by next header if any
-    nxt = min([i for i in [buf.find(b"PVRT", pos+4), buf.find(b"PVPL", pos+4), buf.find(b"GBIX", pos+4)] if i!=-1] or [L])
-    size = min(est_size, L - pos, nxt - pos if nxt>pos else L - pos)
-    # sanity lower bound
-    if size < 0x20: size = min(L - pos, (nxt - pos) if nxt>pos else (L - pos))
-    return pos, size
-
-def __pvpl_guess_size(buf: bytes, pos: int):
+def __pvrt_guess_size(buf: bytes, pos: int, hits: HitTable = None):
+    """Return (start, size) for the PVRT chunk at pos; size 0 when the header fails
+       scanners.pvrt_header() (unknown/illegal format, bad dimensions, or a size
+       field smaller than the layout), so nothing is carved for it."""
+    hdr = pvrt_header(buf, pos)
+    return (pos, hdr[4] - pos) if hdr is not None else (pos, 0)
+
+def __pvpl_guess_size(buf: bytes, pos: int, hits: HitTable = None):
     L=len(buf)
+    if hits is None: hits = HitTable(buf)
     def u16(o): 
         if o+2<=L: return int.from_bytes(buf[o:o+2],'little')
         return 0
@@ -1360,19 +1433,19 @@ def __pvpl_guess_size(buf: bytes, pos: int):
         size = 0x10 + payload
     else:
         size = 0x40  # minimal
-    nxt = min([i for i in [buf.find(b"PVRT", pos+4), buf.find(b"PVPL", pos+4), buf.find(b"GBIX", pos+4)] if i!=-1] or [L])
+    nxt = hits.next_tag(pos+4, (b"PVRT", b"PVPL", b"GBIX"))
     size = min(size, L - pos, nxt - pos if nxt>pos else L-pos)
     if size < 0x10: size = min(L - pos, (nxt - pos) if nxt>pos else (L-pos))
     return pos, size
 
-def __maybe_gbix_start(buf: bytes, start: int):
+def __maybe_gbix_start(buf: bytes, start: int, hits: HitTable = None):
     """If GBIX is immediately before PVRT (GBIX + 8 + length == PVRT), include it."""
     L=len(buf)
     def u32(o): 
         if o+4<=L: return int.from_bytes(buf[o:o+4],'little')
         return 0
     look=max(0, start-32)
-    g=buf.rfind(b"GBIX", look, start)
+    g=hits.prev_tag(look, start-3, b"GBIX") if hits is not None else buf.rfind(b"GBIX", look, start)
     if g!=-1 and g+8<=L:
         try:
             n=u32(g+4)
@@ -1380,51 +1453,74 @@ def __maybe_gbix_start(buf: bytes, start: int):
         except: pass
     return start
 
-def robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str):
+def robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str, align=None, regions=None, store=None,
+                       hits=None):
     """Improved scanner used by Full dePRS and 'Find PVRT'.
-       Writes .pvr/.pvp with GBIX merge; returns counters."""
+       Writes .pvr/.pvp with GBIX merge; returns counters.
+       All signatures come from one HitTable pass (aligned mode with `align`,
+       padding sectors of `regions` skipped); chunk ends are bisected from it.
+       `in_bytes` may be a map_file() map: chunks are carved from it with carve_to().
+       PVM/GVM archives are split by their entry table into <archive>_EXT/<index>_<name>.pvr.
+       With `store` (scanners.AssetStore) every chunk goes to the dedup store instead;
+       `hits` is a prebuilt HitTable of in_bytes (HitTable.for_file() on a pool)."""
     import os, re
     from pathlib import Path as _P
     out=_P(out_dir); out.mkdir(parents=True, exist_ok=True)
     c={"pvr":0,"pvp":0}
+    put=(lambda p, d, a, b: store.carve(p, d, a, b, f"{tag}_{origin}")) if store is not None else carve_to
+    if hits is None: hits=HitTable(in_bytes, align=align, regions=regions)
+    # PVM/GVM archives: textures in the entry table are written under their own names
+    arcs={}; in_arc=set()
+    for sig in (b"PVMH", b"GVMH"):
+        for pos in hits.offsets(sig):
+            arc = TextureArchive.parse(in_bytes, pos)
+            if arc is None: continue
+            arcs[pos] = arc; ext = "pvm" if sig == b"PVMH" else "gvm"
+            sub = _P(out) / f"{tag}_{origin}_{ext}_{pos:08X}_EXT"
+            if store is None: sub.mkdir(exist_ok=True)
+            for e in arc.entries:
+                put(sub / arc.file_name(e), in_bytes, e["offset"], e["offset"] + e["size"])
+                k = "pvr" if ext == "pvm" else "gvr"
+                c[k] = c.get(k, 0) + 1; in_arc.add(e["data"])
     # PVRT scanning (Dreamcast PowerVR textures)
-    for m in re.finditer(b"PVRT", in_bytes):
-        pos = m.start()
-        st, sz = __pvrt_guess_size(in_bytes, pos)
+    for pos in hits.offsets(b"PVRT"):
+        if pos in in_arc: continue
+        st, sz = __pvrt_guess_size(in_bytes, pos, hits)
         if sz > 0:
             # include GBIX if adjacent
-            (_P(out) / f"{tag}_{origin}_pvrt_{pos:08X}.pvr").write_bytes(
-                in_bytes[__maybe_gbix_start(in_bytes, st):pos + sz]
-            )
+            put(_P(out) / f"{tag}_{origin}_pvrt_{pos:08X}.pvr", in_bytes,
+                     __maybe_gbix_start(in_bytes, st, hits), pos + sz)
             c["pvr"] += 1
+        else:
+            c["pvr_suspect"] = c.get("pvr_suspect", 0) + 1
 
     # PVPL scanning (palette blocks)
-    for m in re.finditer(b"PVPL", in_bytes):
-        pos = m.start()
-        st, sz = __pvpl_guess_size(in_bytes, pos)
+    for pos in hits.offsets(b"PVPL"):
+        st, sz = __pvpl_guess_size(in_bytes, pos, hits)
         if sz > 0:
-            (_P(out) / f"{tag}_{origin}_pvpl_{pos:08X}.pvp").write_bytes(in_bytes[pos:pos + sz])
+            put(_P(out) / f"{tag}_{origin}_pvpl_{pos:08X}.pvp", in_bytes, pos, pos + sz)
             c["pvp"] += 1
 
     # TIM2/TM2F scanning (PlayStation 2 TIM2 textures)
     # These signatures mark PS2 texture containers used in games like Tokyo Xtreme Racer 0/3.
     # We search for either 'TIM2' or 'TM2F' and extract until the next known header or EOF.
     for sig in (b"TIM2", b"TM2F"):
-        for m in re.finditer(sig, in_bytes):
-            pos = m.start()
-            # Determine end by finding the nearest next header (TIM2/TM2F/PVRT/PVPL/GBIX/PRS/AFS)
-            next_positions = []
-            for hdr in (b"TIM2", b"TM2F", b"PVRT", b"PVPL", b"GBIX", b"PRS", b"AFS"):
-                i = in_bytes.find(hdr, pos + 4)
-                if i != -1:
-                    next_positions.append(i)
-            end = min(next_positions) if next_positions else len(in_bytes)
-            # sanity: minimal 0x80 bytes to avoid too short segments
-            size = end - pos
-            if size >= 0x80:
-                ext = "tm2" if sig == b"TIM2" else "tm2f"
+        ext = "tm2" if sig == b"TIM2" else "tm2f"
+        for pos in hits.offsets(sig):
+            if sig in EXTENTS:
+                # exact extent from the picture headers; nothing is carved for a bad header
+                r = EXTENTS[sig](in_bytes, pos)
+                if r is None:
+                    c[f"{ext}_suspect"] = c.get(f"{ext}_suspect", 0) + 1; continue
+                size = r[1] - pos
+            else:
+                # Determine end by finding the nearest next header (TIM2/TM2F/PVRT/PVPL/GBIX/PRS/AFS)
+                end = hits.next_tag(pos + 4, (b"TIM2", b"TM2F", b"PVRT", b"PVPL", b"GBIX", b"PRS", b"AFS\x00"))
+                # sanity: minimal 0x80 bytes to avoid too short segments
+                size = end - pos
+            if size >= 0x80 or sig in EXTENTS:
                 try:
-                    (_P(out) / f"{tag}_{origin}_{ext}_{pos:08X}.{ext}").write_bytes(in_bytes[pos:pos + size])
+                    put(_P(out) / f"{tag}_{origin}_{ext}_{pos:08X}.{ext}", in_bytes, pos, pos + size)
                     c.setdefault(ext, 0)
                     c[ext] += 1
                 except Exception:
@@ -1434,19 +1530,16 @@ def robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str):
     # Some Dreamcast and Naomi titles bundle multiple PVR textures in PVM/GVM containers.
     # We search for the 'PVMH' or 'GVMH' signature and extract until the next known header.
     for sig in (b"PVMH", b"GVMH"):
-        for m in re.finditer(sig, in_bytes):
-            pos = m.start()
-            next_positions = []
-            for hdr in (b"PVMH", b"GVMH", b"TIM2", b"TM2F", b"PVRT", b"PVPL", b"GBIX", b"PRS", b"AFS"):
-                i = in_bytes.find(hdr, pos + 4)
-                if i != -1:
-                    next_positions.append(i)
-            end = min(next_positions) if next_positions else len(in_bytes)
-            size = end - pos
+        for pos in hits.offsets(sig):
+            if pos in arcs:
+                size = arcs[pos].end - pos
+            else:
+                end = hits.next_tag(pos + 4, (b"PVMH", b"GVMH", b"TIM2", b"TM2F", b"PVRT", b"PVPL", b"GBIX", b"PRS", b"AFS\x00"))
+                size = end - pos
             if size >= 0x80:
                 ext = "pvm" if sig == b"PVMH" else "gvm"
                 try:
-                    (_P(out) / f"{tag}_{origin}_{ext}_{pos:08X}.{ext}").write_bytes(in_bytes[pos:pos + size])
+                    put(_P(out) / f"{tag}_{origin}_{ext}_{pos:08X}.{ext}", in_bytes, pos, pos + size)
                     c.setdefault(ext, 0)
                     c[ext] += 1
                 except Exception:
@@ -1455,4 +1548,6 @@ def robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str):
     return c
 
 
-# (monkey patch removed in modular version)
\ No newline at end of file
+# after the patch block, so the script runs the same scanners as an imported main()
+if __name__=="__main__":
+    main()
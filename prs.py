@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+"""
+PRS decode engine shared by scanners.py and gui_app.py.
+
+Variants (control bits are read LSB-first and interleaved with data bytes):
+- "basic"      : CRI/SEGA PRS; long refs use a 0x2000 window, short refs a 0x100 window
+- "nights"     : NiGHTS LZS bitstream (12-bit offsets, 3-bit counts in the 3-byte form)
+- "nights_ext" : NiGHTS LZS with 11-bit counts in the 3-byte form (old gui_app decoder)
+
+Main entries:
+    prs_decompress(buf, start=0, variant="basic") -> (bytes, consumed) or (None, 0)
+    prs_decode_block(buf, start=0, variant="basic") -> (bytes, consumed) or (None, 0)
+        stops at the end-of-stream marker; `consumed` is the exact compressed extent
+    prs_probe(buf, start=0, variant="basic") -> bool
+        cheap pre-check on the first few dozen commands, run before a full decode
+    PRSVariantCache(candidates).decode(buf, start)
+        picks the variant (and bit order) once per container / AFS entry and reuses it
+    PRSStreamDecoder(variant).feed(chunk) / .flush() -> bytes
+        incremental decoder keeping only the 0x2000-byte window; can write to a sink
+        or spill to a temporary file
+    prs_decompress_to(src, sink, start=0, variant="basic") -> (written, consumed) or (0, 0)
+        streams one block from a buffer, mmap or open file into `sink`
+    PRSView(buf, start=0, variant="basic", cache=None)[a:b]
+        random access into a block's output, resumed from decoder checkpoints
+    prs_compress(data, variant="basic", level=6) -> bytes
+        hash-chain encoder (levels 1-3 greedy, 4-9 lazy), stream ends with a stop code
+    prs_reimport(path, block_offset, patch_offset, data, variant="basic")
+        decompress a block in a file, patch its output, recompress into the same slot
+    prs_note_source(bin_path, source, block_offset, variant) / prs_reimport_into(bin_path, offset, data)
+        remember where a decoded block came from; patch it and recompress it back there
+        (and on up through blocks nested in decoded blocks)
+
+Notes:
+- Output is byte-identical to the old closure-based decoders, including their
+  end-of-buffer behaviour (basic pads with zeros, NiGHTS stops at the last whole command).
+- Literal runs are copied as slices via a per-control-byte table; back-references are
+  copied as whole slices, overlapping (RLE-style) ones with a doubling copy.
+"""
+from __future__ import annotations
+import os, json, struct, tempfile, zlib
+from bisect import bisect_right
+
+VARIANTS = ("basic", "nights", "nights_ext")
+
+# decoder states returned by the inner loops
+_NEED, _EOF, _END, _BAD = 0, 1, 2, 3
+
+_MAXCMD = 4          # worst case bytes per command: one control reload + 3 data bytes
+_SLICE = 1 << 12     # input bytes decoded per inner-loop call (bounds the runaway check)
+_WINDOW = 0x2000     # farthest back-reference of any variant
+
+# Dreamcast main RAM is 16 MB; no real block decompresses past it.
+PRS_MAX_OUT = 16 * 1024 * 1024
+# prs_probe(): commands looked at, and the least output a block may stop after
+PROBE_COMMANDS = 48
+PROBE_MIN_OUT = 16
+PROBE_SPAN = PROBE_COMMANDS * _MAXCMD   # most input bytes a probe reads past the tag
+
+# Control bits are kept in `cmd` with a sentinel bit above the pending ones, so
+# cmd == 1 means "no bits left".  _LITRUN[cmd] = number of pending literal (1) bits.
+def _litrun(c: int) -> int:
+    n = 0
+    while c > 1 and c & 1:
+        n += 1; c >>= 1
+    return n
+
+_LITRUN = bytes(_litrun(c) for c in range(1024))
+# per-byte bit reversal, for streams stored with the opposite bit order
+_BITREV = bytes(int(f'{c:08b}'[::-1], 2) for c in range(256))
+# basic short ref: two count bits (first one is the high bit) -> amount
+_SHORT = (2, 4, 3, 5)
+
+
+def _copy_back(out: bytearray, sp: int, amount: int):
+    """Append `amount` bytes starting at out[sp]; sp < 0 yields zeros (basic only)."""
+    if sp < 0:
+        z = min(-sp, amount)
+        out += bytes(z); sp += z; amount -= z
+        if not amount:
+            return
+    span = len(out) - sp
+    while amount > span:            # overlapping: double the repeated pattern each pass
+        out += out[sp:sp+span]; amount -= span; span += span
+    out += out[sp:sp+amount]
+
+
+# --------------------------- inner loops ---------------------------
+def _run_basic(src, i: int, n: int, stop: int, cmd: int, out: bytearray, strict: bool):
+    """Decode whole commands starting at i <= stop (caller guarantees stop + _MAXCMD <= n)."""
+    litrun = _LITRUN; short = _SHORT
+    while i <= stop:
+        if cmd == 1:
+            cmd = src[i] | 0x100; i += 1
+        if cmd & 1:
+            k = litrun[cmd]
+            if i + k > n: k = n - i
+            out += src[i:i+k]; i += k; cmd >>= k
+            continue
+        cmd >>= 1
+        if cmd == 1:
+            cmd = src[i] | 0x100; i += 1
+        if cmd & 1:
+            cmd >>= 1
+            a = src[i]; b = src[i+1]; i += 2
+            if strict and not (a | b):
+                return i, cmd, _END
+            amount = a & 7
+            if amount: amount += 2
+            else: amount = src[i] + 1; i += 1
+            d = 0x2000 - (((b << 8) | a) >> 3)
+        else:
+            cmd >>= 1
+            if cmd < 4:   # count bits straddle a control byte
+                if cmd == 1: cmd = src[i] | 0x100
+                else: cmd = ((src[i] | 0x100) << 1) | (cmd & 1)
+                i += 1
+            amount = short[cmd & 3]; cmd >>= 2
+            d = 0x100 - src[i]; i += 1
+        sp = len(out) - d
+        if sp >= 0 and amount <= d: out += out[sp:sp+amount]
+        else: _copy_back(out, sp, amount)
+    return i, cmd, _NEED
+
+def _run_nights(src, i: int, n: int, stop: int, cmd: int, out: bytearray, strict: bool, ext: bool = False):
+    litrun = _LITRUN
+    while i <= stop:
+        if cmd == 1:
+            cmd = src[i] | 0x100; i += 1
+        if cmd & 1:
+            k = litrun[cmd]
+            if i + k > n: k = n - i
+            out += src[i:i+k]; i += k; cmd >>= k
+            continue
+        cmd >>= 1
+        if cmd == 1:
+            cmd = src[i] | 0x100; i += 1
+        if cmd & 1:
+            cmd >>= 1
+            a = src[i]; b = src[i+1]; i += 2
+            d = ((b & 0xF0) << 4) | a
+            if not d:
+                return i, cmd, _END
+            amount = (b & 0x0F) + 3
+        else:
+            cmd >>= 1
+            a = src[i]; b = src[i+1]; c = src[i+2]; i += 3
+            if ext:
+                amount = (a | ((b & 0xE0) << 3)) + 2; d = ((b & 0x1F) << 8) | c
+            else:
+                amount = ((c & 0xE0) >> 5) + 2; d = ((c & 0x1F) << 8) | b
+            if not d:
+                return i, cmd, _BAD
+        sp = len(out) - d
+        if sp < 0:
+            return i, cmd, _BAD
+        if amount <= d: out += out[sp:sp+amount]
+        else: _copy_back(out, sp, amount)
+    return i, cmd, _NEED
+
+def _run_nights_ext(src, i, n, stop, cmd, out, strict):
+    return _run_nights(src, i, n, stop, cmd, out, strict, True)
+
+
+# --------------------------- exact end-of-buffer handling ---------------------------
+def _tail_basic(src, i: int, n: int, cmd: int, out: bytearray, strict: bool):
+    """Last few commands with the old decoder's semantics: missing bits/bytes read as 0."""
+    def bit():
+        nonlocal cmd, i
+        if cmd == 1:
+            if i >= n: return 0
+            cmd = src[i] | 0x100; i += 1
+        b = cmd & 1; cmd >>= 1; return b
+    def byte():
+        nonlocal i
+        if i >= n: return 0
+        b = src[i]; i += 1; return b
+    while i < n:
+        if bit():
+            out.append(byte()); continue
+        if bit():
+            a = byte(); b = byte()
+            if strict and not (a | b):
+                return i, cmd, _END
+            amount = a & 7
+            amount = (byte() + 1) if amount == 0 else (amount + 2)
+            d = 0x2000 - (((b << 8) | a) >> 3)
+        else:
+            amount = (bit() << 1) | bit()
+            amount += 2
+            d = 0x100 - byte()
+        _copy_back(out, len(out) - d, amount)
+    return i, cmd, _EOF
+
+def _tail_nights(src, i: int, n: int, cmd: int, out: bytearray, strict: bool, ext: bool = False):
+    """Last few commands with the old decoder's semantics: stop at the first incomplete command."""
+    def bit():
+        nonlocal cmd, i
+        if cmd == 1:
+            if i >= n: return 0
+            cmd = src[i] | 0x100; i += 1
+        b = cmd & 1; cmd >>= 1; return b
+    while True:
+        if bit():
+            if i >= n: break
+            out.append(src[i]); i += 1
+        elif bit():
+            if i + 2 > n: break
+            a = src[i]; b = src[i+1]; i += 2
+            d = ((b & 0xF0) << 4) | a
+            if not d:
+                return i, cmd, _END
+            amount = (b & 0x0F) + 3
+            if len(out) < d: return i, cmd, _BAD
+            _copy_back(out, len(out) - d, amount)
+        else:
+            if i + 3 > n: break
+            a = src[i]; b = src[i+1]; c = src[i+2]; i += 3
+            if ext:
+                amount = (a | ((b & 0xE0) << 3)) + 2; d = ((b & 0x1F) << 8) | c
+            else:
+                amount = ((c & 0xE0) >> 5) + 2; d = ((c & 0x1F) << 8) | b
+            if not d or len(out) < d: return i, cmd, _BAD
+            _copy_back(out, len(out) - d, amount)
+    return i, cmd, _EOF
+
+def _tail_nights_ext(src, i, n, cmd, out, strict):
+    return _tail_nights(src, i, n, cmd, out, strict, True)
+
+
+_RUN = {"basic": _run_basic, "nights": _run_nights, "nights_ext": _run_nights_ext}
+_TAIL = {"basic": _tail_basic, "nights": _tail_nights, "nights_ext": _tail_nights_ext}
+
+
+def _decode(src, i: int, n: int, variant: str, strict: bool = False, max_out: int = 0, bitrev: bool = False):
+    """Decode from src[i] (just past the 'PRS' tag) to the end of the stream -> (out, i, state).
+
+    With max_out, decoding gives up (state _BAD) once the output grows past it.
+    With bitrev, each input byte is bit-reversed on the fly, one bounded window at a time."""
+    run = _RUN[variant]
+    out = bytearray(); cmd = 1; base = 0
+    if bitrev:
+        while True:
+            win = bytes(src[i:i + _SLICE + _MAXCMD]).translate(_BITREV)
+            if i + len(win) >= n:            # last window: finish it like a plain buffer
+                src, base, i, n = win, i, 0, len(win)
+                break
+            j, cmd, st = run(win, 0, len(win), _SLICE, cmd, out, strict)
+            i += j
+            if st != _NEED:
+                return out, i, st
+            if max_out and len(out) > max_out:
+                return out, i, _BAD
+    last = n - _MAXCMD
+    while i <= last:
+        i, cmd, st = run(src, i, n, min(last, i + _SLICE), cmd, out, strict)
+        if st != _NEED:
+            return out, base + i, st
+        if max_out and len(out) > max_out:
+            return out, base + i, _BAD
+    i, cmd, st = _TAIL[variant](src, i, n, cmd, out, strict)
+    if max_out and len(out) > max_out:
+        st = _BAD
+    return out, base + i, st
+
+
+# --------------------------- public API ---------------------------
+def prs_decompress(buf, start: int = 0, variant: str = "basic", bitrev: bool = False):
+    """Decompress the PRS block at `start`; returns (bytes, consumed) or (None, 0).
+
+    Matches the old per-variant decoders: the stream runs to the end of `buf`
+    (or, for the NiGHTS variants, to their offset-0 stop code).  `bitrev` reads
+    a stream whose bytes (after the tag) are stored bit-reversed."""
+    if buf[start:start+3] != b'PRS':
+        return None, 0
+    out, i, st = _decode(buf, start + 3, len(buf), variant, bitrev=bitrev)
+    if st == _BAD:
+        return None, 0
+    return bytes(out), i - start
+
+def prs_decode_block(buf, start: int = 0, variant: str = "basic", max_out: int = PRS_MAX_OUT, bitrev: bool = False):
+    """Decompress the PRS block at `start` up to its end-of-stream marker.
+
+    Returns (bytes, consumed) where `consumed` is the exact compressed extent
+    (tag and stop code included), or (None, 0) if the stream is invalid, runs off
+    the end of `buf` without a stop code, or decodes to more than `max_out` bytes."""
+    if buf[start:start+3] != b'PRS':
+        return None, 0
+    out, i, st = _decode(buf, start + 3, len(buf), variant, True, max_out, bitrev)
+    if st != _END:
+        return None, 0
+    return bytes(out), i - start
+
+def prs_probe(buf, start: int = 0, variant: str = "basic", commands: int = PROBE_COMMANDS,
+              bitrev: bool = False) -> bool:
+    """Walk the first `commands` commands of the block at `start` without producing output.
+
+    Rejects streams whose back-references point before the start of the output,
+    that use a zero offset, that stop before PROBE_MIN_OUT bytes, or that run off
+    the end of `buf`.  Survivors still need a full decode to be trusted."""
+    if buf[start:start+3] != b'PRS':
+        return False
+    if bitrev:
+        buf = b'PRS' + bytes(buf[start+3:start+3+commands*_MAXCMD]).translate(_BITREV); start = 0
+    n = len(buf); i = start + 3; cmd = 1; produced = 0
+    basic = variant == "basic"; ext = variant == "nights_ext"
+    try:
+        for _ in range(commands):
+            if cmd == 1:
+                cmd = buf[i] | 0x100; i += 1
+            if cmd & 1:
+                if i >= n: return False
+                cmd >>= 1; i += 1; produced += 1
+                continue
+            cmd >>= 1
+            if cmd == 1:
+                cmd = buf[i] | 0x100; i += 1
+            long_ref = cmd & 1; cmd >>= 1
+            if basic:
+                if long_ref:
+                    a = buf[i]; b = buf[i+1]; i += 2
+                    if not (a | b):
+                        return produced >= PROBE_MIN_OUT
+                    amount = a & 7
+                    if amount: amount += 2
+                    else: amount = buf[i] + 1; i += 1
+                    d = 0x2000 - (((b << 8) | a) >> 3)
+                else:
+                    if cmd == 1:
+                        cmd = buf[i] | 0x100; i += 1
+                    hi = cmd & 1; cmd >>= 1
+                    if cmd == 1:
+                        cmd = buf[i] | 0x100; i += 1
+                    amount = ((hi << 1) | (cmd & 1)) + 2; cmd >>= 1
+                    d = 0x100 - buf[i]; i += 1
+            elif long_ref:
+                a = buf[i]; b = buf[i+1]; i += 2
+                d = ((b & 0xF0) << 4) | a
+                if not d:
+                    return produced >= PROBE_MIN_OUT
+                amount = (b & 0x0F) + 3
+            else:
+                a = buf[i]; b = buf[i+1]; c = buf[i+2]; i += 3
+                if ext:
+                    amount = (a | ((b & 0xE0) << 3)) + 2; d = ((b & 0x1F) << 8) | c
+                else:
+                    amount = ((c & 0xE0) >> 5) + 2; d = ((c & 0x1F) << 8) | b
+            if not d or d > produced:
+                return False
+            produced += amount
+    except IndexError:     # ran off the end of buf
+        return False
+    return True
+
+
+# --------------------------- streaming ---------------------------
+class PRSStreamDecoder:
+    """Incremental PRS decoder: feed() compressed chunks, get decoded chunks back.
+
+    Only the last 0x2000 output bytes (the back-reference window) and a few
+    pending input bytes are kept between calls.  Input starts at the 'PRS' tag.
+    strict=True ends at the stop code (`eof` is set, `consumed` is the exact
+    extent, anything fed after it lands in `unused_data`); strict=False runs to
+    the end of the input like prs_decompress().  With `sink` (anything with
+    .write) output goes there and feed()/flush() return b""; spill=True uses an
+    anonymous temporary file as the sink.  Invalid streams raise ValueError."""
+    def __init__(self, variant: str = "basic", strict: bool = True, bitrev: bool = False,
+                 max_out: int = PRS_MAX_OUT, sink=None, spill: bool = False, chunk: int = 1 << 16):
+        self.variant = variant; self.strict = strict; self.bitrev = bitrev
+        self.max_out = max_out; self.chunk = chunk
+        self.sink = tempfile.TemporaryFile() if spill and sink is None else sink
+        self.eof = False; self.consumed = 0; self.total_out = 0; self.unused_data = b""
+        self._run = _RUN[variant]; self._tail = _TAIL[variant]
+        self._in = bytearray(); self._out = bytearray(); self._cmd = 1; self._tag = False
+
+    def feed(self, data) -> bytes:
+        """Decode as much of `data` as possible; returns the output that left the window."""
+        if self.eof:
+            self.unused_data += bytes(data); return b""
+        if not self._tag:
+            self._in += data
+            if len(self._in) < 3:
+                return b""
+            if self._in[:3] != b'PRS':
+                raise ValueError("not a PRS stream")
+            del self._in[:3]; self.consumed = 3; self._tag = True
+            if self.bitrev:
+                self._in = bytearray(self._in.translate(_BITREV))
+        elif self.bitrev:
+            self._in += bytes(data).translate(_BITREV)
+        else:
+            self._in += data
+        return self._step(False)
+
+    def flush(self) -> bytes:
+        """Finish the stream (end-of-input semantics of prs_decompress) and return the rest."""
+        if not self._tag:
+            raise ValueError("not a PRS stream")
+        return self._step(True)
+
+    def checkpoint(self):
+        """-> (consumed, cmd, produced, window): enough state to resume at input offset `consumed`."""
+        return (self.consumed, self._cmd, self.total_out + len(self._out), bytes(self._out[-_WINDOW:]))
+
+    @classmethod
+    def resume(cls, checkpoint, variant: str = "basic", strict: bool = True, bitrev: bool = False,
+               max_out: int = 0):
+        """Decoder continuing from checkpoint(); feed it the input from `consumed` on.
+        Its output starts with the checkpoint window, i.e. at offset produced - len(window)."""
+        dec = cls(variant, strict, bitrev, max_out)
+        dec.consumed, dec._cmd, produced, window = checkpoint
+        dec._tag = True; dec._out = bytearray(window); dec.total_out = produced - len(window)
+        return dec
+
+    def _step(self, final: bool) -> bytes:
+        src = self._in; n = len(src); i = 0; cmd = self._cmd; out = self._out
+        pieces = []; st = _NEED; last = n - _MAXCMD
+        while not self.eof and i <= last:
+            i, cmd, st = self._run(src, i, n, min(last, i + _SLICE), cmd, out, self.strict)
+            if st != _NEED:
+                break
+            if len(out) - _WINDOW >= self.chunk:
+                self._emit(out, len(out) - _WINDOW, pieces)
+        if final and st == _NEED and not self.eof:
+            i, cmd, st = self._tail(src, i, n, cmd, out, self.strict)
+        self._cmd = cmd; self.consumed += i
+        if st == _END:
+            self.eof = True; self.unused_data = bytes(src[i:])
+            if self.bitrev: self.unused_data = self.unused_data.translate(_BITREV)
+            del src[:]
+        else:
+            del src[:i]
+        if st == _BAD:
+            raise ValueError("corrupt PRS stream")
+        if st == _EOF and self.strict:
+            raise ValueError("PRS stream ended without a stop code")
+        self._emit(out, len(out) if (final or self.eof) else len(out) - _WINDOW, pieces)
+        return b"".join(pieces)
+
+    def _emit(self, out: bytearray, k: int, pieces: list):
+        if k <= 0:
+            return
+        if self.max_out and self.total_out + k > self.max_out:
+            raise ValueError("PRS output exceeds max_out")
+        if self.sink is not None: self.sink.write(out[:k])
+        else: pieces.append(bytes(out[:k]))
+        del out[:k]; self.total_out += k
+
+def prs_decompress_to(src, sink, start: int = 0, variant: str = "basic", strict: bool = True,
+                      bitrev: bool = False, max_out: int = PRS_MAX_OUT, chunk: int = 1 << 20):
+    """Stream the PRS block at `start` of `src` into `sink` -> (written, consumed) or (0, 0).
+
+    `src` is a bytes-like object / mmap or a binary file opened for reading (read
+    from `start` in `chunk`-sized pieces); nothing but the decoder window is held.
+    strict/bitrev/max_out as for PRSStreamDecoder.  On failure `sink` may hold a
+    partial output."""
+    dec = PRSStreamDecoder(variant, strict, bitrev, max_out, sink=sink)
+    try:
+        if hasattr(src, "read"):
+            src.seek(start)
+            while not dec.eof:
+                data = src.read(chunk)
+                if not data: break
+                dec.feed(data)
+        else:
+            view = memoryview(src); n = len(view); p = start
+            while not dec.eof and p < n:
+                dec.feed(view[p:p + chunk]); p += chunk
+        dec.flush()
+    except ValueError:
+        return 0, 0
+    return dec.total_out, dec.consumed
+
+
+# --------------------------- random access ---------------------------
+_VIEW_MAGIC = b"PRSV\x01"
+_VIEW_HEAD = struct.Struct("<5sBBBIIIII")   # magic, variant, bitrev, strict, every, size, extent, crc, count
+_VIEW_CP = struct.Struct("<IIII")           # consumed, cmd, produced, window length
+_VIEW_FEED = 1 << 10                        # input bytes per feed while indexing / reading
+
+class PRSView:
+    """Random-access reads from the output of one PRS block without keeping it.
+
+        view = PRSView(buf, start, "basic", every=64*1024, cache="blk.prsv")
+        len(view); view[a:b]; view.read(off, size)
+
+    The block is decoded once; about every `every` output bytes a checkpoint
+    (input offset, control bits, last 0x2000 output bytes) is recorded.  Reads
+    resume from the nearest checkpoint at or before `a`.  With `cache`, the
+    checkpoint table is loaded from / saved to that file and reused while it
+    matches the block (size and CRC of the compressed bytes).  Invalid blocks
+    raise ValueError."""
+    def __init__(self, buf, start: int = 0, variant: str = "basic", strict: bool = True,
+                 bitrev: bool = False, every: int = 64 * 1024, cache=None):
+        self.buf = buf; self.start = start; self.variant = variant
+        self.strict = strict; self.bitrev = bitrev; self.every = every
+        self.size = 0; self.extent = 0; self._cps = []
+        if not (cache and self._load(cache)):
+            self._index()
+            if cache: self.save(cache)
+        self._marks = [cp[2] for cp in self._cps]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            a, b, step = key.indices(self.size)
+            data = self.read(a, b - a)
+            return data if step == 1 else data[::step]
+        if key < 0: key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("PRSView index out of range")
+        return self.read(key, 1)[0]
+
+    def _feed_all(self, dec, p: int, until: int, sink=None):
+        """Feed input from buf[p] until `until` output bytes exist (or the stream ends)."""
+        view = memoryview(self.buf); n = len(view)
+        while not dec.eof and p < n and dec.total_out + len(dec._out) < until:
+            piece = dec.feed(view[p:p + _VIEW_FEED]); p += _VIEW_FEED
+            if sink is not None: sink.append(piece)
+            yield dec
+        if not dec.eof and p >= n:
+            piece = dec.flush()
+            if sink is not None: sink.append(piece)
+
+    def _index(self):
+        dec = PRSStreamDecoder(self.variant, self.strict, self.bitrev)
+        cps = [(3, 1, 0, b"")]; mark = self.every
+        for _ in self._feed_all(dec, self.start, 1 << 62):
+            produced = dec.total_out + len(dec._out)
+            if produced >= mark and not dec.eof:
+                cps.append(dec.checkpoint()); mark = produced + self.every
+        self.size = dec.total_out + len(dec._out); self.extent = dec.consumed; self._cps = cps
+
+    def read(self, off: int, size: int) -> bytes:
+        """Output bytes [off, off+size) (clipped to the block)."""
+        off = max(0, off); end = min(self.size, off + max(0, size))
+        if off >= end:
+            return b""
+        cp = self._cps[bisect_right(self._marks, off) - 1]
+        dec = PRSStreamDecoder.resume(cp, self.variant, self.strict, self.bitrev)
+        pieces = []
+        for _ in self._feed_all(dec, self.start + cp[0], end, pieces):
+            pass
+        data = b"".join(pieces) + bytes(dec._out)
+        base = cp[2] - len(cp[3])
+        return data[off - base:end - base]
+
+    # ---- checkpoint cache ----
+    def _crc(self):
+        return zlib.crc32(memoryview(self.buf)[self.start:self.start + self.extent])
+
+    def save(self, path):
+        with open(path, "wb") as fp:
+            fp.write(_VIEW_HEAD.pack(_VIEW_MAGIC, VARIANTS.index(self.variant), self.bitrev, self.strict,
+                                     self.every, self.size, self.extent, self._crc(), len(self._cps)))
+            for consumed, cmd, produced, window in self._cps:
+                fp.write(_VIEW_CP.pack(consumed, cmd, produced, len(window))); fp.write(window)
+
+    def _load(self, path) -> bool:
+        try:
+            with open(path, "rb") as fp:
+                magic, v, br, st, every, size, extent, crc, count = _VIEW_HEAD.unpack(fp.read(_VIEW_HEAD.size))
+                if (magic, VARIANTS[v], bool(br), bool(st)) != (_VIEW_MAGIC, self.variant, self.bitrev, self.strict):
+                    return False
+                cps = []
+                for _ in range(count):
+                    consumed, cmd, produced, wlen = _VIEW_CP.unpack(fp.read(_VIEW_CP.size))
+                    cps.append((consumed, cmd, produced, fp.read(wlen)))
+        except (OSError, struct.error, IndexError):
+            return False
+        self.extent = extent
+        if len(self.buf) < self.start + extent or self._crc() != crc:
+            return False
+        self.every = every; self.size = size; self._cps = cps
+        return True
+
+
+# --------------------------- encoder ---------------------------
+# level -> (hash-chain links followed per position, lazy matching); 0 stores literals only
+PRS_LEVELS = ((0, False), (2, False), (4, False), (8, False), (16, True),
+              (32, True), (64, True), (128, True), (512, True), (4096, True))
+_MAXDIST = 0x1FFF
+# longest back-reference of each variant, and a match long enough to skip the lazy step
+_MAXLEN = {"basic": 256, "nights": 18, "nights_ext": 2049}
+_LAZY_GOOD = 32
+
+def _match_len(data: bytes, i: int, j: int, lim: int) -> int:
+    """Longest l <= lim with data[j:j+l] == data[i:i+l]; the first 3 bytes are known to match."""
+    lo = 3; step = 8
+    while lo < lim:             # gallop: most matches are short
+        hi = min(lim, lo + step)
+        if data[j+lo:j+hi] != data[i+lo:i+hi]:
+            break
+        lo = hi; step += step
+    else:
+        return lim
+    hi -= 1                     # data[..lo] matches, data[..hi+1] does not
+    while lo < hi:
+        mid = (lo + hi + 1) >> 1
+        if data[j+lo:j+mid] == data[i+lo:i+mid]: lo = mid
+        else: hi = mid - 1
+    return lo
+
+def prs_compress(data, variant: str = "basic", level: int = 6, bitrev: bool = False) -> bytes:
+    """Compress `data` into a PRS stream (tag and stop code included) that
+    prs_decode_block() reads back exactly.  Matches are found through hash
+    chains over 3-byte keys; `level` picks the chain depth and lazy matching
+    from PRS_LEVELS.  `bitrev` stores the bytes after the tag bit-reversed."""
+    data = bytes(data); n = len(data)
+    chain, lazy = PRS_LEVELS[level]
+    maxlen = _MAXLEN[variant]; basic = variant == "basic"; ext = variant == "nights_ext"
+    out = bytearray(b'PRS'); ctl = 0; mask = 0x100
+
+    def bits(v: int, k: int):
+        """k control bits, most significant first."""
+        nonlocal ctl, mask
+        for sh in range(k - 1, -1, -1):
+            if mask == 0x100:
+                ctl = len(out); out.append(0); mask = 1
+            if (v >> sh) & 1: out[ctl] |= mask
+            mask <<= 1
+
+    def ref(l: int, d: int):
+        if basic:
+            if l <= 5 and d <= 0x100:
+                bits(l - 2, 4); out.append((0x100 - d) & 0xFF)
+            else:
+                bits(1, 2); w = ((0x2000 - d) << 3) | (l - 2 if l <= 9 else 0)
+                out.append(w & 0xFF); out.append(w >> 8)
+                if l > 9: out.append(l - 1)
+        elif l <= 18 and d <= 0xFFF:
+            bits(1, 2); out.append(d & 0xFF); out.append(((d >> 4) & 0xF0) | (l - 3))
+        else:
+            bits(0, 2)
+            if ext: out.extend((((l - 2) & 0xFF), (((l - 2) >> 8) << 5) | (d >> 8), d & 0xFF))
+            else: out.extend((0, d & 0xFF, ((l - 2) << 5) | (d >> 8)))
+
+    # prev[i] = last earlier position with the same 3 bytes: the hash chains of every position
+    prev = [-1] * n; last = {}
+    for idx, k in enumerate([a | (b << 8) | (c << 16) for a, b, c in zip(data, data[1:], data[2:])]):
+        prev[idx] = last.get(k, -1); last[k] = idx
+    del last
+
+    def find(i: int):
+        """Longest usable match at i -> (length, distance) or (0, 0)."""
+        j = prev[i]; best = 2; bd = 0; links = chain
+        top = min(maxlen, n - i)
+        while j >= 0 and links:
+            d = i - j
+            if d > _MAXDIST:
+                break
+            lim = top if basic or ext or d <= 0xFFF else min(top, 9)
+            if lim > best and data[j+best] == data[i+best]:
+                l = _match_len(data, i, j, lim)
+                if l > best:
+                    best = l; bd = d
+                    if l >= top: break
+            j = prev[j]; links -= 1
+        return (best, bd) if bd else (0, 0)
+
+    i = 0
+    while i < n:
+        l, d = find(i) if chain and prev[i] >= 0 else (0, 0)
+        if not l:   # literal: one control bit + the byte
+            if mask == 0x100:
+                ctl = len(out); out.append(0); mask = 1
+            out[ctl] |= mask; mask <<= 1
+            out.append(data[i]); i += 1
+            continue
+        while lazy and l < _LAZY_GOOD and i + 1 < n and prev[i + 1] >= 0:
+            l2, d2 = find(i + 1)
+            if l2 <= l: break
+            bits(1, 1); out.append(data[i]); i += 1; l, d = l2, d2
+        ref(l, d); i += l
+    bits(1, 2); out += b'\0\0'                   # stop code
+    if bitrev:
+        out[3:] = out[3:].translate(_BITREV)
+    return bytes(out)
+
+def prs_reimport(path, block_offset: int, patch_offset: int, data, variant: str = "basic",
+                 bitrev: bool = False, level: int = 6):
+    """Patch `data` into the output of the PRS block at `block_offset` of the file
+    `path` and write the recompressed block back into the same slot.
+
+    The new stream is checked by decoding it again; if it does not fit at `level`,
+    level 9 is tried before giving up.  The rest of the slot is zero-filled.
+    Returns (new_size, slot_size); raises ValueError if the block is not a valid
+    PRS stream, the patch runs past its output, or the result is too large."""
+    new, slot = _prs_repatch(path, block_offset, patch_offset, data, variant, bitrev, level)
+    with open(path, "r+b") as fp:
+        fp.seek(block_offset); fp.write(new + bytes(slot - len(new)))
+    return len(new), slot
+
+def _prs_repatch(path, block_offset: int, patch_offset: int, data, variant: str, bitrev: bool, level: int):
+    """(recompressed block, slot size) for prs_reimport(), nothing written."""
+    with open(path, "rb") as fp:
+        fp.seek(block_offset)
+        dec = PRSStreamDecoder(variant, True, bitrev, sink=None)
+        pieces = []
+        while not dec.eof:
+            chunk = fp.read(1 << 20)
+            if not chunk: break
+            pieces.append(dec.feed(chunk))
+        pieces.append(dec.flush())
+    raw = bytearray(b"".join(pieces)); slot = dec.consumed
+    if patch_offset < 0 or patch_offset + len(data) > len(raw):
+        raise ValueError(f"Patch {patch_offset:#x}+{len(data):#x} runs past the block output ({len(raw):#x}).")
+    raw[patch_offset:patch_offset + len(data)] = data
+    for lv in (level, 9) if level < 9 else (level,):
+        new = prs_compress(raw, variant, lv, bitrev)
+        if len(new) <= slot:
+            break
+    if len(new) > slot:
+        raise ValueError(f"Recompressed block is larger than original ({len(new)}>{slot}).")
+    if prs_decode_block(new, 0, variant, max_out=0, bitrev=bitrev) != (bytes(raw), len(new)):
+        raise ValueError("Recompressed block does not decode back to the patched data.")
+    return new, slot
+
+
+PRS_NOTE_SUFFIX = ".prs.json"
+
+def prs_note_source(path, source, block_offset: int, variant: str, bitrev: bool = False):
+    """Record next to the decoded block `path` (in <path>.prs.json) the file and offset
+    of the PRS block it was decoded from, for prs_reimport_into()."""
+    with open(str(path) + PRS_NOTE_SUFFIX, "w", encoding="utf-8") as fp:
+        json.dump({"source": os.path.abspath(source), "offset": block_offset,
+                   "variant": variant, "bitrev": bool(bitrev)}, fp)
+
+def prs_source(path):
+    """The prs_note_source() record of a decoded block, or None."""
+    try:
+        with open(str(path) + PRS_NOTE_SUFFIX, encoding="utf-8") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+def prs_reimport_into(path, offset: int, data, level: int = 6) -> list:
+    """Write `data` at `offset` of `path`; if `path` is a decoded PRS block (see
+    prs_note_source) the patch is also recompressed into the block's slot in its
+    source, and so on up while the source is itself a decoded block.  Every level
+    is recompressed and checked before any file is written.  Returns the files
+    written, innermost first; raises ValueError like prs_reimport()."""
+    writes = [(str(path), offset, bytes(data))]
+    note = prs_source(path)
+    while note is not None:
+        src, off = note["source"], note["offset"]
+        new, slot = _prs_repatch(src, off, writes[-1][1], writes[-1][2], note["variant"], note["bitrev"], level)
+        writes.append((src, off, new + bytes(slot - len(new))))
+        note = prs_source(src)
+    for p, o, d in writes:
+        with open(p, "r+b") as fp:
+            fp.seek(o); fp.write(d)
+    return [p for p, _, _ in writes]
+
+# --------------------------- variant detection ---------------------------
+# (variant, bitrev) candidates in the order the callers used to try them
+SCANNER_VARIANTS = (("basic", False), ("nights", False))
+AUTO_VARIANTS = (("nights_ext", False), ("nights_ext", True))
+
+class PRSVariantCache:
+    """Decides which PRS variant a container (or AFS entry) uses and remembers it.
+
+    Until a block has decoded, every candidate is probed at each hit; after that
+    the cached (variant, bitrev) is tried first and the other candidates only if
+    it fails, so a container mixing bit orders (or a choice made on a false hit)
+    loses no block.  The last variant that decoded becomes the choice.
+    Use one instance per container.  strict=True decodes with prs_decode_block,
+    strict=False with prs_decompress (old to-end-of-buffer behaviour)."""
+    def __init__(self, candidates=SCANNER_VARIANTS, strict: bool = True):
+        self.candidates = tuple(candidates)
+        self.strict = strict
+        self.choice = None
+
+    def order(self):
+        """Candidates in the order they are tried: the cached choice first."""
+        if self.choice is None: return self.candidates
+        return (self.choice,) + tuple(c for c in self.candidates if c != self.choice)
+
+    def decode(self, buf, start: int, stats: dict | None = None):
+        """-> (bytes, consumed) or (None, 0); tallies prs_probes/prs_accepted into `stats`."""
+        for variant, bitrev in self.order():
+            if stats is not None: stats["prs_probes"] = stats.get("prs_probes", 0) + 1
+            if not prs_probe(buf, start, variant, bitrev=bitrev):
+                continue
+            if stats is not None: stats["prs_accepted"] = stats.get("prs_accepted", 0) + 1
+            if self.strict:
+                out, used = prs_decode_block(buf, start, variant, bitrev=bitrev)
+            else:
+                out, used = prs_decompress(buf, start, variant, bitrev=bitrev)
+            if out and used:
+                self.choice = (variant, bitrev)
+                return out, used
+        return None, 0
+
+    def decode_to(self, buf, start: int, path, stats: dict | None = None):
+        """Like decode(), but streams the output into the file `path` -> (written, consumed) or (0, 0).
+
+        The file is only created once a probe passes and is removed again on failure."""
+        for variant, bitrev in self.order():
+            if stats is not None: stats["prs_probes"] = stats.get("prs_probes", 0) + 1
+            if not prs_probe(buf, start, variant, bitrev=bitrev):
+                continue
+            if stats is not None: stats["prs_accepted"] = stats.get("prs_accepted", 0) + 1
+            with open(path, "wb") as fp:
+                size, used = prs_decompress_to(buf, fp, start, variant, self.strict, bitrev)
+            if size and used:
+                self.choice = (variant, bitrev)
+                return size, used
+            os.remove(path)
+        return 0, 0
@@ -5,10 +5,17 @@ import sys
 import math
 import time
 import io
+import mmap
 import struct
 import zlib
 import fnmatch
+from contextlib import redirect_stdout, nullcontext
 from PIL import Image
+try:
+    from scanners import HitTable, pvrt_header, ScanCache
+    from prs import prs_reimport_into
+except ImportError:
+    HitTable = pvrt_header = ScanCache = prs_reimport_into = None
 
 '''
 MIT License
@@ -216,6 +223,9 @@ class Pypvr:
             self.scandir_mode = False
             self.scandir_base = None
             self.scandir_out_base = None
+            self.jobs = 1
+            self.cache = None
+            self.cache_entries = None  # -j workers: cache entries collected for the parent to store
 
             if args_str:
 
@@ -257,6 +267,8 @@ class Pypvr:
                 act_flag_pattern = r'-act'
                 buffer_pattern = r'-buffer'
                 nopvp_pattern = r'-nopvp'
+                jobs_pattern = r'(?:^|\s)-j\s+(\d+)'
+                cache_pattern = r'(?:^|\s)-cache(?:\s|$)'
 
                 # extract filenames (PVR or PVP files)
                 matches = re.findall(file_pattern, args_str, re.IGNORECASE)
@@ -289,6 +301,13 @@ class Pypvr:
                 if re.search(act_flag_pattern, args_str):
                     self.act_export = True
 
+                jobs_match = re.search(jobs_pattern, args_str)
+                if jobs_match:
+                    self.jobs = int(jobs_match.group(1))
+
+                if re.search(cache_pattern, args_str) and ScanCache is not None:
+                    self.cache = ScanCache()
+
             if self.scandir:
                 if not os.path.isdir(self.scandir):
                     print(f"Error: '{self.scandir}' is not a valid directory!")
@@ -345,191 +364,264 @@ class Pypvr:
 
                 self.load_pvr(None, True if self.buffer_pvp else False, act_buffer, None, self.buffer_pvr)
             else:
-                for cur_file in self.files_lst:
-                    # store original out_dir
-                    original_out_dir = self.out_dir
+                if self.jobs != 1 and len(self.files_lst) > 1:
+                    self.process_files_parallel()
+                else:
+                    for cur_file in self.files_lst:
+                        self.process_file(cur_file)
 
-                    # scandir mode output
+                if self.log and self.log_content != '':
+                    # log file placement for scandir mode
                     if hasattr(self, 'scandir_mode') and self.scandir_mode:
-                        # rel path from scandir base
-                        rel_path = os.path.relpath(os.path.dirname(cur_file), self.scandir_base)
+                        # log file in the base scandir output directory
+                        log_dir = self.scandir_out_base
+                        os.makedirs(log_dir, exist_ok=True)
+                    else:
+                        log_dir = self.out_dir if self.out_dir_specified else os.path.dirname(
+                            os.path.abspath(self.files_lst[0])) if self.files_lst else '.'
 
-                        if rel_path == '.':
-                            # root dir
-                            self.out_dir = self.scandir_out_base
+                    with open(os.path.join(log_dir, 'pvr_log.txt'), 'w') as l:
+                        l.write(self.log_content)
 
-                        else:
-                            # subdir
-                            self.out_dir = os.path.join(self.scandir_out_base, rel_path)
+        def process_file(self, cur_file):
+            # decode one file: a PVR/PVP pair, or a container scanned for PVRT/PVPL chunks
+            # store original out_dir
+            original_out_dir = self.out_dir
 
-                        # ensure the output directory exists
-                        os.makedirs(self.out_dir, exist_ok=True)
+            # scandir mode output
+            if hasattr(self, 'scandir_mode') and self.scandir_mode:
+                # rel path from scandir base
+                rel_path = os.path.relpath(os.path.dirname(cur_file), self.scandir_base)
 
-                        if self.debug:
-                            print(f"Processing: {cur_file}")
-                            print(f"Relative path: {rel_path}")
-                            print(f"Output dir: {self.out_dir}")
-                            print(f"Scandir out base: {self.scandir_out_base}")
-
-                    # if no output directory was specified and not in scandir mode, use the current file's directory
-                    elif not self.out_dir_specified:
-                        self.out_dir = os.path.dirname(os.path.abspath(cur_file))
-                        os.makedirs(self.out_dir, exist_ok=True)
-
-                    if not cur_file.lower().endswith(('pvp', 'pvr')):
-                        print(f"Scanning {cur_file}")
-                        try:
-                            with open(cur_file, "rb") as f:
-                                self.log = True
-                                buffer = f.read()
-
-                                # find PVRT and PVPL offsets
-                                pvrt_matches = [match.start() for match in re.finditer(b"PVRT", buffer)]
-                                pvpl_matches = [match.start() for match in re.finditer(b"PVPL", buffer)]
-
-                                # lists to store offsets and sizes
-                                pvrt_offsets_sizes = []
-                                pvpl_offsets_sizes = []
-
-                                pvri = 0
-                                pvpi = 0
-                                apply_palette = False
-                                act_buffer = bytearray()
-
-                                # process PVRT matches
-                                for offset in pvrt_matches:
-                                    if self.debug: print(f"PVRT found at offset: {hex(offset)}")
-
-                                    if offset + 4 < len(buffer):
-                                        filesize = int.from_bytes(buffer[offset + 4:offset + 8],
-                                                                  byteorder='little') + 8
-                                        remaining_bytes = len(buffer) - offset
-
-                                        if filesize > remaining_bytes or filesize < 0x10:
-                                            continue
-                                    else:
-                                        continue
+                if rel_path == '.':
+                    # root dir
+                    self.out_dir = self.scandir_out_base
 
-                                    if offset + 11 < len(buffer):
-                                        byte_a = buffer[offset + 0xA]
-                                        byte_b = buffer[offset + 0xB]
-                                        if byte_a != 0x00 or byte_b != 0x00:
-                                            continue
-                                    else:
-                                        continue
+                else:
+                    # subdir
+                    self.out_dir = os.path.join(self.scandir_out_base, rel_path)
 
-                                    pvrt_offsets_sizes.append((offset, filesize))
-                                    unpack_dir = os.path.join(self.out_dir, os.path.basename(cur_file) + '_EXT',
-                                                              'PVR')
-                                    os.makedirs(unpack_dir, exist_ok=True)
-
-                                    full_pvr_path = os.path.join(unpack_dir, f"{str(pvri).zfill(3)}.pvr")
-
-                                    # extract file
-                                    with open(full_pvr_path, 'wb') as p:
-                                        p.write(buffer[offset:offset + filesize])
-                                        pvri += 1
-
-                                    self.log_content += (
-                                        f"PVR FILE   : {os.path.normpath(full_pvr_path)}\n"
-                                        f"CONTAINER  : {os.path.normpath(cur_file)}\n"
-                                        f"DATA OFFST : {offset}\n"
-                                        f"DATA FSIZE : {filesize}\n"
-                                    )
-
-                                    self.load_pvr(full_pvr_path, apply_palette, act_buffer,
-                                                  os.path.join(os.path.basename(cur_file) + '_EXT',
-                                                               f"{str(pvri - 1).zfill(3)}.pvr"))
-
-                                # process PVPL matches
-                                for offset in pvpl_matches:
-                                    if self.debug: print(f"PVPL found at offset: {hex(offset)}")
-
-                                    if offset + 0xE + 2 <= len(buffer):
-                                        value = int.from_bytes(buffer[offset + 0xE:offset + 0xE + 2],
-                                                               byteorder='little')
-                                        filesize = int.from_bytes(buffer[offset + 4:offset + 8],
-                                                                  byteorder='little') + 8
-
-                                        if value not in {0x10, 0x100}:
-                                            continue
-                                    else:
-                                        continue
+                # ensure the output directory exists
+                os.makedirs(self.out_dir, exist_ok=True)
 
-                                    pvpl_offsets_sizes.append((offset, filesize))
-                                    unpack_dir = os.path.join(self.out_dir, os.path.basename(cur_file) + '_EXT',
-                                                              'PVP')
-                                    os.makedirs(unpack_dir, exist_ok=True)
+                if self.debug:
+                    print(f"Processing: {cur_file}")
+                    print(f"Relative path: {rel_path}")
+                    print(f"Output dir: {self.out_dir}")
+                    print(f"Scandir out base: {self.scandir_out_base}")
 
-                                    full_pvp_path = os.path.join(unpack_dir, f"{str(pvpi).zfill(3)}.pvp")
+            # if no output directory was specified and not in scandir mode, use the current file's directory
+            elif not self.out_dir_specified:
+                self.out_dir = os.path.dirname(os.path.abspath(cur_file))
+                os.makedirs(self.out_dir, exist_ok=True)
 
-                                    # extract file
-                                    with open(os.path.join(unpack_dir, f"{str(pvpi).zfill(3)}.pvp"), 'wb') as p:
-                                        p.write(buffer[offset:offset + filesize])
-                                        pvpi += 1
+            log_start = len(self.log_content)
+            cached = self.cached_container(cur_file)
+            if cached is not None:
+                # unchanged container, all of its files still there: reuse its log entries
+                self.log = True
+                self.log_content += cached["log"]
+                print(f"Cached {cur_file}")
 
-                                    act_buffer = bytearray()
+            elif not cur_file.lower().endswith(('pvp', 'pvr')):
+                print(f"Scanning {cur_file}")
+                try:
+                    # map the container instead of reading it; only carved assets are copied,
+                    # and the map is closed however the scan ends
+                    with open(cur_file, "rb") as f, \
+                            (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                             if os.fstat(f.fileno()).st_size else nullcontext(b"")) as buffer:
+                        self.log = True
+
+                        # find PVRT and PVPL offsets (one pass when the toolkit's scanners are available)
+                        if HitTable is not None:
+                            hits = HitTable.for_file(cur_file, (b"PVRT", b"PVPL"), cache=self.cache) \
+                                if self.cache else HitTable(buffer, (b"PVRT", b"PVPL"))
+                            pvrt_matches = hits.offsets(b"PVRT")
+                            pvpl_matches = hits.offsets(b"PVPL")
+                        else:
+                            pvrt_matches = [match.start() for match in re.finditer(b"PVRT", buffer)]
+                            pvpl_matches = [match.start() for match in re.finditer(b"PVPL", buffer)]
 
-                                    self.log_content += (
-                                        f"PVP FILE   : {os.path.normpath(full_pvp_path)}\n"
-                                        f"CONTAINER  : {os.path.normpath(cur_file)}\n"
-                                        f"DATA OFFST : {offset}\n"
-                                        f"DATA FSIZE : {filesize}\n"
-                                    )
-                                    self.load_pvp(full_pvp_path, act_buffer, full_pvp_path)
+                        # lists to store offsets and sizes
+                        pvrt_offsets_sizes = []
+                        pvpl_offsets_sizes = []
 
-                                print(f"Finished extracting {cur_file}")
+                        pvri = 0
+                        pvpi = 0
+                        apply_palette = False
+                        act_buffer = bytearray()
 
-                        except FileNotFoundError:
-                            print(f"File not found: {cur_file}")
-                        except Exception as e:
-                            print(f"Error scanning file {cur_file}: {e}")
+                        # process PVRT matches
+                        for offset in pvrt_matches:
+                            if self.debug: print(f"PVRT found at offset: {hex(offset)}")
+                            # strict header check (format, dimensions, size vs layout) when available;
+                            # only reported, the size and 0x0A/0x0B checks below decide what is carved
+                            if self.debug and pvrt_header is not None and pvrt_header(buffer, offset) is None:
+                                print(f"PVRT at {hex(offset)} does not match its declared layout")
+
+                            if offset + 4 < len(buffer):
+                                filesize = int.from_bytes(buffer[offset + 4:offset + 8],
+                                                          byteorder='little') + 8
+                                remaining_bytes = len(buffer) - offset
+
+                                if filesize > remaining_bytes or filesize < 0x10:
+                                    continue
+                            else:
+                                continue
 
-                    else:
-                        path_upper = cur_file.endswith(('PVP', 'PVR'))
+                            if offset + 11 < len(buffer):
+                                byte_a = buffer[offset + 0xA]
+                                byte_b = buffer[offset + 0xB]
+                                if byte_a != 0x00 or byte_b != 0x00:
+                                    continue
+                            else:
+                                continue
 
-                        full_pvr_path = os.path.abspath(cur_file[:-4] + ('.PVR' if path_upper else '.pvr'))
+                            pvrt_offsets_sizes.append((offset, filesize))
+                            unpack_dir = os.path.join(self.out_dir, os.path.basename(cur_file) + '_EXT',
+                                                      'PVR')
+                            os.makedirs(unpack_dir, exist_ok=True)
+
+                            full_pvr_path = os.path.join(unpack_dir, f"{str(pvri).zfill(3)}.pvr")
+
+                            # extract file
+                            with open(full_pvr_path, 'wb') as p:
+                                p.write(buffer[offset:offset + filesize])
+                                pvri += 1
+
+                            self.log_content += (
+                                f"PVR FILE   : {os.path.normpath(full_pvr_path)}\n"
+                                f"CONTAINER  : {os.path.normpath(cur_file)}\n"
+                                f"DATA OFFST : {offset}\n"
+                                f"DATA FSIZE : {filesize}\n"
+                            )
+
+                            self.load_pvr(full_pvr_path, apply_palette, act_buffer,
+                                          os.path.join(os.path.basename(cur_file) + '_EXT',
+                                                       f"{str(pvri - 1).zfill(3)}.pvr"))
+
+                        # process PVPL matches
+                        for offset in pvpl_matches:
+                            if self.debug: print(f"PVPL found at offset: {hex(offset)}")
+
+                            if offset + 0xE + 2 <= len(buffer):
+                                value = int.from_bytes(buffer[offset + 0xE:offset + 0xE + 2],
+                                                       byteorder='little')
+                                filesize = int.from_bytes(buffer[offset + 4:offset + 8],
+                                                          byteorder='little') + 8
+
+                                if value not in {0x10, 0x100}:
+                                    continue
+                            else:
+                                continue
 
-                        if self.usepal:
-                            full_pvp_path = os.path.abspath(self.usepal)
-                        else:
-                            full_pvp_path = os.path.abspath(cur_file[:-4] + ('.PVP' if path_upper else '.pvp'))
+                            pvpl_offsets_sizes.append((offset, filesize))
+                            unpack_dir = os.path.join(self.out_dir, os.path.basename(cur_file) + '_EXT',
+                                                      'PVP')
+                            os.makedirs(unpack_dir, exist_ok=True)
 
-                        if self.debug: print(f"Checking PVR file: {full_pvr_path}, PVP file: {full_pvp_path}")
+                            full_pvp_path = os.path.join(unpack_dir, f"{str(pvpi).zfill(3)}.pvp")
 
-                        # check if PVP or PVR file exists
-                        pvp_exists = os.path.exists(full_pvp_path)
-                        pvr_exists = os.path.exists(full_pvr_path)
+                            # extract file
+                            with open(os.path.join(unpack_dir, f"{str(pvpi).zfill(3)}.pvp"), 'wb') as p:
+                                p.write(buffer[offset:offset + filesize])
+                                pvpi += 1
 
-                        if self.debug: print(f"PVP exists: {pvp_exists}, PVR exists: {pvr_exists}")
+                            act_buffer = bytearray()
 
-                        apply_palette = True if (cur_file.lower().endswith(".pvp") and pvr_exists) or (
-                                cur_file.lower().endswith(".pvr") and pvp_exists) else False
+                            self.log_content += (
+                                f"PVP FILE   : {os.path.normpath(full_pvp_path)}\n"
+                                f"CONTAINER  : {os.path.normpath(cur_file)}\n"
+                                f"DATA OFFST : {offset}\n"
+                                f"DATA FSIZE : {filesize}\n"
+                            )
+                            self.load_pvp(full_pvp_path, act_buffer, full_pvp_path)
 
-                        act_buffer = bytearray()
+                        print(f"Finished extracting {cur_file}")
 
-                        if pvp_exists:
-                            self.load_pvp(full_pvp_path, act_buffer, full_pvp_path)
+                        if self.cache:
+                            ext_dir = os.path.join(self.out_dir, os.path.basename(cur_file) + '_EXT')
+                            params = self.cache_params(cur_file)
+                            value = {"log": self.log_content[log_start:], "outputs": ScanCache.outputs(ext_dir)}
+                            if self.cache_entries is None:
+                                self.cache.put(cur_file, "pypvr", params, value)
+                            else:
+                                self.cache_entries.append((cur_file, params, value))
 
-                        if pvr_exists:
-                            self.load_pvr(full_pvr_path, apply_palette, act_buffer, os.path.basename(cur_file))
+                except FileNotFoundError:
+                    print(f"File not found: {cur_file}")
+                except Exception as e:
+                    print(f"Error scanning file {cur_file}: {e}")
 
-                    # restore original out_dir if it was specified
-                    if self.out_dir_specified:
-                        self.out_dir = original_out_dir
+            else:
+                path_upper = cur_file.endswith(('PVP', 'PVR'))
 
-                if self.log and self.log_content != '':
-                    # log file placement for scandir mode
-                    if hasattr(self, 'scandir_mode') and self.scandir_mode:
-                        # log file in the base scandir output directory
-                        log_dir = self.scandir_out_base
-                        os.makedirs(log_dir, exist_ok=True)
-                    else:
-                        log_dir = self.out_dir if self.out_dir_specified else os.path.dirname(
-                            os.path.abspath(self.files_lst[0])) if self.files_lst else '.'
+                full_pvr_path = os.path.abspath(cur_file[:-4] + ('.PVR' if path_upper else '.pvr'))
 
-                    with open(os.path.join(log_dir, 'pvr_log.txt'), 'w') as l:
-                        l.write(self.log_content)
+                if self.usepal:
+                    full_pvp_path = os.path.abspath(self.usepal)
+                else:
+                    full_pvp_path = os.path.abspath(cur_file[:-4] + ('.PVP' if path_upper else '.pvp'))
+
+                if self.debug: print(f"Checking PVR file: {full_pvr_path}, PVP file: {full_pvp_path}")
+
+                # check if PVP or PVR file exists
+                pvp_exists = os.path.exists(full_pvp_path)
+                pvr_exists = os.path.exists(full_pvr_path)
+
+                if self.debug: print(f"PVP exists: {pvp_exists}, PVR exists: {pvr_exists}")
+
+                apply_palette = True if (cur_file.lower().endswith(".pvp") and pvr_exists) or (
+                        cur_file.lower().endswith(".pvr") and pvp_exists) else False
+
+                act_buffer = bytearray()
+
+                if pvp_exists:
+                    self.load_pvp(full_pvp_path, act_buffer, full_pvp_path)
+
+                if pvr_exists:
+                    self.load_pvr(full_pvr_path, apply_palette, act_buffer, os.path.basename(cur_file))
+
+            # restore original out_dir if it was specified
+            if self.out_dir_specified:
+                self.out_dir = original_out_dir
+
+        def cache_params(self, cur_file):
+            # what a container's cached result depends on besides the container itself
+            return {"out": os.path.abspath(os.path.join(self.out_dir, os.path.basename(cur_file) + '_EXT')),
+                    "fmt": self.fmt, "flip": bool(self.flip), "nopvp": self.nopvp, "act": self.act_export}
+
+        def cached_container(self, cur_file):
+            # -cache: the stored result of an unchanged container whose output files are intact
+            if not self.cache or cur_file.lower().endswith(('pvp', 'pvr')) or not os.path.isfile(cur_file):
+                return None
+            cached = self.cache.get(cur_file, "pypvr", self.cache_params(cur_file))
+            return cached if cached is not None and ScanCache.intact(cached["outputs"]) else None
+
+        # decode options a -j worker gets from the parent; everything else starts fresh
+        worker_settings = ('out_dir', 'out_dir_specified', 'fmt', 'flip', 'log', 'silent', 'debug', 'nopvp',
+                           'usepal', 'act_export', 'scandir', 'scandir_mode', 'scandir_base', 'scandir_out_base')
+
+        def process_files_parallel(self):
+            # -j N: one file per task on a process pool; console output and log fragments
+            # come back per file and are merged in file order, so pvr_log.txt matches a serial run.
+            # With -cache, workers look up the cache by its root and return their new
+            # entries, which are stored here
+            from concurrent.futures import ProcessPoolExecutor
+            jobs = self.jobs if self.jobs > 0 else (os.cpu_count() or 1)
+            settings = {k: getattr(self, k) for k in self.worker_settings}
+            settings['cache'] = str(self.cache.root) if self.cache else None
+            tasks = [(settings, cur_file) for cur_file in self.files_lst]
+            with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as ex:
+                for out, log, log_content, entries in ex.map(_decode_file, tasks,
+                                                             chunksize=max(1, len(tasks) // (jobs * 4))):
+                    if out:
+                        sys.stdout.write(out)
+                    self.log = self.log or log
+                    self.log_content += log_content
+                    for cur_file, params, value in entries:
+                        self.cache.put(cur_file, "pypvr", params, value)
 
         # scan directory recursively for supported files
         def scan_dir_contents(self, directory):
@@ -2753,6 +2845,18 @@ class Pypvr:
                             vq_iter,vq_rseed, image_path, out_dir)
 
 
+        def write_to_container(self, cnt_filnam, cnt_offset, data):
+            # a container decoded from a PRS block (toolkit _DEPRS / PRS_EXTRACT .bin with a
+            # .prs.json note) is patched and recompressed back into the original file too
+            if prs_reimport_into is not None:
+                written = prs_reimport_into(cnt_filnam, cnt_offset, data)
+                if len(written) > 1 and not self.silent:
+                    print(f"Recompressed into: {', '.join(written[1:])}")
+                return
+            with open(cnt_filnam, 'rb+') as container:
+                container.seek(cnt_offset)
+                container.write(data)
+
         def process_pvr_log(self, log_file):
             # process pvr_log.txt file to re-encode
 
@@ -2807,9 +2911,7 @@ class Pypvr:
                                 continue
 
                             # import back to container
-                            with open(cnt_filnam, 'rb+') as container:
-                                container.seek(cnt_offset)
-                                container.write(pvp_data)
+                            self.write_to_container(cnt_filnam, cnt_offset, pvp_data)
                             continue
 
                         except FileNotFoundError as e:
@@ -2849,9 +2951,7 @@ class Pypvr:
                                         continue
 
                                     # open container and write data
-                                    with open(cnt_filnam, 'rb+') as container:
-                                        container.seek(cnt_offset)
-                                        container.write(pvr_data)
+                                    self.write_to_container(cnt_filnam, cnt_offset, pvr_data)
 
                                 except FileNotFoundError as e:
                                     print(f"Error: File not found - {str(e)}")
@@ -3038,6 +3138,9 @@ class Pypvr:
             print('    act                 # Convert PVP to ACT palette (Adobe Color Table)')
             print('    nopvp               # Do not extract pvp')
             print('    scandir <directory> # Recursively scan directory for all supported files')  # NEW
+            print('    j <workers>         # Files decoded in parallel (scandir / folders, 0 = all cores)')
+            print('    cache               # Skip unchanged containers whose output is still there')
+            print('                        # (with -j, workers read it and the main process stores new entries)')
             print()
             print()
             print('   ----------------------')
@@ -3174,5 +3277,21 @@ class Pypvr:
             print()
 
 
+def _decode_file(task):
+    # worker of Decode.process_files_parallel: decode one file with the parent's
+    # decode options, returning (console output, log flag, pvr_log fragment, cache entries)
+    settings, cur_file = task
+    dec = Pypvr.Decode()
+    for k in Pypvr.Decode.worker_settings:
+        setattr(dec, k, settings[k])
+    if settings['cache'] and ScanCache is not None:
+        dec.cache = ScanCache(settings['cache'])
+        dec.cache_entries = []
+    out = io.StringIO()
+    with redirect_stdout(out):
+        dec.process_file(cur_file)
+    return out.getvalue(), dec.log, dec.log_content, dec.cache_entries or []
+
+
 if __name__ == "__main__":
     Pypvr.Cli()
@@ -10,7 +10,38 @@ Finds and carves:
 - Recursively scans inside PRS-compressed blocks (‘PRS’) and inside PVM/GVM payloads.
 
 Main entry:
+    HitTable(buf) -> every signature in SIGNATURES found in one regex pass;
+        .offsets(sig) and .next_tag(pos, tags) (bisect) replace per-tag find loops
+    HitTable(buf, align=ALIGNED) -> 4-byte magics only at aligned offsets, compared
+        as a NumPy uint32 view in one vectorized pass; PRS/GVR stay byte-granular
+    HitTable.for_file(path, workers=N) -> the same table for one big file, its spans
+        scanned on N processes and stitched (robust_scan_to_dir(..., hits=...))
     robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str) -> dict[counts]
+    (counts also report prs_hits / prs_probes / prs_accepted for tuning the PRS probe)
+    scan_file_to_dir(path, out_dir, tag, origin) -> same, on a memory-mapped file
+    pvrt_header(buf, pos) -> (px, tex, w, h, end) if the PVRT header is a legal
+        texture whose size field covers its layout (strict carving), else None
+    TextureArchive.parse(buf, pos) -> PVM/GVM entry table (names, GBIX, formats) with
+        memoryview access to each texture
+    EntryReader -> base of the AFS readers: one open handle, pread / memoryview entries,
+        thread-safe, context manager
+        .extract(out_dir, indices=..., kinds=..., workers=N) copies entries kernel-side
+        on a thread pool
+        .repack({index: file}, out) streams a patched copy (in_place=True: copy, then pwrite)
+        .rebuild({index: file}, out, strategy) relocates grown entries, rewrites TOC + names
+    afs_toc(fp) -> (base, entries) of an AFS archive from its header and table only;
+        afs_entries() scores all 16 TOC layouts in one NumPy pass
+    EXTENTS[sig](buf, pos) -> exact (start, end) of an asset from its own size fields;
+        register more formats with @extent_parser(sig)
+    AssetStore(root) -> content-addressed store: robust_scan_to_dir(..., store=...) writes
+        each distinct asset once and keeps a (container, layer, offset) -> hash manifest
+    AssetIndex(root) -> index-only: the same manifest (plus format/dimensions, JSON Lines
+        or SQLite) and no asset files; read_asset(record) reads a hit back
+    ScanCache() -> persistent hit tables / results per container, keyed by path, size,
+        mtime and a sampled content hash, with invalidate() and LRU eviction
+    RegionMap.build(buf) -> per-sector padding/data/noise map (one NumPy pre-pass);
+        regions=... skips padding when searching and noise when probing PRS, and
+        can be cached as a .rmap next to the output
 
 Outputs:
     <out_dir>/<tag>_<origin>_<ext>_<offset>.{pvr,pvp,gbix,gvr,gvm,pvm,tm2,tm2f}
@@ -19,219 +50,1473 @@ Outputs:
 Notes:
 - Does not attempt to *decode* GVR; it carves them so you can feed to external GvrTool.
 - PVR decode is handled elsewhere by PyPVR (GUI uses it for preview/PNG export).
+- `in_bytes` may be any bytes-like object, an mmap or a memoryview; PRS payloads
+  are streamed straight to their .bin file and scanned through a map of it, so
+  memory stays flat however large the decompressed data gets.
+- Nothing is sliced into bytes: PVM/GVM payloads are rescanned through memoryviews
+  and carve_to() writes chunks from the mapped region (copy_file_range/sendfile
+  when the input is a map_file() FileMap).
 """
 from __future__ import annotations
-import re, os
+import re, os, mmap, math, struct, json, hashlib, copy, threading
+from bisect import bisect_left
+from contextlib import contextmanager, closing
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:     # aligned mode then filters the regex hits instead
+    np = None
+
+from prs import prs_decompress, PRSVariantCache, SCANNER_VARIANTS, prs_note_source
+
 # --------------------------- PRS decompressors ---------------------------
 def _prs_decompress_basic(buf: bytes, start: int = 0):
     """Simple, widely-compatible CRI PRS decoder; returns (bytes, consumed) or (None, 0)."""
-    if buf[start:start+3] != b'PRS':
-        return None, 0
-    i = start + 3
-    out = bytearray()
-    bit = 0; cmd = 0
-    def getbit():
-        nonlocal bit, cmd, i
-        if bit == 0:
-            if i >= len(buf): return 0
-            cmd = buf[i]; i += 1; bit = 8
-        b = cmd & 1; cmd >>= 1; bit -= 1; return b
-    def getbyte():
-        nonlocal i
-        if i >= len(buf): return 0
-        b = buf[i]; i += 1; return b
-    while i < len(buf):
-        if getbit():
-            out.append(getbyte())
-        else:
-            if getbit():
-                a = getbyte(); b = getbyte()
-                off = ((b << 8) | a) >> 3
-                amount = (a & 7)
-                amount = (getbyte() + 1) if amount == 0 else (amount + 2)
-                sp = len(out) - 0x2000 + off
-            else:
-                amount = (getbit() << 1) | getbit()
-                off = getbyte()
-                amount += 2
-                sp = len(out) - 0x100 + off
-            for _ in range(amount):
-                if sp < 0: out.append(0)
-                elif sp < len(out): out.append(out[sp])
-                else: out.append(0)
-                sp += 1
-    return bytes(out), i - start
+    return prs_decompress(buf, start, "basic")
 
 def _prs_decompress_nights(buf: bytes, start: int = 0):
     """Alternative bitstream variant used by some builds; returns (bytes, consumed) or (None, 0)."""
-    if buf[start:start+3] != b'PRS':
-        return None, 0
-    i = start + 3
-    out = bytearray()
-    bitbuf = 0; bits = 0
-    def getbit():
-        nonlocal bitbuf, bits, i
-        if bits == 0:
-            if i >= len(buf): return 0
-            bitbuf = buf[i]; i += 1; bits = 8
-        b = bitbuf & 1; bitbuf >>= 1; bits -= 1; return b
+    return prs_decompress(buf, start, "nights")
+
+def _prs_try_all(buf: bytes, start: int, counts: dict | None = None, variants: PRSVariantCache | None = None):
+    """Decode the block at `start` up to its stop code; consumed is the exact extent.
+    Variants are probed first and only survivors get a full decode (tallied in
+    `counts`); `variants` remembers the variant chosen for this container."""
+    if variants is None:
+        variants = PRSVariantCache(SCANNER_VARIANTS)
+    return variants.decode(buf, start, counts)
+
+class FileMap(mmap.mmap):
+    """Read-only map of a file that keeps the file's descriptor (`fd`) open, so
+    carve_to() can copy ranges of it kernel-side; `path` is the mapped file."""
+    fd = -1
+    path = None
+
+@contextmanager
+def map_file(path):
+    """Read-only FileMap of `path` for the scanners (b"" for an empty file)."""
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            yield b""; return
+        mm = FileMap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        mm.fd = fp.fileno(); mm.path = os.path.abspath(path)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, count: int):
+    """Copy `count` bytes at `offset` of src_fd to dst_fd inside the kernel
+    (copy_file_range, else sendfile); OSError if neither works here."""
+    copy = getattr(os, "copy_file_range", None)
+    while count > 0:
+        if copy is not None:
+            try:
+                n = copy(src_fd, dst_fd, count, offset_src=offset)
+            except OSError:
+                copy = None; continue   # e.g. EXDEV on older kernels: try sendfile
+        elif hasattr(os, "sendfile"):
+            n = os.sendfile(dst_fd, src_fd, offset, count)
+        else:
+            raise OSError("no kernel-side copy on this platform")
+        if n <= 0:
+            raise OSError("short kernel-side copy")
+        offset += n; count -= n
+
+def _pwrite(fd: int, data, offset: int):
+    """os.pwrite() of all of `data`, or lseek+write where pwrite is missing."""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"): n = os.pwrite(fd, view, offset)
+        else: os.lseek(fd, offset, os.SEEK_SET); n = os.write(fd, view)
+        view = view[n:]; offset += n
+
+def carve_to(path, data, start: int, end: int):
+    """Write data[start:end] to `path` without materialising the slice.
+
+    A FileMap is copied kernel-side from its file; anything else (bytes, mmap,
+    memoryview) is written straight from its buffer."""
+    with open(path, "wb") as out:
+        fd = getattr(data, "fd", -1)
+        if fd >= 0 and end > start:
+            try:
+                _copy_range(fd, out.fileno(), start, end - start); return path
+            except OSError:
+                out.seek(0); out.truncate()
+        with memoryview(data) as view:
+            out.write(view[start:end])
+    return path
+
+# --------------------------- content-addressed store ---------------------------
+class AssetStore:
+    """Write each distinct carved blob once, named by its hash.
+
+        store = AssetStore(root, container="DISC.AFS")
+        store.carve(path, data, start, end, layer)   # in place of carve_to()
+        store.save()                                  # <root>/manifest.jsonl
+
+    Objects go to <root>/<hash[:2]>/<hash>.<ext> (BLAKE2b-128 of the bytes).  Every
+    call adds a manifest record {container, layer, source, offset, size, ext, name,
+    hash}, `name` being the file carve_to() would have written and source/offset
+    the byte range it came from (a map_file() map names its file; a nested window
+    is described by layer()), so each hit can still be traced and each unique
+    texture decoded once.  Existing objects (an earlier run or another process)
+    are not rewritten."""
+    MANIFEST = "manifest.jsonl"
+
+    def __init__(self, root, container: str = ""):
+        self.root = Path(root); self.container = container
+        self.source = None; self.base = 0
+        self.records = []; self.known = set(); self.totals = {"written": 0, "saved": 0}
+
+    def layer(self, source=None, base: int = 0) -> "AssetStore":
+        """The same store for a window at `base` of `source` (None: of the data the
+        current layer reads); records, objects and byte counts stay shared."""
+        sub = copy.copy(self)
+        sub.source, sub.base = (source, base) if source else (self.source, self.base + base)
+        return sub
+
+    def object_path(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.{ext}"
+
+    def _record(self, path, data, start: int, end: int, layer: str) -> dict:
+        path = Path(path); src = getattr(data, "path", None)
+        with memoryview(data) as view, view[start:end] as blob:
+            digest = hashlib.blake2b(blob, digest_size=16).hexdigest()
+        rec = {"container": self.container, "layer": layer, "source": src or self.source,
+               "offset": start if src else self.base + start, "size": end - start,
+               "ext": path.suffix.lstrip(".") or "bin", "name": path.name, "hash": digest}
+        self.records.append(rec)
+        return rec
+
+    def carve(self, path, data, start: int, end: int, layer: str = "") -> Path:
+        rec = self._record(path, data, start, end, layer); key = (rec["hash"], rec["ext"])
+        obj = self.object_path(*key)
+        if key in self.known or obj.exists():
+            self.totals["saved"] += end - start
+        else:
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp = obj.with_name(f"{obj.name}.{os.getpid()}.tmp")
+            carve_to(tmp, data, start, end); os.replace(tmp, obj)   # atomic for parallel writers
+            self.totals["written"] += end - start
+        self.known.add(key)
+        return obj
+
+    def merge(self, records, totals: dict | None = None):
+        """Take over the records (and byte counts) of a store used in another process."""
+        self.records += records
+        for k, v in (totals or {}).items(): self.totals[k] += v
+        self.known.update((r["hash"], r["ext"]) for r in records)
+
+    def summary(self) -> dict:
+        return {"assets": len(self.records), "unique": len({(r["hash"], r["ext"]) for r in self.records}),
+                "bytes_written": self.totals["written"], "bytes_saved": self.totals["saved"]}
+
+    def save(self, path=None) -> Path:
+        path = Path(path) if path else self.root / self.MANIFEST
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix in SQLITE_SUFFIXES:
+            import sqlite3
+            path.unlink(missing_ok=True)
+            with closing(sqlite3.connect(path)) as db, db:
+                db.execute(f"CREATE TABLE assets ({', '.join(INDEX_COLUMNS)})")
+                db.executemany(f"INSERT INTO assets VALUES ({', '.join('?' * len(INDEX_COLUMNS))})",
+                               ([r.get(c) for c in INDEX_COLUMNS] for r in self.records))
+            return path
+        with open(path, "w", encoding="utf-8") as fp:
+            for r in self.records:
+                fp.write(json.dumps(r, separators=(",", ":")) + "\n")
+        return path
+
+    @staticmethod
+    def load(path) -> list:
+        """Records of a manifest written by save() (JSON Lines or SQLite)."""
+        if Path(path).suffix in SQLITE_SUFFIXES:
+            import sqlite3
+            with closing(sqlite3.connect(path)) as db:
+                cur = db.execute("SELECT * FROM assets")
+                cols = [d[0] for d in cur.description]
+                return [{c: v for c, v in zip(cols, row) if v is not None} for row in cur]
+        with open(path, encoding="utf-8") as fp:
+            return [json.loads(line) for line in fp if line.strip()]
+
+class AssetIndex(AssetStore):
+    """Index-only scan: the manifest records of an AssetStore (plus format and
+    dimensions from asset_info()) without writing a single asset file.
+
+        index = AssetIndex(out_dir, container="DISC.AFS")
+        robust_scan_to_dir(data, out_dir, tag, origin, store=index)
+        index.save()                                  # <out_dir>/index.jsonl (.sqlite: SQLite)
+        raw = read_asset(AssetStore.load(path)[0])
+
+    Decode, preview and reimport read each asset back from source + offset + size,
+    so decoded PRS layers (.bin) stay on disk as the sources of their hits."""
+    MANIFEST = "index.jsonl"
+
+    def carve(self, path, data, start: int, end: int, layer: str = ""):
+        self._record(path, data, start, end, layer).update(asset_info(data, start, end))
+
+# manifest columns (SQLite table `assets`); JSON Lines records carry the same keys
+INDEX_COLUMNS = ("container", "layer", "source", "offset", "size", "ext", "name", "hash",
+                 "format", "width", "height", "px", "tex")
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+def asset_info(data, start: int, end: int) -> dict:
+    """{"format", "width", "height"} of a carved asset from its own header (PVRT adds
+    its pixel/texture modes "px"/"tex"); a GBIX prefix is skipped.  Unknown formats
+    only get "format" (the magic)."""
+    p = start
+    if bytes(data[p:p+4]) == b"GBIX" and p + 8 <= end:
+        p += 8 + _u32(data, p + 4)
+    magic = bytes(data[p:p+4])
+    if magic == b"PVRT":
+        hdr = pvrt_header(data, p)
+        if hdr is not None:
+            return {"format": "PVRT", "width": hdr[2], "height": hdr[3], "px": hdr[0], "tex": hdr[1]}
+    elif magic[:3] == b"GVR" and p + 16 <= end:
+        return {"format": "GVRT", "width": int.from_bytes(data[p+12:p+14], "big"),
+                "height": int.from_bytes(data[p+14:p+16], "big")}
+    elif magic == b"TIM2" and p + 16 <= end:
+        pic = p + (0x80 if data[p+5] else 0x10)
+        if pic + 0x18 <= end:
+            return {"format": "TIM2", "width": _u16(data, pic + 0x14), "height": _u16(data, pic + 0x16)}
+    elif end - start >= 0x30 and bytes(data[start+0x2C:start+0x30]) == b"PVR!":
+        return {"format": "PVR!", "width": _u32(data, start + 8), "height": _u32(data, start + 4)}
+    return {"format": magic.rstrip(b"\x00").decode("latin-1").replace("\x03", "3").replace("\x04", "4")}
+
+def read_asset(record) -> bytes:
+    """The bytes of one manifest record, read from its source file."""
+    with open(record["source"], "rb") as fp:
+        fp.seek(record["offset"]); return fp.read(record["size"])
+
+# --------------------------- signature table ---------------------------
+# Every carve target.  A signature that is a prefix of another (GVR of GVRT) also
+# lists the longer one's hits, the way a plain find() for it would see them.
+SIGNATURES = (b"PVRT", b"PVPL", b"GBIX", b"PVR!", b"PVR\x03", b"PVR\x04", b"TIM2", b"TM2F",
+              b"PVMH", b"GVMH", b"GVRT", b"GVR", b"PRS", b"AFS\x00")
+
+# Aligned scan mode: alignment per signature (3- or 4-byte magics, multiples of 4).
+# PRS sits at arbitrary offsets inside packed data and stays byte-granular.
+# Pass a dict to HitTable(align=...) to override, e.g. {**ALIGNED, b"AFS\x00": 2048}.
+ALIGNED = {b"PVRT": 4, b"PVPL": 4, b"GBIX": 4, b"PVR!": 4, b"PVR\x03": 4, b"PVR\x04": 4,
+           b"PVMH": 4, b"GVMH": 4, b"GVRT": 4, b"GVR": 4, b"TIM2": 4, b"TM2F": 4, b"AFS\x00": 4}
+
+def _alignment(sigs, align) -> dict:
+    """{sig: alignment > 1} for the signatures `align` (int or dict) applies to; an int
+    covers every signature in ALIGNED."""
+    if not align:
+        return {}
+    if isinstance(align, int):
+        align = {t: align for t in ALIGNED}
+    out = {}
+    for t in sigs:
+        a = align.get(t, 1)
+        if a > 1 and 3 <= len(t) <= 4:
+            if a % 4:
+                raise ValueError(f"alignment of {t!r} must be a multiple of 4, not {a}")
+            out[t] = a
+    return out
+
+def parse_align(spec: str) -> dict:
+    """"4" or "4,AFS=2048,PVRT=32" (CLI form) -> {sig: alignment} for HitTable(align=...).
+    The leading number applies to every signature in ALIGNED."""
+    names = {t.rstrip(b"\x00").decode("latin-1"): t for t in ALIGNED}
+    out = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, val = part.rpartition("=")
+        if not name:
+            out.update((t, int(val)) for t in ALIGNED)
+        elif name.upper() in names:
+            out[names[name.upper()]] = int(val)
+        else:
+            raise ValueError(f"unknown signature {name!r} in alignment spec")
+    return out
+
+class HitTable:
+    """Offsets of every signature of one buffer, found in a single regex pass.
+
+    The combined pattern yields non-overlapping matches, so a signature starting
+    inside another one's match (TIM2 in b"PVRTIM2") is looked for explicitly
+    afterwards; the result equals one find() loop per signature.
+
+    With `align` (an int, or {sig: alignment} such as ALIGNED) the aligned
+    signatures are only reported at offsets that are multiples of their
+    alignment; they are found by comparing the buffer, viewed as little-endian
+    uint32 words, against all their magics at once (3-byte ones under a 24-bit
+    mask; NumPy, without it the regex hits are filtered).  The regex then only
+    runs for the rest, normally just PRS.
+
+    With `regions` (a RegionMap of the buffer) padding sectors are not searched.
+    With `span` (start, end) only hits starting in that range are reported; a
+    match may still run past its end.  HitTable.for_file() scans the spans of
+    one file on a process pool and merges them into the table of the whole file."""
+    _patterns = {}
+
+    def __init__(self, buf, sigs=SIGNATURES, align=None, regions=None, span=None):
+        sigs = tuple(sigs); aligned = _alignment(sigs, align)
+        self.size = len(buf)
+        self.by_sig = by_sig = {t: [] for t in sigs}
+        ranges = regions.live_ranges() if regions is not None else [(0, self.size)]
+        if span is not None:
+            ranges = [(max(s, span[0]), min(e, span[1])) for s, e in ranges if s < span[1] and e > span[0]]
+        if aligned and np is not None:
+            self._scan_words(buf, aligned, ranges)
+            rest = tuple(t for t in sigs if t not in aligned)
+        else:
+            rest = sigs
+        if rest:
+            pat, overlaps = self._compile(rest)
+            tail = max(map(len, rest)) - 1      # a hit may run past its range's end
+            for s, e in ranges:
+                for m in pat.finditer(buf, s, min(self.size, e + tail)):
+                    if m.start() < e: by_sig[m.group()].append(m.start())
+            for t, cands in overlaps.items():
+                for p in by_sig[t]:
+                    for q, u in ((p + d, u) for d, u in cands):
+                        if buf[q:q+len(u)] == u:
+                            by_sig[u].append(q)
+        # an aligned 3-byte magic already matched inside longer words (GVR in GVRT)
+        for t in rest:
+            for longer in rest:
+                if longer != t and longer.startswith(t) and by_sig[longer]:
+                    by_sig[t] = by_sig[t] + by_sig[longer]
+        for t, a in aligned.items():
+            if t in rest:       # no NumPy: keep the aligned regex hits
+                by_sig[t] = [p for p in by_sig[t] if p % a == 0]
+        for t in sigs:
+            offs = by_sig[t]
+            if any(offs[k] >= offs[k+1] for k in range(len(offs) - 1)):
+                by_sig[t] = sorted(set(offs))
+
+    def _scan_words(self, buf, aligned: dict, ranges):
+        """Fill by_sig for the aligned signatures, one vectorized compare per alignment,
+        magic length and range."""
+        words = np.frombuffer(buf, dtype="<u4", count=self.size // 4)
+        for a, k in sorted({(v, len(t)) for t, v in aligned.items()}):
+            group = [t for t, v in aligned.items() if v == a and len(t) == k]
+            magics = np.array([int.from_bytes(t, "little") for t in group], dtype="<u4")
+            for s, e in ranges:
+                s = -(-s // a) * a
+                view = words[s // 4:e // 4:a // 4]
+                if k == 3: view = view & 0xFFFFFF
+                idx = np.flatnonzero(np.isin(view, magics))
+                found = view[idx]
+                for t, m in zip(group, magics):
+                    self.by_sig[t] += (idx[found == m] * a + s).tolist()
+            for t in group:
+                q = (self.size - k) // a * a      # a 3-byte magic can end in the partial last word
+                if q >= len(words) * 4 and ranges and q < ranges[-1][1] and buf[q:q+k] == t:
+                    self.by_sig[t].append(q)
+
+    @classmethod
+    def for_file(cls, path, sigs=SIGNATURES, align=None, regions=None, workers: int = 1,
+                 part: int = 64 << 20, cache: "ScanCache | None" = None) -> "HitTable":
+        """HitTable of a whole file, scanned as spans of about `part` bytes (sector
+        multiples, so aligned words never straddle a cut) on `workers` processes,
+        each mapping the file itself.  A match crossing a cut belongs to the span it
+        starts in; hits found twice near a cut are dropped when merging, so the
+        result equals HitTable(map of the file).  With `cache` (a ScanCache) the
+        table of an unchanged file is loaded instead of scanned."""
+        sigs = tuple(sigs)
+        if cache is not None:
+            params = {"sigs": [t.hex() for t in sigs], "regions": regions is not None,
+                      "align": {t.hex(): a for t, a in _alignment(sigs, align).items()}}
+            found = cache.get(path, "hits", params)
+            if found is not None:
+                table = cls.__new__(cls); table.size = os.path.getsize(path)
+                table.by_sig = {t: found[t.hex()] for t in sigs}
+                return table
+            table = cls.for_file(path, sigs, align, regions, workers, part)
+            cache.put(path, "hits", params, {t.hex(): offs for t, offs in table.by_sig.items()})
+            return table
+        size = os.path.getsize(path)
+        part = max(SECTOR, -(-part // SECTOR) * SECTOR)
+        spans = [(a, min(size, a + part)) for a in range(0, size, part)]
+        if workers <= 1 or len(spans) <= 1:
+            with map_file(path) as buf:
+                return cls(buf, sigs, align, regions)
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = [(os.fspath(path), sigs, align, regions, sp) for sp in spans]
+        table = cls.__new__(cls); table.size = size
+        table.by_sig = {t: [] for t in sigs}
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as ex:
+            for found in ex.map(_scan_span, jobs):    # span order: offsets stay ascending
+                for t, offs in found.items(): table.by_sig[t] += offs
+        for t, offs in table.by_sig.items():
+            if any(offs[k] >= offs[k+1] for k in range(len(offs) - 1)):
+                table.by_sig[t] = sorted(set(offs))
+        return table
+
+    @classmethod
+    def _compile(cls, sigs):
+        """-> (pattern, {sig: [(delta, other)]}) where `other` may start `delta` bytes into `sig`."""
+        if sigs not in cls._patterns:
+            pat = re.compile(b"|".join(re.escape(t) for t in sorted(sigs, key=len, reverse=True)))
+            overlaps = {}
+            for t in sigs:
+                for u in sigs:
+                    for d in range(1, len(t)):
+                        if u.startswith(t[d:]) or t[d:].startswith(u):
+                            overlaps.setdefault(t, []).append((d, u))
+            cls._patterns[sigs] = pat, overlaps
+        return cls._patterns[sigs]
+
+    def offsets(self, sig: bytes) -> list[int]:
+        """Sorted offsets of `sig` (must be one of the table's signatures)."""
+        return self.by_sig[sig]
+
+    def hits(self) -> list[tuple[int, bytes]]:
+        """(offset, signature) for every hit, in file order."""
+        return sorted((p, t) for t, offs in self.by_sig.items() for p in offs)
+
+    def next_tag(self, start: int, tags) -> int:
+        """First offset >= start of any of `tags`, or the buffer size."""
+        best = self.size
+        for t in tags:
+            offs = self.by_sig[t]; k = bisect_left(offs, start)
+            if k < len(offs) and offs[k] < best: best = offs[k]
+        return best
+
+    def prev_tag(self, lo: int, hi: int, tag: bytes) -> int:
+        """Last offset of `tag` in [lo, hi), or -1 (rfind on the table)."""
+        offs = self.by_sig[tag]; k = bisect_left(offs, hi) - 1
+        return offs[k] if k >= 0 and offs[k] >= lo else -1
+
+def _scan_span(job) -> dict:
+    """One span of HitTable.for_file() in a pool process: {sig: offsets}."""
+    path, sigs, align, regions, span = job
+    with map_file(path) as buf:
+        return HitTable(buf, sigs, align, regions, span).by_sig
+
+# --------------------------- PVRT header validation ---------------------------
+# PyPVR's mode tables (Pypvr.px_modes / tex_modes).  pypvr imports this module and
+# may be replaced by the GUI's stub, so it is imported late and these copies are
+# used when it is not available.
+_PX_MODES = {0: "1555", 1: "565", 2: "4444", 3: "yuv422", 4: "bump", 5: "555", 6: "yuv420",
+             7: "8888", 8: "p4bpp", 9: "p8bpp"}
+_TEX_MODES = {1: "tw", 2: "tw mm", 3: "vq", 4: "vq mm", 5: "pal4", 6: "pal4 mm", 7: "pal8",
+              8: "pal8 mm", 9: "re", 10: "re mm", 11: "st", 12: "st mm", 13: "twre", 14: "bmp",
+              15: "bmp mm", 16: "svq", 17: "svq mm", 18: "twal mm"}
+_PVR_MODES = None
+_PAL_PX = {"1555", "565", "4444", "8888", "p4bpp", "p8bpp"}
+# bytes in front of the 8x8 mip level (smaller levels + padding), as load_pvr() skips them
+_MIP_TAIL = {"tw": 0x2c, "re": 0x2c, "pal4": 0xc, "pal8": 0x18, "bmp": 0x54, "twal": 0x30, "vq": 0x6, "svq": 0x6}
+CHUNK_SLACK = 0x20  # a size field may exceed the computed layout by writer padding
+# headers that end the padding of a PVRT whose size field runs past CHUNK_SLACK
+_PVRT_NEXT = (b"PVRT", b"PVPL", b"GBIX", b"GVRT", b"PVMH", b"GVMH", b"TIM2", b"PRS")
+
+def _pvr_modes():
+    global _PVR_MODES
+    if _PVR_MODES is None:
+        try:
+            from pypvr import Pypvr
+            _PVR_MODES = Pypvr.px_modes, Pypvr.tex_modes
+        except (ImportError, AttributeError):
+            _PVR_MODES = _PX_MODES, _TEX_MODES
+    return _PVR_MODES
+
+def pvrt_data_size(px: int, tex: int, w: int, h: int) -> int | None:
+    """Bytes after the 16-byte PVRT header (codebook, mips, top level) for this
+    format and size, or None if the combination is not a legal texture."""
+    px_modes, tex_modes = _pvr_modes()
+    if px not in px_modes or tex not in tex_modes:
+        return None
+    kind, *mm = tex_modes[tex].split(); mm = bool(mm)
+    if mm and kind == "st":
+        return None                                  # reserved code; "re mm" is laid out like "tw mm"
+    pal = kind in ("pal4", "pal8")
+    if (px_modes[px] not in _PAL_PX) if pal else px_modes[px] in ("p4bpp", "p8bpp"):
+        return None                                  # placeholder formats are for palettes only
+    if not (8 <= w <= 1024 and 1 <= h <= 1024):
+        return None
+    if kind == "st":
+        if w % 32: return None                       # stride: width in 32s, any height
+    elif h < 8 or w & (w - 1) or h & (h - 1):
+        return None
+    if mm and w != h:
+        return None
+    if kind in ("vq", "svq"):
+        if kind == "vq": book = 256
+        elif w <= 16: book = 16
+        elif w == 32: book = 64 if mm else 32
+        elif w == 64 and not mm: book = 128
+        else: book = 256
+        size = book * 8; level = lambda s: s * s // 4
+    else:
+        bits = {"pal4": 4, "pal8": 8, "bmp": 32}.get(kind, 16)
+        size = 0; level = lambda s: s * s * bits // 8
+    if mm:
+        size += _MIP_TAIL[kind] + sum(level(1 << k) for k in range(3, w.bit_length() - 1))
+    return size + level(w) * h // w
+
+def _next_header(buf, start: int, stop: int, sigs=_PVRT_NEXT, chunk: int = 1 << 16) -> int:
+    """First offset in [start, stop) where one of `sigs` begins, else stop; buf is
+    read a chunk at a time, so a huge bogus size field costs no big copy."""
+    for a in range(start, stop, chunk):
+        piece = bytes(buf[a:min(stop, a + chunk) + 3])
+        hit = min((i for i in (piece.find(sig) for sig in sigs) if i != -1), default=-1)
+        if hit != -1 and a + hit < stop:
+            return a + hit
+    return stop
+
+def pvrt_header(buf, pos: int):
+    """(px, tex, w, h, end) of a valid PVRT header at `pos`, else None.
+
+    Valid means: known pixel/texture modes in a legal pairing, power-of-two (or
+    stride) dimensions, zero reserved bytes, and a size field covering the layout,
+    whose data lies inside buf.  `end` is pos + 8 + size field; padding past
+    CHUNK_SLACK is cut at the end of buf or at the next known header."""
+    n = len(buf)
+    if pos + 16 > n or buf[pos+10] or buf[pos+11]:
+        return None
+    declared = int.from_bytes(buf[pos+4:pos+8], "little")
+    px, tex = buf[pos+8], buf[pos+9]
+    w = int.from_bytes(buf[pos+12:pos+14], "little"); h = int.from_bytes(buf[pos+14:pos+16], "little")
+    need = pvrt_data_size(px, tex, w, h)
+    if need is None or declared < need + 8 or pos + 16 + need > n:
+        return None
+    end = pos + 8 + declared
+    if declared > need + 8 + CHUNK_SLACK or end > n:
+        end = _next_header(buf, pos + 16 + need, min(end, n))
+    return px, tex, w, h, end
+
+# --------------------------- extent parsers ---------------------------
+# EXTENTS maps a signature to fn(buf, pos) -> (start, end) of the asset whose magic
+# is at pos, read from its own size fields, or None if the header does not parse.
+# Formats without a parser fall back to the next-header bound in robust_scan_to_dir.
+EXTENTS = {}
+
+def extent_parser(*sigs):
+    """Decorator registering an extent parser for the given signatures."""
+    def register(fn):
+        for sig in sigs: EXTENTS[sig] = fn
+        return fn
+    return register
+
+def _u16(buf, o): return int.from_bytes(buf[o:o+2], "little")
+def _u32(buf, o): return int.from_bytes(buf[o:o+4], "little")
+
+@extent_parser(b"PVRT")
+def _pvrt_extent(buf, pos):
+    hdr = pvrt_header(buf, pos)
+    return (pos, hdr[4]) if hdr is not None else None
+
+@extent_parser(b"GBIX")
+def _gbix_extent(buf, pos):
+    """GBIX global index chunk: 8-byte header + 4 or 8 bytes (some writers pad to 16)."""
+    size = _u32(buf, pos + 4)
+    if size not in (4, 8, 16) or pos + 8 + size > len(buf):
+        return None
+    return pos, pos + 8 + size
+
+# GVR data formats: (bits per pixel, block width, block height)
+_GVR_FORMATS = {0x0: (4, 8, 8), 0x1: (8, 8, 4), 0x2: (8, 8, 4), 0x3: (16, 4, 4), 0x4: (16, 4, 4),
+                0x5: (16, 4, 4), 0x6: (32, 4, 4), 0x8: (4, 8, 8), 0x9: (8, 8, 4), 0xE: (4, 8, 8)}
+
+@extent_parser(b"GVRT", b"GVR")
+def _gvrt_extent(buf, pos):
+    """GVRT chunk: LE size field, flags/palette nibbles at +0x0A, data format at +0x0B,
+    big-endian width/height.  Pixel data is stored in blocks, padded per mip level;
+    an internal palette (flag 0x8) precedes it."""
+    n = len(buf)
+    if pos + 16 > n or buf[pos+3:pos+4] != b"T":
+        return None
+    declared = _u32(buf, pos + 4); flags = buf[pos+10] & 0x0F; fmt = buf[pos+11]
+    w = int.from_bytes(buf[pos+12:pos+14], "big"); h = int.from_bytes(buf[pos+14:pos+16], "big")
+    if fmt not in _GVR_FORMATS or not (1 <= w <= 1024 and 1 <= h <= 1024):
+        return None
+    bits, bw, bh = _GVR_FORMATS[fmt]
+    need = (2 << bits if fmt in (0x8, 0x9) else 0) if flags & 0x8 else 0
     while True:
-        if getbit():
-            if i >= len(buf): break
-            out.append(buf[i]); i += 1
+        need += -(-w // bw) * bw * -(-h // bh) * bh * bits // 8
+        if not flags & 0x1 or (w == 1 and h == 1): break
+        w = max(1, w >> 1); h = max(1, h >> 1)
+    if not need + 8 <= declared <= need + 8 + CHUNK_SLACK or pos + 8 + declared > n:
+        return None
+    return pos, pos + 8 + declared
+
+@extent_parser(b"TIM2")
+def _tim2_extent(buf, pos):
+    """TIM2: 16-byte file header (version, alignment, picture count), then pictures
+    whose headers give total = header + CLUT + image size."""
+    n = len(buf)
+    if pos + 16 > n or buf[pos+4] not in (3, 4) or buf[pos+5] not in (0, 1):
+        return None
+    count = _u16(buf, pos + 6)
+    p = pos + (0x80 if buf[pos+5] else 0x10)
+    if not 1 <= count <= 0x1000:
+        return None
+    for _ in range(count):
+        if p + 0x30 > n:
+            return None
+        total, clut, image, head = _u32(buf, p), _u32(buf, p + 4), _u32(buf, p + 8), _u16(buf, p + 12)
+        w, h = _u16(buf, p + 0x14), _u16(buf, p + 0x16)
+        if head < 0x30 or total != head + clut + image or not (w and h) or p + total > n:
+            return None
+        p += total
+    return pos, p
+
+@extent_parser(b"PVR!")
+def _pvr2_extent(buf, pos):
+    """Legacy PowerVR v2 header: the "PVR!" tag sits at +0x2C of a 52-byte header that
+    starts with its own size and holds height, width and the texture data size."""
+    start = pos - 0x2C
+    if start < 0 or _u32(buf, start) != 52:
+        return None
+    h, w, data = _u32(buf, start + 4), _u32(buf, start + 8), _u32(buf, start + 20)
+    if not (1 <= w <= 4096 and 1 <= h <= 4096) or not 0 < data <= len(buf) - start - 52:
+        return None
+    return start, start + 52 + data
+
+# PVR v3 compressed pixel formats: id -> (bits per pixel, block width, block height)
+_PVR3_COMPRESSED = {0: (2, 8, 4), 1: (2, 8, 4), 2: (4, 4, 4), 3: (4, 4, 4), 6: (4, 4, 4), 7: (4, 4, 4),
+                    8: (8, 4, 4), 9: (8, 4, 4), 10: (8, 4, 4), 11: (8, 4, 4)}
+
+@extent_parser(b"PVR\x03")
+def _pvr3_extent(buf, pos):
+    """PowerVR v3 header (52 bytes + metadata): data size follows from the pixel
+    format (channel bit rates or a compressed format id), dimensions, surfaces,
+    faces and mip count."""
+    n = len(buf)
+    if pos + 52 > n:
+        return None
+    fmt_lo, fmt_hi = _u32(buf, pos + 8), _u32(buf, pos + 12)
+    h, w, d, surfaces, faces, mips, meta = (_u32(buf, pos + o) for o in range(24, 52, 4))
+    if fmt_hi:
+        bits = sum(fmt_hi.to_bytes(4, "little")); bw = bh = 1
+    elif fmt_lo in _PVR3_COMPRESSED:
+        bits, bw, bh = _PVR3_COMPRESSED[fmt_lo]
+    else:
+        return None
+    if not (1 <= w <= 8192 and 1 <= h <= 8192 and 1 <= d <= 2048 and 1 <= surfaces <= 256
+            and faces in (1, 6) and 1 <= mips <= 16 and meta <= n):
+        return None
+    data = 0
+    for m in range(mips):
+        lw, lh, ld = max(1, w >> m), max(1, h >> m), max(1, d >> m)
+        data += -(-lw // bw) * bw * -(-lh // bh) * bh * ld * bits // 8
+    end = pos + 52 + meta + data * surfaces * faces
+    return (pos, end) if end <= n else None
+
+# --------------------------- AFS table of contents ---------------------------
+# Candidate readings of the (a, b) u32 pairs after the 12-byte AFS header, in the order
+# ties are broken: (column holding the offset, offset relative to the header,
+# offset multiplier, size multiplier); the other column holds the size.
+AFS_LAYOUTS = [(col, rel, mo, ms) for col, rel in ((0, 0), (1, 0), (0, 1), (1, 1))
+               for mo in (1, 2048) for ms in (1, 2048)]
+
+def afs_entries(toc, base: int, total: int) -> list:
+    """Entries {index, offset, size} of an AFS table `toc` (the raw pairs, 8 bytes
+    each) whose header sits at `base` of a `total`-byte file.  Every layout of
+    AFS_LAYOUTS is scored by how many entries it places inside the file, all at
+    once on a NumPy (16, n) grid; entries outside the file under the best one are
+    dropped."""
+    return afs_layout(toc, base, total)[1]
+
+def afs_layout(toc, base: int, total: int):
+    """(layout, entries): the AFS_LAYOUTS row afs_entries() picks and its entries."""
+    n = len(toc) // 8
+    if np is not None:
+        pairs = np.frombuffer(toc, dtype="<u4", count=n * 2).reshape(n, 2).astype(np.int64)
+        lay = np.array(AFS_LAYOUTS, dtype=np.int64)
+        off = pairs[:, lay[:, 0]].T * lay[:, 2, None] + base * lay[:, 1, None]
+        size = pairs[:, 1 - lay[:, 0]].T * lay[:, 3, None]
+        ok = (off >= 0) & (off < total) & (size > 0) & (size <= total - off)
+        k = int(np.argmax(ok.sum(axis=1)))
+        keep = np.flatnonzero(ok[k])
+        return AFS_LAYOUTS[k], [{"index": i, "offset": o, "size": z}
+                for i, o, z in zip(keep.tolist(), off[k, keep].tolist(), size[k, keep].tolist())]
+    pairs = struct.unpack(f"<{n * 2}I", toc[:n * 8])
+    fits = lambda o, z: 0 <= o < total and 0 < z <= total - o
+    def place(layout):
+        col, rel, mo, ms = layout
+        return [(i, pairs[2*i + col] * mo + base * rel, pairs[2*i + 1 - col] * ms) for i in range(n)]
+    best = max(AFS_LAYOUTS, key=lambda l: (sum(fits(o, z) for _, o, z in place(l)), -AFS_LAYOUTS.index(l)))
+    return best, [{"index": i, "offset": o, "size": z} for i, o, z in place(best) if fits(o, z)]
+
+def afs_toc(fp, total: int | None = None):
+    """(base, entries) of the AFS archive in the open binary file `fp`, reading only
+    its header and table; an archive not at offset 0 is located through a map of
+    the file.  ValueError if there is none."""
+    fd = fp.fileno(); total = os.fstat(fd).st_size if total is None else total
+    fp.seek(0); head = fp.read(12); base = 0
+    if head[:4] != b"AFS\x00":
+        if not total: raise ValueError("AFS not found")
+        with closing(FileMap(fd, 0, access=mmap.ACCESS_READ)) as data:
+            base = data.find(b"AFS\x00")
+        if base == -1: raise ValueError("AFS not found")
+        fp.seek(base); head = fp.read(12)
+    n = min(_u32(head, 4), max(0, total - base - 12) // 8)   # a bogus count cannot run past EOF
+    fp.seek(base + 12)
+    return base, afs_entries(fp.read(n * 8), base, total)
+
+AFS_NAME_RECORD = 0x30     # name[32], 6 x u16 date/time, u32 length
+AFS_ALIGN = 0x800          # entries start on CD sectors
+AFS_STRATEGIES = ("minimal", "append", "shift", "repack")
+
+def afs_name_table(fp, n: int, first: int, total: int):
+    """(pointer position, offset, size) of the filename/attribute table of the AFS
+    archive at the start of `fp`, or None.  Its (offset, size) pair follows the
+    n-entry TOC or ends the header sectors (just before `first`, the lowest entry
+    offset); the table must hold n records and lie past the header."""
+    for at in (12 + 8 * n, first - 8):
+        if at < 12 + 8 * n or at + 8 > total: continue
+        fp.seek(at); o, size = struct.unpack("<II", fp.read(8))
+        if size >= AFS_NAME_RECORD * n and size and first <= o and o + size <= total:
+            return at, o, size
+    return None
+
+def afs_plan(pieces, first: int, align: int, strategy: str):
+    """{key: new offset} for the (offset, old size, new size, key) `pieces` of an
+    AFS body (entries and the name table, sorted by offset), all past `first`.
+
+    append   a piece stays unless it grew past the start of the next one; grown
+             pieces go to the end of the archive, their old slots left as holes
+    shift    order kept; each piece starts at its old offset or, when the one
+             before now reaches past it, at the next `align` boundary after it,
+             so a growth ripples forward only until sector slack absorbs it
+    repack   every piece rewritten back to back from `first`, `align`-ed"""
+    up = lambda x: -(-x // align) * align
+    place = {}
+    if strategy == "repack":
+        cur = first
+        for off, old, new, key in pieces:
+            place[key] = up(cur); cur = place[key] + new
+    elif strategy == "shift":
+        cur = first
+        for off, old, new, key in pieces:
+            place[key] = max(off, up(cur)); cur = place[key] + new
+    else:
+        grown = []
+        for k, (off, old, new, key) in enumerate(pieces):
+            nxt = next((p[0] for p in pieces[k+1:] if p[0] > off), None)
+            if new <= old or nxt is None or off + new <= nxt: place[key] = off
+            else: grown.append((new, key))
+        cur = up(max([place[p[3]] + p[2] for p in pieces if p[3] in place] + [first]))
+        for new, key in grown:
+            place[key] = cur; cur = up(cur + new)
+    return place
+
+class EntryReader:
+    """Entries of an archive file served from one handle kept open.
+
+        with AFSArchive(path) as afs:                  # subclasses fill self.entries
+            raw = afs.read_entry_bytes(i)              # bytes via os.pread
+            with afs.entry_view(i) as view: ...        # zero-copy memoryview of a map
+
+    read_entry_bytes()/read_range() use os.pread on the shared descriptor, which
+    has no file position, so threads may read concurrently (a locked seek+read
+    where pread is missing).  entry_view() slices a read-only FileMap opened on
+    first use.  close() (or leaving the with block) releases the descriptor;
+    the map goes once no view of it is alive."""
+    def _open(self, path):
+        self.path = Path(path); self._fp = open(self.path, "rb")
+        self._map = None; self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                try: self._map.close()
+                except BufferError: pass   # views still exported: freed with the last one
+                self._map = None
+            self._fp.close()
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        if hasattr(os, "pread"):
+            return os.pread(self._fp.fileno(), size, offset)
+        with self._lock:
+            self._fp.seek(offset); return self._fp.read(size)
+
+    def read_entry_bytes(self, idx: int) -> bytes:
+        e = self.entries[idx]
+        return self.read_range(e["offset"], e["size"])
+
+    def file_map(self):
+        """The shared read-only FileMap of the archive (b"" for an empty file)."""
+        with self._lock:
+            if self._map is None:
+                fd = self._fp.fileno()
+                if os.fstat(fd).st_size == 0: return b""
+                self._map = FileMap(fd, 0, access=mmap.ACCESS_READ); self._map.fd = fd
+                self._map.path = os.path.abspath(self.path)
+            return self._map
+
+    def entry_view(self, idx: int) -> memoryview:
+        e = self.entries[idx]
+        return memoryview(self.file_map())[e["offset"]:e["offset"] + e["size"]]
+
+    def entry_kind(self, idx: int) -> str:
+        """Sniffed type of an entry: asset_info()'s "format" of its first bytes
+        ("PVRT", "TIM2", ...), else the carve signature it starts with ("PVMH",
+        "AFS", "PRS", ...), else "bin"."""
+        e = self.entries[idx]
+        head = self.read_range(e["offset"], min(e["size"], 0x40))
+        info = asset_info(head, 0, len(head))
+        if "width" in info: return info["format"]
+        sig = next((s for s in SIGNATURES if head.startswith(s)), None)
+        return "bin" if sig is None else asset_info(sig, 0, len(sig))["format"]
+
+    def _copy_out(self, fd: int, offset: int, count: int):
+        """Append `count` archive bytes at `offset` to fd at its position: kernel-side,
+        else (from the same position again) a buffered read_range()/write loop."""
+        at = os.lseek(fd, 0, os.SEEK_CUR)
+        try:
+            _copy_range(self._fp.fileno(), fd, offset, count); return
+        except OSError:
+            os.lseek(fd, at, os.SEEK_SET)
+        end = offset + count
+        while offset < end:       # a range past EOF stops short like read()
+            chunk = self.read_range(offset, min(end - offset, 1 << 20))
+            if not chunk: break
+            os.write(fd, chunk); offset += len(chunk)
+
+    def _extract_one(self, e: dict, path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            self._copy_out(fd, e["offset"], e["size"])
+        finally:
+            os.close(fd)
+
+    def extract(self, out_dir, name: str = "{index:04d}.bin", indices=None, kinds=None,
+                workers: int = 0, skip_empty: bool = False) -> int:
+        """Copy entries to out_dir/name.format(**entry, kind=...) kernel-side
+        (copy_file_range, else sendfile, else buffered pread/write) on a thread
+        pool of `workers` threads (0 = up to 8).  `indices` (a range or any
+        iterable of entry indices) and `kinds` (entry_kind() values, any case)
+        filter the entries; `name` may hold subfolders such as "{kind}/...",
+        created once up front.  Returns the number of files written."""
+        picked = self.entries if indices is None else [self.entries[i] for i in indices]
+        if skip_empty:
+            picked = [e for e in picked if e["offset"] and e["size"]]
+        want = None if kinds is None else {k.upper() for k in kinds}
+        need_kind = want is not None or "{kind" in name
+        out = Path(out_dir); jobs = []
+        for e in picked:
+            kind = self.entry_kind(e["index"]) if need_kind else ""
+            if want is not None and kind.upper() not in want: continue
+            jobs.append((e, out / name.format(**e, kind=kind)))
+        for d in {p.parent for _, p in jobs} | {out}:
+            d.mkdir(parents=True, exist_ok=True)
+        workers = min(workers if workers > 0 else min(8, os.cpu_count() or 1), max(1, len(jobs)))
+        if workers <= 1:
+            for e, p in jobs: self._extract_one(e, p)
+            return len(jobs)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for _ in ex.map(lambda job: self._extract_one(*job), jobs): pass
+        return len(jobs)
+
+    def _patches(self, repl: dict) -> list:
+        """(offset, size, replacement path, its size) per replaced entry, in `repl` order."""
+        patches = []
+        for idx, newp in repl.items():
+            idx = int(idx); e = self.entries[idx]; n = os.path.getsize(newp)
+            if n > e["size"]:
+                raise ValueError(f"Entry #{idx} replacement is larger than original ({n}>{e['size']}).")
+            patches.append((e["offset"], e["size"], newp, n))
+        return patches
+
+    def repack(self, repl: dict, out_path, in_place: bool = False) -> Path:
+        """Copy of the archive with entries replaced ({index: file}); a shorter file
+        is zero-padded to the entry size, a longer one is refused.
+
+        Streamed: the untouched ranges between replaced entries are copied kernel-
+        side and only the replacements and their padding are written, so memory
+        stays flat whatever the archive size.  in_place=True copies the whole
+        archive first (one kernel copy, a reflink where the filesystem has them)
+        and then pwrite()s only the changed ranges into it; out_path may then be
+        the archive itself to patch it directly."""
+        patches = self._patches(repl); outp = Path(out_path)
+        same = outp.exists() and os.path.samefile(outp, self.path)
+        if same and not in_place:
+            raise ValueError("Streaming repack cannot overwrite its own source; use in_place=True.")
+        total = os.fstat(self._fp.fileno()).st_size
+        flags = os.O_WRONLY | getattr(os, "O_BINARY", 0)
+        fd = os.open(outp, flags if same else flags | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            if in_place:
+                if not same: self._copy_out(fd, 0, total)
+                for off, size, newp, n in patches:
+                    with open(newp, "rb") as fp: data = fp.read()
+                    _pwrite(fd, data + bytes(size - n), off)
+                return outp
+            # entries may share bytes: each cut-to-cut range comes from the last
+            # replacement covering it (as pwrite()s in order would leave it), else the source
+            cuts = sorted({0, total} | {p[0] for p in patches} | {p[0] + p[1] for p in patches})
+            for a, b in zip(cuts, cuts[1:]):
+                top = next((p for p in reversed(patches) if p[0] <= a and b <= p[0] + p[1]), None)
+                if top is None:
+                    self._copy_out(fd, a, b - a); continue
+                off, size, newp, n = top; lo, hi = a - off, b - off
+                if lo < n:
+                    with open(newp, "rb") as fp:
+                        fp.seek(lo); left = min(hi, n) - lo
+                        while left > 0:
+                            chunk = fp.read(min(left, 1 << 20))
+                            if not chunk: raise OSError(f"{newp} shrank while repacking")
+                            os.write(fd, chunk); left -= len(chunk)
+                for k in range(max(lo, n), hi, 1 << 20): os.write(fd, bytes(min(hi - k, 1 << 20)))
+        finally:
+            os.close(fd)
+        return outp
+
+    def rebuild(self, repl: dict, out_path, strategy: str = "minimal", align: int = AFS_ALIGN) -> dict:
+        """Rebuilt copy of this AFS with entries replaced ({index: file}) by files of
+        any size: entries and the filename table are laid out by afs_plan() at
+        `align` boundaries, and the TOC, the name-table pointer and the table's
+        length fields are rewritten in the archive's own TOC layout.  "minimal"
+        plans append, shift and repack and keeps the one that places the fewest
+        bytes at a new offset (then the smallest file): relocating a grown entry
+        costs its size, shifting costs every piece the growth ripples through.  Data is streamed (kernel-side
+        copies at the new offsets), nothing is held in memory; bytes outside the
+        header, the entries and the name table come out as zeros.
+        Returns {path, strategy, moved, relocated, size}."""
+        if strategy not in AFS_STRATEGIES: raise ValueError(f"unknown strategy {strategy!r}")
+        if getattr(self, "base", 0): raise ValueError("Embedded AFS: rebuild the file that contains it.")
+        outp = Path(out_path)
+        if outp.exists() and os.path.samefile(outp, self.path):
+            raise ValueError("Rebuild cannot overwrite its own source.")
+        total = os.fstat(self._fp.fileno()).st_size
+        n = min(_u32(self.read_range(0, 12), 4), max(0, total - 12) // 8); toc = self.read_range(12, n * 8)
+        (col, rel, mo, ms), found = afs_layout(toc, 0, total)    # indices are TOC slots whatever reader filled self.entries
+        if align % mo: raise ValueError(f"Alignment {align} is not a multiple of the TOC offset unit {mo}.")
+        repl = {int(i): p for i, p in repl.items()}
+        known = {e["index"] for e in found}
+        for i in repl:
+            if i not in known: raise ValueError(f"Entry #{i} is not in the archive.")
+        first = min((e["offset"] for e in found), default=12 + 8 * n)
+        with self._lock:
+            names = afs_name_table(self._fp, n, first, total)
+        pieces = sorted([(e["offset"], e["size"], os.path.getsize(repl[e["index"]]) if e["index"] in repl else e["size"],
+                          e["index"]) for e in found] + ([(names[1], names[2], names[2], -1)] if names else []))
+        plans = {k: afs_plan(pieces, first, align, k) for k in AFS_STRATEGIES[1:]}
+        moved = {k: sum(new for off, old, new, key in pieces if plan[key] != off) for k, plan in plans.items()}
+        end = {k: -(-max([plan[p[3]] + p[2] for p in pieces] + [first]) // align) * align for k, plan in plans.items()}
+        if strategy == "minimal": strategy = min(plans, key=lambda k: (moved[k], end[k]))
+        place = plans[strategy]
+        if end[strategy] >= 1 << 32: raise ValueError("The rebuilt archive would not fit 32-bit offsets.")
+        fd = os.open(outp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            self._copy_out(fd, 0, first)        # header, TOC, name-table pointer: patched below
+            for off, old, new, key in sorted(pieces, key=lambda p: (p[3] in repl, place[p[3]])):
+                os.lseek(fd, place[key], os.SEEK_SET)    # skipped ranges stay holes (zeros)
+                if key not in repl:
+                    self._copy_out(fd, off, old); continue
+                with open(repl[key], "rb") as fp:
+                    for chunk in iter(lambda: fp.read(1 << 20), b""): os.write(fd, chunk)
+            os.ftruncate(fd, end[strategy])
+            table = bytearray(toc)
+            for off, old, new, key in pieces:
+                if key < 0: continue
+                struct.pack_into("<I", table, 8 * key + 4 * col, place[key] // mo)
+                struct.pack_into("<I", table, 8 * key + 4 * (1 - col), -(-new // ms))
+            _pwrite(fd, table, 12)
+            if names:
+                at, noff, nsize = names; where = place[-1]
+                _pwrite(fd, struct.pack("<II", where, nsize), at)
+                old_size = {e["index"]: e["size"] for e in found}
+                for i, p in repl.items():       # a record's length field follows the entry it describes
+                    rec = AFS_NAME_RECORD * i + AFS_NAME_RECORD - 4
+                    if rec + 4 <= nsize and _u32(self.read_range(noff + rec, 4), 0) == old_size[i]:
+                        _pwrite(fd, struct.pack("<I", os.path.getsize(p)), where + rec)
+        finally:
+            os.close(fd)
+        return {"path": outp, "strategy": strategy, "moved": moved[strategy],
+                "relocated": sum(1 for off, old, new, key in pieces if place[key] != off), "size": end[strategy]}
+
+# --------------------------- PVM/GVM archives ---------------------------
+_ARCHIVES = {b"PVMH": ("little", (b"GBIX", b"PVRT")), b"GVMH": ("big", (b"GBIX", b"GCIX", b"GVRT"))}
+
+class TextureArchive:
+    """Entry table of a PVM (PVMH) or GVM (GVMH) archive, parsed in place.
+
+        arc = TextureArchive.parse(buf, pos)       # None if it is not a valid archive
+        for e, view in arc: ...                    # view: memoryview of buf, no copy
+
+    Each entry is a dict like the AFS readers' entries: index, id, name, gbix, px,
+    tex, dims (whatever the header flags provide) plus offset/size of the texture
+    (its GBIX/GCIX chunk included) in buf and `data`, the offset of its PVRT/GVRT.  `end` is the end of the last texture.
+    The header holds flags (0x1 global indices, 0x2 dimensions, 0x4 formats,
+    0x8 names) and the entry count; GVM numbers are big-endian, chunk sizes are
+    little-endian in both."""
+    def __init__(self, buf, pos: int, magic: bytes, entries: list, end: int):
+        self.buf = buf; self.pos = pos; self.magic = magic
+        self.entries = entries; self.end = end
+
+    @classmethod
+    def parse(cls, buf, pos: int):
+        n = len(buf); magic = bytes(buf[pos:pos+4])
+        if magic not in _ARCHIVES or pos + 12 > n:
+            return None
+        order, chunks = _ARCHIVES[magic]
+        num = lambda o, k: int.from_bytes(buf[o:o+k], order)
+        flags, count = num(pos + 8, 2), num(pos + 10, 2)
+        width = 2 + (28 if flags & 0x8 else 0) + (2 if flags & 0x4 else 0) + (2 if flags & 0x2 else 0) + (4 if flags & 0x1 else 0)
+        first = pos + 8 + _u32(buf, pos + 4)
+        if not 1 <= count <= 0x4000 or not pos + 12 + count * width <= first <= n:
+            return None
+        entries = []; o = pos + 12; p = first
+        for i in range(count):
+            e = {"index": i, "id": num(o, 2)}; o += 2
+            if flags & 0x8:
+                e["name"] = bytes(buf[o:o+28]).split(b"\0", 1)[0].decode("ascii", "replace"); o += 28
+            if flags & 0x4:
+                e["px"], e["tex"] = buf[o], buf[o+1]; o += 2
+            if flags & 0x2:
+                e["dims"] = num(o, 2); o += 2
+            if flags & 0x1:
+                e["gbix"] = num(o, 4); o += 4
+            # textures follow each other, sometimes with zero padding in between
+            q = p
+            while q < min(n, p + 0x40) and bytes(buf[q:q+4]) not in chunks:
+                if buf[q]: return None
+                q += 1
+            start = q
+            if bytes(buf[q:q+4]) in (b"GBIX", b"GCIX"):
+                q += 8 + _u32(buf, q + 4)
+            if bytes(buf[q:q+4]) != chunks[-1] or q + 8 > n:
+                return None
+            end = q + 8 + _u32(buf, q + 4)
+            if end > n:
+                return None
+            e["offset"] = start; e["size"] = end - start; e["data"] = q
+            entries.append(e); p = end
+        return cls(buf, pos, magic, entries, p)
+
+    def view(self, entry: dict) -> memoryview:
+        return memoryview(self.buf)[entry["offset"]:entry["offset"] + entry["size"]]
+
+    def __iter__(self):
+        for e in self.entries:
+            yield e, self.view(e)
+
+    def __len__(self): return len(self.entries)
+
+    def file_name(self, entry: dict) -> str:
+        """<index>_<name>.pvr/.gvr, the name sanitized for the file system."""
+        name = re.sub(r"[^\w.-]+", "_", entry.get("name") or "").strip("_")
+        ext = "pvr" if self.magic == b"PVMH" else "gvr"
+        return f"{entry['index']:03d}_{name}.{ext}" if name else f"{entry['index']:03d}.{ext}"
+
+@extent_parser(b"PVMH", b"GVMH")
+def _archive_extent(buf, pos):
+    arc = TextureArchive.parse(buf, pos)
+    return (pos, arc.end) if arc is not None else None
+
+# --------------------------- region map ---------------------------
+# Sector kinds of a RegionMap.  PAD: all 0x00 or all 0xFF, nothing to find (any
+# stray byte keeps the sector live, so a header in front of blank pixels survives).
+# NOISE: near-uniform bytes (ADX audio, encrypted or random data); PRS output
+# carries control bytes and stays below NOISE_BITS, so no block starts there.
+REGION_PAD, REGION_DATA, REGION_NOISE = 0, 1, 2
+SECTOR = 0x800
+NOISE_BITS = 7.8
+_RMAP_MAGIC = b"RMAP\x01"
+_RMAP_HEAD = struct.Struct("<5sIQQI")     # magic, sector, size, mtime_ns, count
+_RMAP_ROWS = 512                          # sectors per vectorized block
+
+class RegionMap:
+    """Per-sector statistics of a buffer: kind (REGION_*) and byte entropy.
+
+        rm = RegionMap.build(buf)                    # one vectorized pre-pass
+        rm = RegionMap.for_file(path, "disc.rmap")   # reuse a saved map if still valid
+        HitTable(buf, regions=rm); rm.prs_plausible(off)
+
+    `entropy` holds bits/byte * 32 per sector.  A saved map is reused while the
+    file's size and mtime are unchanged."""
+    def __init__(self, kinds: bytes, entropy: bytes, size: int, sector: int = SECTOR):
+        self.kinds = bytes(kinds); self.entropy = bytes(entropy)
+        self.size = size; self.sector = sector
+
+    @classmethod
+    def build(cls, buf, sector: int = SECTOR, noise: float = NOISE_BITS):
+        size = len(buf); full = size // sector
+        kinds = bytearray(); ent = bytearray()
+        if np is not None and full:
+            arr = np.frombuffer(buf, dtype=np.uint8, count=full * sector).reshape(full, sector)
+            for r in range(0, full, _RMAP_ROWS):
+                blk = arr[r:r + _RMAP_ROWS]
+                lo = blk.min(axis=1); hi = blk.max(axis=1)
+                live = np.flatnonzero((lo != hi) | ((lo != 0) & (lo != 0xFF)))
+                k = np.full(len(blk), REGION_PAD, dtype=np.uint8); e = np.zeros(len(blk), dtype=np.uint8)
+                if len(live):   # byte histograms of the live rows only, one bincount
+                    rows = blk[live].astype(np.intp); rows += (np.arange(len(live)) * 256)[:, None]
+                    counts = np.bincount(rows.ravel(), minlength=len(live) * 256).reshape(-1, 256)
+                    p = counts / sector
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        h = -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1)
+                    k[live] = np.where(h >= noise, REGION_NOISE, REGION_DATA)
+                    e[live] = np.minimum(h * 32, 255).astype(np.uint8)
+                kinds += k.tobytes(); ent += e.tobytes()
+            del arr, blk
+            start = full * sector
+        else:
+            start = 0
+        for p in range(start, size, sector):      # no NumPy, or the partial last sector
+            k, h = cls._classify(buf[p:p + sector], noise)
+            kinds.append(k); ent.append(min(int(h * 32), 255))
+        return cls(kinds, ent, size, sector)
+
+    @staticmethod
+    def _classify(chunk, noise: float):
+        """(kind, bits/byte) of one sector."""
+        chunk = bytes(chunk); n = len(chunk)
+        if chunk.count(chunk[:1]) == n and chunk[:1] in (b"\x00", b"\xff"):
+            return REGION_PAD, 0.0
+        h = -sum(v / n * math.log2(v / n) for v in (chunk.count(bytes((c,))) for c in range(256)) if v)
+        return (REGION_NOISE if h >= noise else REGION_DATA), h
+
+    def kind_at(self, off: int) -> int:
+        return self.kinds[off // self.sector] if 0 <= off < self.size else REGION_PAD
+
+    def prs_plausible(self, off: int) -> bool:
+        """Whether a PRS block can start at `off` (its sector is neither padding nor noise)."""
+        return self.kind_at(off) == REGION_DATA
+
+    def live_ranges(self):
+        """[(start, end)] of the runs of non-padding sectors."""
+        out = []; sec = self.sector
+        for m in re.finditer(rb"[^\x00]+", self.kinds):
+            out.append((m.start() * sec, min(self.size, m.end() * sec)))
+        return out
+
+    def summary(self) -> dict:
+        return {"sectors": len(self.kinds), "pad": self.kinds.count(REGION_PAD),
+                "data": self.kinds.count(REGION_DATA), "noise": self.kinds.count(REGION_NOISE)}
+
+    # ---- artifact ----
+    def save(self, path, mtime_ns: int = 0):
+        with open(path, "wb") as fp:
+            fp.write(_RMAP_HEAD.pack(_RMAP_MAGIC, self.sector, self.size, mtime_ns, len(self.kinds)))
+            fp.write(self.kinds); fp.write(self.entropy)
+
+    @classmethod
+    def load(cls, path, size: int | None = None, mtime_ns: int | None = None):
+        """Map saved by save(), or None if missing, corrupt or stale for (size, mtime_ns)."""
+        try:
+            with open(path, "rb") as fp:
+                magic, sector, sz, mt, count = _RMAP_HEAD.unpack(fp.read(_RMAP_HEAD.size))
+                kinds = fp.read(count); ent = fp.read(count)
+        except (OSError, struct.error):
+            return None
+        if magic != _RMAP_MAGIC or len(kinds) != count or len(ent) != count:
+            return None
+        if (size is not None and sz != size) or (mtime_ns is not None and mt != mtime_ns):
+            return None
+        return cls(kinds, ent, sz, sector)
+
+    @classmethod
+    def for_file(cls, path, cache=None, data=None):
+        """Map of the file at `path`, loaded from `cache` when still valid, else built
+        (from `data` if given, else from a map of the file) and saved to `cache`."""
+        st = os.stat(path)
+        if cache:
+            rm = cls.load(cache, st.st_size, st.st_mtime_ns)
+            if rm is not None:
+                return rm
+        if data is not None:
+            rm = cls.build(data)
         else:
-            if getbit():
-                if i+2 > len(buf): break
-                a = buf[i]; b = buf[i+1]; i += 2
-                offs = ((b & 0xF0) << 4) | a
-                cnt  = (b & 0x0F) + 3
-                if offs == 0: break
-                src = len(out) - offs
-                if src < 0: return None, 0
-                for _ in range(cnt):
-                    out.append(out[src]); src += 1
-            else:
-                if i+3 > len(buf): break
-                a = buf[i]; b = buf[i+1]; c = buf[i+2]; i += 3
-                cnt  = ((c & 0xE0) >> 5) + 2
-                offs = ((c & 0x1F) << 8) | b
-                src = len(out) - offs
-                if src < 0: return None, 0
-                for _ in range(cnt):
-                    out.append(out[src]); src += 1
-    return bytes(out), i - start
-
-def _prs_try_all(buf: bytes, start: int):
-    for fn in (_prs_decompress_basic, _prs_decompress_nights):
-        dec, consumed = fn(buf, start)
-        if dec and len(dec) > 0:
-            return dec, consumed
-    return None, 0
+            with map_file(path) as data:
+                rm = cls.build(data)
+        if cache:
+            rm.save(cache, st.st_mtime_ns)
+        return rm
+
+# --------------------------- persistent scan cache ---------------------------
+_SAMPLES, _SAMPLE = 16, 64 << 10
+
+def content_hash(path, size: int | None = None) -> str:
+    """Fast fingerprint of a file's content: BLAKE2b-128 of its size and 16 evenly
+    spaced 64 KiB samples (the whole file when it is smaller than that)."""
+    size = os.path.getsize(path) if size is None else size
+    h = hashlib.blake2b(size.to_bytes(8, "little"), digest_size=16)
+    with open(path, "rb") as fp:
+        if size <= _SAMPLES * _SAMPLE:
+            h.update(fp.read())
+        else:
+            for k in range(_SAMPLES):
+                fp.seek((size - _SAMPLE) * k // (_SAMPLES - 1)); h.update(fp.read(_SAMPLE))
+    return h.hexdigest()
+
+class ScanCache:
+    """Results of earlier scans, reused while their container is unchanged.
+
+        cache = ScanCache()                               # default_root(), 1 GiB
+        hits = HitTable.for_file(path, cache=cache)       # hit table
+        value = cache.get(path, "deprs", params)          # any JSON value, or None
+        cache.put(path, "deprs", params, value)
+        cache.invalidate(path)                            # invalidate(): everything
+
+    One JSON file per (container, kind, params) under `root`, named by hashes of the
+    container's absolute path and of (kind, params).  An entry is only returned
+    while the container's fingerprint (size, mtime_ns, content_hash()) matches; a
+    stale one is deleted.  Least recently used entries are evicted once all of them
+    take more than `limit` bytes.  outputs()/intact() record and check the files a
+    cached run wrote, so a result is only reused while they are still there."""
+    SUFFIX = ".scan.json"
+
+    def __init__(self, root=None, limit: int = 1 << 30):
+        self.root = Path(root) if root else self.default_root(); self.limit = limit
+        self._prints = {}
+
+    @staticmethod
+    def default_root() -> Path:
+        """$TXR2_SCAN_CACHE, else ~/.cache/txr2_toolkit/scan."""
+        return Path(os.environ.get("TXR2_SCAN_CACHE") or Path.home() / ".cache" / "txr2_toolkit" / "scan")
+
+    def fingerprint(self, path) -> dict:
+        st = os.stat(path); key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if key not in self._prints:   # hashed once per process and file version
+            self._prints[key] = content_hash(path, st.st_size)
+        return {"path": key[0], "size": key[1], "mtime_ns": key[2], "hash": self._prints[key]}
+
+    @staticmethod
+    def _where(path) -> str:
+        return hashlib.blake2b(os.path.abspath(path).encode(), digest_size=8).hexdigest()
+
+    def entry_path(self, path, kind: str, params=None) -> Path:
+        what = hashlib.blake2b(json.dumps([kind, params], sort_keys=True).encode(), digest_size=8).hexdigest()
+        return self.root / f"{self._where(path)}-{what}{self.SUFFIX}"
+
+    def get(self, path, kind: str, params=None):
+        entry = self.entry_path(path, kind, params)
+        try:
+            with open(entry, encoding="utf-8") as fp:
+                rec = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if rec.get("fingerprint") != self.fingerprint(path):
+            entry.unlink(missing_ok=True); return None
+        os.utime(entry)   # recency for eviction
+        return rec["value"]
+
+    def put(self, path, kind: str, params, value) -> Path:
+        entry = self.entry_path(path, kind, params); self.root.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump({"fingerprint": self.fingerprint(path), "kind": kind, "params": params, "value": value},
+                      fp, separators=(",", ":"))
+        os.replace(tmp, entry)
+        self.evict()
+        return entry
+
+    def invalidate(self, path=None) -> int:
+        """Drop the entries of one container (every entry without `path`); -> count."""
+        pat = f"{self._where(path)}-*" if path else "*"
+        n = 0
+        for entry in self.root.glob(pat + self.SUFFIX):
+            entry.unlink(missing_ok=True); n += 1
+        return n
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the cache fits `limit`; -> count."""
+        entries = []
+        for entry in self.root.glob("*" + self.SUFFIX):
+            try: st = entry.stat()
+            except OSError: continue
+            entries.append((st.st_mtime_ns, st.st_size, entry))
+        total = sum(e[1] for e in entries); n = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.limit: break
+            entry.unlink(missing_ok=True); total -= size; n += 1
+        return n
+
+    @staticmethod
+    def outputs(*dirs) -> list:
+        """[[path, size]] of every file under `dirs`, to store with a cached result."""
+        return [[str(p), p.stat().st_size] for d in dirs if Path(d).is_dir()
+                for p in sorted(Path(d).rglob("*")) if p.is_file()]
+
+    @staticmethod
+    def intact(outputs) -> bool:
+        """True while every file of outputs() still exists with its size."""
+        try:
+            return all(os.path.getsize(p) == size for p, size in outputs)
+        except OSError:
+            return False
 
 # --------------------------- helpers ---------------------------
-def _next_tag(buf: bytes, start: int, tags: list[bytes]) -> int:
-    cand = [buf.find(t, start) for t in tags]
-    cand = [c for c in cand if c != -1]
-    return min(cand) if cand else len(buf)
-
-def _carve_range(buf: bytes, start: int, tags_next: list[bytes], hard_cap: int = 8*1024*1024):
-    nxt = _next_tag(buf, start+4, tags_next)
-    end = min(len(buf), max(start+16, nxt))  # at least some payload
+def _carve_range(hits: HitTable, start: int, tags_next: list[bytes], hard_cap: int = 8*1024*1024):
+    nxt = hits.next_tag(start+4, tags_next)
+    end = min(hits.size, max(start+16, nxt))  # at least some payload
     end = min(end, start + hard_cap)
     return start, end
 
-def _dump(out_dir: Path, stem: str, ext: str, start: int, end: int, data: bytes):
-    out = out_dir / f"{stem}_{start:08X}.{ext}"
-    out.write_bytes(data[start:end])
-    return out
+def _dump(out_dir: Path, stem: str, ext: str, start: int, end: int, data: bytes, store=None):
+    path = out_dir / f"{stem}_{start:08X}.{ext}"
+    return store.carve(path, data, start, end, stem) if store is not None else carve_to(path, data, start, end)
 
 # --------------------------- main scan ---------------------------
-def robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str, _depth: int = 0):
+def robust_scan_to_dir(in_bytes: bytes, out_dir: str, tag: str, origin: str, _depth: int = 0,
+                       _variants: PRSVariantCache | None = None, align=None,
+                       regions: RegionMap | None = None, strict: bool = True, store: AssetStore | None = None,
+                       hits: HitTable | None = None):
     """
     Scan one blob, carve known chunks, optionally recurse into PRS/PVM/GVM.
-    _depth avoids infinite recursion.
+    _depth avoids infinite recursion; _variants carries the PRS variant chosen
+    for this container into the nested layers.  `align` selects the aligned
+    scan mode (see HitTable); nested layers are scanned with the same alignment.
+    `regions` (a RegionMap of in_bytes) skips padding sectors and PRS hits in
+    padding/noise; it only applies to this layer.  With `strict` a PVRT hit is only
+    carved if pvrt_header() accepts it (its declared bytes), and formats
+    with an extent parser in EXTENTS (GBIX, GVRT, TIM2, PVR!, PVR\x03) are carved
+    to the extent it reads; rejected hits are counted as <ext>_suspect.  Other
+    formats are bounded by the next known header.  PVM/GVM archives are split by
+    their entry table (TextureArchive); only ones that do not parse are rescanned.
+    With `store` (an AssetStore) carved assets go to the content-addressed store
+    and its manifest instead of one file per hit; an AssetIndex only records them.
+    `hits` is a prebuilt HitTable of in_bytes (e.g. HitTable.for_file() on several
+    processes); extents are still read from in_bytes, across any scan partition.
     """
+    if _variants is None:
+        _variants = PRSVariantCache(SCANNER_VARIANTS)
     out = Path(out_dir); out.mkdir(parents=True, exist_ok=True)
     stem = f"{tag}_{origin}"
-    counts = {"pvr":0,"pvp":0,"gbix":0,"gvr":0,"pvm":0,"gvm":0,"tm2":0,"tm2f":0,"prs":0}
+    counts = {"pvr":0,"pvp":0,"gbix":0,"gvr":0,"pvm":0,"gvm":0,"tm2":0,"tm2f":0,"prs":0,
+              "prs_hits":0,"prs_probes":0,"prs_accepted":0,"prs_skipped":0,
+              "pvr_suspect":0,"gbix_suspect":0,"gvr_suspect":0,"tm2_suspect":0,"tm2f_suspect":0}
+
+    if hits is None:
+        hits = HitTable(in_bytes, align=align, regions=regions)
+    n = hits.size
+
+    def extent(sig, p, tags):
+        """(start, end) from the registered extent parser when strict, else the
+        next-header bound; None if the parser rejects the header."""
+        fn = EXTENTS.get(sig) if strict else None
+        return fn(in_bytes, p) if fn is not None else _carve_range(hits, p, tags)
 
     # ---- PVR family (PVRT/PVPL/GBIX + legacy PVR!, PVR\x03, PVR\x04) ----
     pvr_like = [(b"PVRT","pvr"), (b"PVPL","pvp")]
     legacy_pvr = [b"PVR!", b"PVR\x03", b"PVR\x04"]
     for sig, ext in pvr_like:
-        i = 0
-        while True:
-            p = in_bytes.find(sig, i)
-            if p == -1: break
+        for p in hits.offsets(sig):
+            if strict and sig in EXTENTS:
+                r = EXTENTS[sig](in_bytes, p)
+                if r is None:
+                    counts["pvr_suspect"] += 1
+                else:
+                    _dump(out, stem, ext, *r, in_bytes, store); counts[ext]+=1
+                continue
             end = p + 8
-            if end <= len(in_bytes):
+            if end <= n:
                 size = int.from_bytes(in_bytes[p+4:end], "little") + 8
-                if 0x10 <= size <= len(in_bytes) - p:
-                    _dump(out, stem, ext, p, p+size, in_bytes); counts[ext]+=1
+                if 0x10 <= size <= n - p:
+                    _dump(out, stem, ext, p, p+size, in_bytes, store); counts[ext]+=1
                 else:
-                    s,e = _carve_range(in_bytes, p, [b"PVRT",b"PVPL",b"GBIX",b"GVR",b"PVMH",b"GVMH"])
-                    _dump(out, stem, ext, s, e, in_bytes); counts[ext]+=1
-            i = p + 4
+                    s,e = _carve_range(hits, p, [b"PVRT",b"PVPL",b"GBIX",b"GVR",b"PVMH",b"GVMH"])
+                    _dump(out, stem, ext, s, e, in_bytes, store); counts[ext]+=1
     # GBIX metadata
-    i = 0
-    while True:
-        p = in_bytes.find(b"GBIX", i)
-        if p == -1: break
-        if p+8 <= len(in_bytes):
+    for p in hits.offsets(b"GBIX"):
+        if strict:
+            r = _gbix_extent(in_bytes, p)
+            if r is None: counts["gbix_suspect"] += 1
+            else: _dump(out, stem, "gbix", *r, in_bytes, store); counts["gbix"]+=1
+        elif p+8 <= n:
             size = int.from_bytes(in_bytes[p+4:p+8], "little")
-            end = min(len(in_bytes), p+8+max(0,size))
-            _dump(out, stem, "gbix", p, end, in_bytes); counts["gbix"]+=1
+            end = min(n, p+8+max(0,size))
+            _dump(out, stem, "gbix", p, end, in_bytes, store); counts["gbix"]+=1
         else:
-            s,e = _carve_range(in_bytes, p, [b"PVRT",b"PVPL",b"GBIX",b"GVR"])
-            _dump(out, stem, "gbix", s, e, in_bytes); counts["gbix"]+=1
-        i = p + 4
-    # Legacy PVR* headers (carve best-effort)
+            s,e = _carve_range(hits, p, [b"PVRT",b"PVPL",b"GBIX",b"GVR"])
+            _dump(out, stem, "gbix", s, e, in_bytes, store); counts["gbix"]+=1
+    # Legacy PVR* headers (exact for PVR!/PVR\x03, best-effort otherwise)
     for legacy in legacy_pvr:
-        i = 0
-        while True:
-            p = in_bytes.find(legacy, i)
-            if p == -1: break
-            s,e = _carve_range(in_bytes, p, [b"PVRT",b"PVPL",b"GBIX",b"GVR",b"PVMH",b"GVMH",legacy])
-            _dump(out, stem, "pvr", s, e, in_bytes); counts["pvr"]+=1
-            i = p + 4
+        for p in hits.offsets(legacy):
+            r = extent(legacy, p, [b"PVRT",b"PVPL",b"GBIX",b"GVR",b"PVMH",b"GVMH",legacy])
+            if r is None:
+                counts["pvr_suspect"] += 1; continue
+            _dump(out, stem, "pvr", *r, in_bytes, store); counts["pvr"]+=1
 
     # ---- TIM2 / TM2F ----
     for sig, ext in ((b"TIM2","tm2"), (b"TM2F","tm2f")):
-        i = 0
-        while True:
-            p = in_bytes.find(sig, i)
-            if p == -1: break
-            s,e = _carve_range(in_bytes, p, [b"TIM2", b"TM2F", b"PVRT", b"GVR", b"PVMH", b"GVMH"])
-            _dump(out, stem, ext, s, e, in_bytes); counts[ext]+=1
-            i = p + 4
+        for p in hits.offsets(sig):
+            r = extent(sig, p, [b"TIM2", b"TM2F", b"PVRT", b"GVR", b"PVMH", b"GVMH"])
+            if r is None:
+                counts[f"{ext}_suspect"] += 1; continue
+            _dump(out, stem, ext, *r, in_bytes, store); counts[ext]+=1
 
     # ---- PVM/GVM containers + direct GVR ----
     for sig, ext in ((b"PVMH","pvm"), (b"GVMH","gvm")):
-        i = 0
-        while True:
-            p = in_bytes.find(sig, i)
-            if p == -1: break
-            s,e = _carve_range(in_bytes, p, [b"PVMH", b"GVMH", b"PVRT", b"GVR"])
-            blob = _dump(out, stem, ext, s, e, in_bytes); counts[ext]+=1
+        for p in hits.offsets(sig):
+            arc = TextureArchive.parse(in_bytes, p) if strict else None
+            if arc is not None:
+                # entry table: one file per texture under its original name, no rescan
+                _dump(out, stem, ext, p, arc.end, in_bytes, store); counts[ext]+=1
+                sub = out / f"{stem}_{p:08X}_EXT"
+                if store is None: sub.mkdir(exist_ok=True)
+                for e in arc.entries:
+                    if store is not None:
+                        store.carve(sub / arc.file_name(e), in_bytes, e["offset"], e["offset"] + e["size"], f"{stem}_{ext}")
+                    else:
+                        carve_to(sub / arc.file_name(e), in_bytes, e["offset"], e["offset"] + e["size"])
+                    counts["pvr" if ext == "pvm" else "gvr"] += 1
+                continue
+            s,e = _carve_range(hits, p, [b"PVMH", b"GVMH", b"PVRT", b"GVR"])
+            _dump(out, stem, ext, s, e, in_bytes, store); counts[ext]+=1
             # Recurse into container payload to pick inner PVRT/GVR
             if _depth < 2:
-                sub = robust_scan_to_dir(in_bytes[s:e], str(out / f"{blob.stem}_EXT"), tag=f"{tag}", origin=f"{origin}_{ext}", _depth=_depth+1)
+                with memoryview(in_bytes) as view:   # zero-copy window onto the payload
+                    sub = robust_scan_to_dir(view[s:e], str(out / f"{stem}_{s:08X}_EXT"), tag=f"{tag}", origin=f"{origin}_{ext}", _depth=_depth+1, _variants=_variants, align=align, strict=strict,
+                                             store=store.layer(getattr(in_bytes, "path", None), s) if store is not None else None)
                 for k,v in sub.items(): counts[k] = counts.get(k,0)+v
-            i = p + 4
-
-    # Direct GVR/GVRT (CRI texture lumps, sometimes preceded by GBIX)
-    for mark in (b"GVR", b"GVRT"):
-        i = 0
-        while True:
-            p = in_bytes.find(mark, i)
-            if p == -1: break
-            # try to include preceding GBIX if within 64 bytes
-            gb = in_bytes.rfind(b"GBIX", max(0,p-64), p)
-            start = gb if gb != -1 else p
-            s,e = _carve_range(in_bytes, start, [b"GVR", b"GVRT", b"GBIX", b"PVRT", b"PVMH", b"GVMH"])
-            _dump(out, stem, "gvr", s, e, in_bytes); counts["gvr"]+=1
-            i = p + 3
+
+    # Direct GVR/GVRT (CRI texture lumps, sometimes preceded by GBIX); GVR hits include GVRT
+    for p in hits.offsets(b"GVR"):
+        # try to include preceding GBIX if within 64 bytes (strict: only if it ends right here)
+        gb = hits.prev_tag(max(0,p-64), p-3, b"GBIX")
+        if strict and gb != -1:
+            r = _gbix_extent(in_bytes, gb)
+            if r is None or r[1] != p: gb = -1
+        start = gb if gb != -1 else p
+        r = extent(b"GVR", p, [b"GVR", b"GVRT", b"GBIX", b"PVRT", b"PVMH", b"GVMH"])
+        if r is None:
+            counts["gvr_suspect"] += 1; continue
+        _dump(out, stem, "gvr", start, r[1], in_bytes, store); counts["gvr"]+=1
 
     # ---- PRS blocks → decompress and recurse ----
     prs_dir = out / "PRS_EXTRACT"
-    i = 0; idx = 0
-    while True:
-        p = in_bytes.find(b"PRS", i)
-        if p == -1: break
-        dec, consumed = _prs_try_all(in_bytes, p)
-        if dec and len(dec) > 0:
-            prs_dir.mkdir(parents=True, exist_ok=True)
-            blob_path = prs_dir / f"{stem}_prs_{idx:03d}.bin"
-            blob_path.write_bytes(dec)
+    i = 0; idx = 0; made_dir = False
+    for p in hits.offsets(b"PRS"):
+        if p < i: continue
+        counts["prs_hits"] += 1
+        if regions is not None and not regions.prs_plausible(p):
+            counts["prs_skipped"] += 1; continue
+        if not prs_dir.is_dir():
+            prs_dir.mkdir(parents=True); made_dir = True
+        blob_path = prs_dir / f"{stem}_prs_{idx:03d}.bin"
+        size, consumed = _variants.decode_to(in_bytes, p, blob_path, counts)
+        if size:
             counts["prs"] += 1; idx += 1
+            if getattr(in_bytes, "path", None):     # lets a reimport recompress the block in place
+                prs_note_source(blob_path, in_bytes.path, p, *_variants.choice)
             # recurse into decompressed payload
             if _depth < 3:
-                sub = robust_scan_to_dir(dec, str(prs_dir / f"{blob_path.stem}_EXT"), tag=f"{tag}_prs{idx-1}", origin=origin, _depth=_depth+1)
+                with map_file(blob_path) as dec:
+                    sub = robust_scan_to_dir(dec, str(prs_dir / f"{blob_path.stem}_EXT"), tag=f"{tag}_prs{idx-1}", origin=origin, _depth=_depth+1, _variants=_variants, align=align, strict=strict, store=store)
                 for k,v in sub.items(): counts[k] = counts.get(k,0)+v
-            i = p + max(consumed, 3)
-        else:
-            i = p + 3
+            i = p + max(consumed, 3)   # hits inside the decoded block are part of it
+    if made_dir and idx == 0:
+        prs_dir.rmdir()   # only false hits: nothing was written
 
     return counts
+
+def scan_file_to_dir(path: str, out_dir: str, tag: str, origin: str, align=None, regions=None, store=None,
+                     workers: int = 1):
+    """robust_scan_to_dir() over a memory-mapped file instead of its bytes.
+    regions: None (scan everything), True (build a RegionMap first) or the path
+    of a .rmap cache to reuse/refresh; store: an AssetStore to dedup into;
+    workers > 1 finds the signatures with HitTable.for_file() (partitioned)."""
+    with map_file(path) as data:
+        rm = None
+        if regions:
+            rm = RegionMap.for_file(path, None if regions is True else regions, data)
+        hits = HitTable.for_file(path, align=align, regions=rm, workers=workers) if workers > 1 else None
+        return robust_scan_to_dir(data, out_dir, tag, origin, align=align, regions=rm, store=store, hits=hits)
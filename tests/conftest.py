@@ -0,0 +1,4 @@
+# The toolkit is a flat set of modules: make them importable from the tests.
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,87 @@
+import random
+
+from prs import prs_compress
+import gui_app
+
+
+def _pvrt(w: int = 8, h: int = 8, seed: int = 0) -> bytes:
+    """A 565 twiddled PVRT texture with a 16-byte GBIX chunk in front."""
+    data = random.Random(seed).randbytes(w * h * 2)
+    return (b"GBIX" + (8).to_bytes(4, "little") + bytes(8) + b"PVRT" + (8 + len(data)).to_bytes(4, "little")
+            + bytes((1, 1, 0, 0)) + w.to_bytes(2, "little") + h.to_bytes(2, "little") + data)
+
+
+def test_prs_first_pvr_reads_texture_lazily():
+    tex = _pvrt()
+    for variant, bitrev in (("nights_ext", True), ("nights_ext", False), ("basic", False)):
+        for lead in (0, 0x1FFF5, 0x30000):      # in the first window, across a window edge, later
+            out = bytes(lead) + tex + random.Random(1).randbytes(0x4000)
+            block = prs_compress(out, variant, 3, bitrev=bitrev)
+            assert gui_app._prs_first_pvr(block, 0, 0x10000) == (tex, lead)
+
+
+def test_prs_first_pvr_without_texture():
+    assert gui_app._prs_first_pvr(prs_compress(bytes(0x5000), "nights_ext")) is None
+
+
+def _tree(root):
+    import hashlib, pathlib
+    root = pathlib.Path(root)
+    return {str(p.relative_to(root)): hashlib.md5(p.read_bytes()).hexdigest()
+            for p in sorted(root.rglob("*")) if p.is_file()}
+
+
+def test_deprs_serial_and_pool_outputs_match(tmp_path):
+    # top-level blocks alternate bit orders; the last one is all literals behind
+    # bit-symmetric flag bytes (0xFF, then 0x42 before the end marker), so both
+    # orders decode it, to different bytes, and only a per-block variant cache
+    # picks the same order on -j1 and -jN
+    disc = bytearray(b"\x00" * 64)
+    for k in range(4):
+        raw = random.Random(10 + k).randbytes(300) + _pvrt(8, 8, k) + bytes(200)
+        disc += prs_compress(raw, "nights_ext", 3, bitrev=k % 2 == 1) + b"\x55" * 40
+    lit = random.Random(5).randbytes(512)
+    disc += b"PRS" + b"".join(b"\xff" + lit[i:i + 8] for i in range(0, 512, 8)) + b"\x42\0\0" + b"\x55" * 40
+    src = tmp_path / "disc.bin"; src.write_bytes(bytes(disc))
+    one = gui_app.full_deprs_and_scan(str(src), str(tmp_path / "j1"), workers=1)
+    many = gui_app.full_deprs_and_scan(str(src), str(tmp_path / "j2"), workers=2)
+    for k in ("prs_hits", "leaf_pvr", "leaf_pvp", "total_pvrpvp"):
+        assert one[k] == many[k]
+    assert one["leaf_pvr"] == 4
+    assert _tree(tmp_path / "j1") == _tree(tmp_path / "j2")
+
+
+def test_deprs_cli_script_matches_imported_main(tmp_path):
+    import subprocess, sys, pathlib
+    disc = bytes(0x50) + _pvrt(8, 8, 1)[16:] + bytes(64) + prs_compress(_pvrt(8, 8, 2) + bytes(300), "nights_ext", 3)
+    src = tmp_path / "disc.bin"; src.write_bytes(disc)
+    script = pathlib.Path(gui_app.__file__)
+
+    def names(out):
+        return sorted(str(p.relative_to(out)) for p in out.rglob("*") if p.is_file())
+    gui_app.main(["--deprs", str(src), "-o", str(tmp_path / "imported")])
+    expected = names(tmp_path / "imported")
+    assert any(n.endswith("disc_base_pvrt_00000050.pvr") for n in expected)
+    for j in ("1", "2"):
+        out = tmp_path / f"script_j{j}"
+        subprocess.run([sys.executable, str(script), "--deprs", str(src), "-o", str(out), "-j", j],
+                       check=True, cwd=script.parent, capture_output=True)
+        assert names(out) == expected
+
+
+def test_afs_extract_all_counts_written_entries(tmp_path):
+    blobs = [_pvrt(8, 8, k)[16:] for k in range(3)] + [b"\x11" * 64, b"", b"\x22" * 64]
+    head = 12 + 8 * len(blobs); data = bytearray(b"AFS\0" + len(blobs).to_bytes(4, "little") + bytes(4))
+    offs = []; pos = (head + 0x7FF) & ~0x7FF
+    for b in blobs:
+        offs.append(pos if b else 0); pos = (pos + len(b) + 0x7FF) & ~0x7FF
+    for o, b in zip(offs, blobs):
+        data += len(b).to_bytes(4, "little") + o.to_bytes(4, "little")     # (size, offset) pairs
+    data += bytes(pos - len(data))
+    for o, b in zip(offs, blobs):
+        data[o:o + len(b)] = b
+    (tmp_path / "a.afs").write_bytes(bytes(data))
+    with gui_app.AFSArchive(tmp_path / "a.afs") as afs:
+        assert afs.extract_all(tmp_path / "pvr", kinds=["pvrt"]) == 3
+        assert afs.extract_all(tmp_path / "all") == 5
+    assert len(list((tmp_path / "pvr").iterdir())) == 3
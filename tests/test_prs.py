@@ -0,0 +1,79 @@
+import random
+
+from prs import PRSVariantCache, AUTO_VARIANTS, prs_compress
+
+
+def _payload(seed: int, n: int = 3000) -> bytes:
+    rnd = random.Random(seed); words = [rnd.randbytes(rnd.randrange(3, 12)) for _ in range(40)]
+    return b"".join(rnd.choice(words) for _ in range(n // 7))[:n]
+
+
+def _mixed():
+    """Bit-reversed, plain, then bit-reversed nights_ext blocks in one buffer."""
+    plain = [_payload(k) for k in range(3)]
+    buf = bytearray(b"\xAA" * 64); offs = []
+    for k, data in enumerate(plain):
+        offs.append(len(buf)); buf += prs_compress(data, "nights_ext", 6, bitrev=k != 1) + b"\x55" * 37
+    return bytes(buf), offs, plain
+
+
+def test_variant_cache_falls_back_to_other_bit_order():
+    buf, offs, plain = _mixed()
+    for strict in (True, False):
+        cache = PRSVariantCache(AUTO_VARIANTS, strict=strict)
+        for off, data in zip(offs, plain):
+            out, used = cache.decode(buf, off)
+            assert out is not None and out[:len(data)] == data
+        assert cache.choice == ("nights_ext", True)
+
+
+def test_variant_cache_decode_to_falls_back(tmp_path):
+    buf, offs, plain = _mixed()
+    cache = PRSVariantCache(AUTO_VARIANTS)
+    for k, (off, data) in enumerate(zip(offs, plain)):
+        path = tmp_path / f"{k}.bin"
+        written, used = cache.decode_to(buf, off, path)
+        assert written == len(data) and path.read_bytes() == data
+
+
+def test_variant_cache_tries_choice_first():
+    cache = PRSVariantCache(AUTO_VARIANTS)
+    assert cache.order() == AUTO_VARIANTS
+    cache.choice = AUTO_VARIANTS[1]
+    assert cache.order() == (AUTO_VARIANTS[1], AUTO_VARIANTS[0])
+
+
+def test_reimport_into_recompresses_nested_blocks(tmp_path):
+    from prs import prs_decode_block, prs_note_source, prs_reimport_into
+    inner_raw = _payload(7, 6000)
+    inner = prs_compress(inner_raw, "basic", 2)
+    head = _payload(8, 500); outer_raw = head + inner + _payload(9, 500)
+    outer = prs_compress(outer_raw, "nights_ext", 2, bitrev=True)
+    disc = tmp_path / "disc.bin"; disc.write_bytes(b"\xEE" * 100 + outer + b"\xEE" * 50)
+    # what the dePRS walk leaves behind: decoded blocks with their source notes
+    d0 = tmp_path / "d0.bin"; d0.write_bytes(outer_raw); prs_note_source(d0, disc, 100, "nights_ext", True)
+    d1 = tmp_path / "d1.bin"; d1.write_bytes(inner_raw); prs_note_source(d1, d0, len(head), "basic")
+    patch = b"PATCHED!" * 4
+    assert prs_reimport_into(d1, 1000, patch) == [str(d1), str(d0.resolve()), str(disc.resolve())]
+    want = inner_raw[:1000] + patch + inner_raw[1000 + len(patch):]
+    assert d1.read_bytes() == want
+    data = disc.read_bytes()
+    assert data[:100] == b"\xEE" * 100 and data[-50:] == b"\xEE" * 50 and len(data) == 150 + len(outer)
+    out, _ = prs_decode_block(data, 100, "nights_ext", bitrev=True)
+    assert out == d0.read_bytes()
+    assert prs_decode_block(out, len(head), "basic")[0] == want
+
+
+def test_reimport_into_plain_file_and_too_large(tmp_path):
+    from prs import prs_note_source, prs_reimport_into
+    plain = tmp_path / "c.bin"; plain.write_bytes(bytes(64))
+    assert prs_reimport_into(plain, 8, b"abc") == [str(plain)]
+    assert plain.read_bytes() == bytes(8) + b"abc" + bytes(53)
+    raw = bytes(4000); disc = tmp_path / "disc.bin"; disc.write_bytes(prs_compress(raw, "basic"))
+    d0 = tmp_path / "d0.bin"; d0.write_bytes(raw); prs_note_source(d0, disc, 0, "basic")
+    before = disc.read_bytes()
+    try:
+        prs_reimport_into(d0, 0, random.Random(3).randbytes(3000)); assert False
+    except ValueError:
+        pass
+    assert disc.read_bytes() == before and d0.read_bytes() == raw     # nothing written
@@ -0,0 +1,79 @@
+import random
+
+import pypvr
+from scanners import pvrt_data_size, pvrt_header
+
+
+def _pvrt(px: int, tex: int, w: int, size: int) -> bytes:
+    """A PVRT chunk with `size` in its size field, filled with noise."""
+    return (b"PVRT" + size.to_bytes(4, "little") + bytes((px, tex, 0, 0)) + w.to_bytes(2, "little")
+            + w.to_bytes(2, "little") + random.Random(w).randbytes(size - 8))
+
+
+def test_rectangle_mipmaps_use_the_twiddled_chain():
+    for px in (0, 1, 2, 3):                     # 1555, 565, 4444, yuv422
+        for w, declared in ((8, 180), (32, 2740), (64, 10932), (256, 174772)):
+            assert pvrt_data_size(px, 10, w, w) + 8 == declared
+            assert pvrt_data_size(px, 10, w, w) == pvrt_data_size(px, 2, w, w)
+            assert pvrt_header(_pvrt(px, 10, w, declared), 0) is not None
+    assert pvrt_data_size(1, 12, 32, 32) is None        # "st mm" stays reserved
+
+
+def test_scandir_carves_what_the_size_checks_accept(tmp_path):
+    # a "re mm" texture and a twiddled one with writer padding beyond CHUNK_SLACK
+    padded = _pvrt(1, 1, 8, 8 + 128 + 0x40)
+    src = tmp_path / "in"; src.mkdir()
+    (src / "tex.bin").write_bytes(bytes(32) + _pvrt(1, 10, 32, 2740) + bytes(16) + padded + bytes(16))
+    pypvr.Pypvr.Decode(args_str=f'-scandir "{src}" -o "{tmp_path / "out"}" -fmt png -nolog')
+    carved = sorted((tmp_path / "out").rglob("*.pvr"))
+    assert [p.stat().st_size for p in carved] == [8 + 2740, 8 + 8 + 128 + 0x40]
+
+
+def test_padded_size_field_carves_the_same_everywhere(tmp_path):
+    import gui_app
+    from scanners import robust_scan_to_dir
+    padded = _pvrt(1, 1, 8, 8 + 128 + 0x40)
+    disc = bytes(0x50) + padded + bytes(0x40)
+    assert pvrt_header(disc, 0x50)[4] == 0x50 + len(padded)
+    src = tmp_path / "in"; src.mkdir(); (src / "disc.bin").write_bytes(disc)
+    pypvr.Pypvr.Decode(args_str=f'-scandir "{src}" -o "{tmp_path / "pypvr"}" -fmt png -nolog')
+    robust_scan_to_dir(disc, str(tmp_path / "robust"), "disc", "base")
+    gui_app.full_deprs_and_scan(str(src / "disc.bin"), str(tmp_path / "deprs"))
+    for out in ("pypvr", "robust", "deprs"):     # dePRS scans an input without PRS twice (base and raw leaf)
+        assert {p.read_bytes() for p in (tmp_path / out).rglob("*.pvr")} == {padded}, out
+    # padding past CHUNK_SLACK stops at the next header; a size field below the layout is still rejected
+    gbix = b"GBIX" + (8).to_bytes(4, "little") + bytes(8)
+    assert pvrt_header(padded[:0xA0] + gbix + padded[0xB0:], 0)[4] == 0xA0
+    assert pvrt_header(_pvrt(1, 1, 8, 8 + 120), 0) is None
+
+
+def test_parallel_scandir_stores_cache_entries(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("TXR2_SCAN_CACHE", str(tmp_path / "cache"))
+    src = tmp_path / "in"; src.mkdir()
+    for k in range(3):
+        (src / f"c{k}.bin").write_bytes(bytes(16 * k) + _pvrt(1, 10, 8, 180) + bytes(16))
+    args = f'-scandir "{src}" -o "{tmp_path / "out"}" -fmt png -cache'
+    pypvr.Pypvr.Decode(args_str=args + ' -j 2')
+    log = (tmp_path / "out" / "in_ext" / "pvr_log.txt").read_text()
+    assert len(list((tmp_path / "cache").glob("*.scan.json"))) >= 3
+    capsys.readouterr()
+    pypvr.Pypvr.Decode(args_str=args)
+    assert capsys.readouterr().out.count("Cached ") == 3
+    assert (tmp_path / "out" / "in_ext" / "pvr_log.txt").read_text() == log
+
+
+def test_scan_closes_the_map_when_decoding_fails(tmp_path, monkeypatch):
+    import mmap
+    maps = []
+
+    class Map(mmap.mmap):
+        def __init__(self, *args, **kw):
+            maps.append(self)
+
+    def fail(*args, **kw):
+        raise RuntimeError("bad texture")
+    monkeypatch.setattr(mmap, "mmap", Map)
+    monkeypatch.setattr(pypvr.Pypvr.Decode, "load_pvr", fail)
+    (tmp_path / "c.bin").write_bytes(bytes(16) + _pvrt(1, 10, 8, 180) + bytes(16))
+    pypvr.Pypvr.Decode(args_str=f'"{tmp_path / "c.bin"}" -o "{tmp_path / "out"}" -nolog')
+    assert len(maps) == 1 and maps[0].closed